@@ -1,3 +1,5 @@
+import hashlib
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -6,6 +8,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.config import settings
 from app.database import get_users_collection, get_admins_collection, get_agents_collection
+from app.revocation import revocation_list
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -25,7 +28,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
@@ -36,6 +39,45 @@ def decode_token(token: str):
     except JWTError:
         return None
 
+def password_fingerprint(hashed_password: str) -> str:
+    """Short digest of the stored hash; changes whenever the password does"""
+    return hashlib.sha256(hashed_password.encode()).hexdigest()[:16]
+
+def create_email_verification_token(email: str) -> str:
+    expire = datetime.utcnow() + timedelta(hours=settings.VERIFICATION_TOKEN_EXPIRE_HOURS)
+    return jwt.encode(
+        {"sub": email, "type": "email_verification", "exp": expire},
+        settings.SECRET_KEY, algorithm=settings.ALGORITHM
+    )
+
+def create_password_reset_token(email: str, hashed_password: str) -> str:
+    # Bound to the current password hash, so the token is void once used
+    expire = datetime.utcnow() + timedelta(minutes=settings.RESET_TOKEN_EXPIRE_MINUTES)
+    return jwt.encode(
+        {"sub": email, "type": "password_reset", "pwd": password_fingerprint(hashed_password), "exp": expire},
+        settings.SECRET_KEY, algorithm=settings.ALGORITHM
+    )
+
+def decode_purpose_token(token: str, purpose: str):
+    """Decode a self-contained email token; None if invalid, expired or for another purpose"""
+    payload = decode_token(token)
+    if payload is None or payload.get("type") != purpose or not payload.get("sub"):
+        return None
+    return payload
+
+async def decode_active_token(token: str):
+    """Decode a token and reject it if it has been revoked"""
+    payload = decode_token(token)
+    if payload is None or await revocation_list.is_revoked(payload.get("jti")):
+        return None
+    return payload
+
+async def revoke_token(credentials: HTTPAuthorizationCredentials):
+    """Revoke the bearer token of the current request (logout)"""
+    payload = decode_token(credentials.credentials)
+    if payload:
+        await revocation_list.revoke(payload)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -44,7 +86,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     )
     
     token = credentials.credentials
-    payload = decode_token(token)
+    payload = await decode_active_token(token)
     
     if payload is None:
         raise credentials_exception
@@ -72,7 +114,7 @@ async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(
     )
     
     token = credentials.credentials
-    payload = decode_token(token)
+    payload = await decode_active_token(token)
     
     if payload is None:
         raise credentials_exception
@@ -99,7 +141,7 @@ async def get_current_agent(credentials: HTTPAuthorizationCredentials = Depends(
     )
     
     token = credentials.credentials
-    payload = decode_token(token)
+    payload = await decode_active_token(token)
     
     if payload is None:
         raise credentials_exception
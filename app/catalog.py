@@ -0,0 +1,277 @@
+"""
+Product catalog and delivery fee settings snapshot
+
+GET /api/products, /api/categories and every price quote read the same
+small set of documents. They are served from a snapshot: one buffer that
+holds the pre-rendered JSON bodies (all available products, one body per
+category, the category list) and the fee settings, behind a small index.
+Responses are memoryview slices of the buffer, sent without copying.
+
+Without CATALOG_SNAPSHOT_DIR each worker builds its own snapshot in memory.
+With it, the workers of a host share one memory-mapped file:
+
+- a worker that changes the catalog or settings rebuilds the snapshot and
+  publishes it (write to a temporary file, then os.replace);
+- when the snapshot is older than CATALOG_CACHE_TTL_SECONDS, the one
+  worker that wins a non-blocking file lock rebuilds it;
+- every worker stats the file at most every CATALOG_SNAPSHOT_CHECK_SECONDS
+  and maps the new version. Requests still holding the old version keep
+  their mapping until they finish.
+
+The file lives best on tmpfs (/dev/shm), where the mapping is the page
+cache itself: one copy of the catalog per host instead of one per worker.
+Stock flags can lag by up to the TTL, or CATALOG_STOCK_REFRESH_SECONDS
+after this worker's own orders changed stock (see mark_stock_changed);
+order creation still checks stock against the database.
+"""
+
+import asyncio
+import fcntl
+import json
+import mmap
+import os
+import struct
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.config import settings
+from app.database import get_products_collection, get_delivery_settings_collection
+
+MAGIC = b"VGCAT001"
+HEADER = struct.Struct("<8sI")  # magic, index length
+SNAPSHOT_FILE = "catalog.snapshot"
+
+def serialize_product(product: dict) -> dict:
+    """API representation of a product document (string id, in_stock flag)"""
+    product["id"] = str(product["_id"])
+    product.pop("_id")
+
+    # Add stock status
+    if product["unitType"] == "Kg":
+        product["in_stock"] = product.get("stockKg", 0) > 0
+    elif product["unitType"] == "Piece":
+        product["in_stock"] = product.get("stockPieces", 0) > 0
+    else:  # Both
+        product["in_stock"] = (product.get("stockKg", 0) > 0 or
+                              product.get("stockPieces", 0) > 0)
+
+    return product
+
+def _render(content) -> bytes:
+    return JSONResponse(content).body
+
+async def build_sections() -> Tuple[float, Dict[str, bytes]]:
+    """Read the catalog and settings; returns (read_at, {section: body})"""
+    read_at = time.time()
+    products_collection = get_products_collection()
+    products, categories, settings_doc = await asyncio.gather(
+        products_collection.find({"isAvailable": True}).to_list(1000),
+        products_collection.distinct("category"),
+        get_delivery_settings_collection().find_one({}, sort=[("updated_at", -1)])
+    )
+
+    if settings_doc:
+        fee_settings = {
+            "base_fee": settings_doc["base_delivery_fee"],
+            "per_km": settings_doc["price_per_km"],
+            "per_meter": settings_doc["price_per_meter"]
+        }
+    else:
+        fee_settings = {
+            "base_fee": settings.BASE_DELIVERY_FEE,
+            "per_km": settings.PRICE_PER_KM,
+            "per_meter": settings.PRICE_PER_METER
+        }
+
+    products = jsonable_encoder([serialize_product(product) for product in products])
+    by_category = defaultdict(list)
+    for product in products:
+        by_category[product.get("category")].append(product)
+
+    sections = {
+        "products": _render(products),
+        "categories": _render({"categories": categories}),
+        "fee_settings": _render(fee_settings)
+    }
+    for category, category_products in by_category.items():
+        sections[f"category:{category}"] = _render(category_products)
+    return read_at, sections
+
+def pack(version: int, read_at: float, sections: Dict[str, bytes]) -> bytes:
+    offsets, offset = {}, 0
+    for name, body in sections.items():
+        offsets[name] = [offset, len(body)]
+        offset += len(body)
+    index = json.dumps({"version": version, "read_at": read_at, "sections": offsets}).encode()
+    return b"".join([HEADER.pack(MAGIC, len(index)), index, *sections.values()])
+
+class CatalogSnapshot:
+    """Read-only view over a packed snapshot (bytes or a memory map)"""
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        magic, index_length = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("Not a catalog snapshot")
+        index = json.loads(bytes(view[HEADER.size:HEADER.size + index_length]))
+        base = HEADER.size + index_length
+
+        self.version: int = index["version"]
+        self.read_at: float = index["read_at"]
+        self._sections = {
+            name: view[base + offset:base + offset + length]
+            for name, (offset, length) in index["sections"].items()
+        }
+        self.fee_settings: dict = json.loads(bytes(self._sections["fee_settings"]))
+
+    def products(self) -> memoryview:
+        return self._sections["products"]
+
+    def category(self, category: str):
+        return self._sections.get(f"category:{category}", b"[]")
+
+    def categories(self) -> memoryview:
+        return self._sections["categories"]
+
+class SnapshotResponse(Response):
+    """JSON response whose body is a slice of the snapshot, sent as is"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return content
+
+class CatalogCache:
+    def __init__(self, ttl_seconds: int, snapshot_dir: str = "", check_seconds: float = 1.0,
+                 stock_refresh_seconds: float = 2):
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_dir = snapshot_dir
+        self.check_seconds = check_seconds
+        self.stock_refresh_seconds = stock_refresh_seconds
+        self.snapshot: Optional[CatalogSnapshot] = None
+        self._stale = False
+        self._stock_changed_at = 0.0
+        self._checked_at = 0.0
+        self._file_id = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.snapshot_dir, SNAPSHOT_FILE)
+
+    def invalidate(self):
+        """Rebuild (and publish) on the next access, after a catalog or settings change"""
+        self._stale = True
+
+    def mark_stock_changed(self, changed_at: float):
+        """An order changed stock: expire a snapshot read before then after stock_refresh_seconds"""
+        self._stock_changed_at = max(self._stock_changed_at, changed_at)
+
+    def _expired(self) -> bool:
+        age = time.time() - self.snapshot.read_at
+        if self.snapshot.read_at < self._stock_changed_at:
+            return age > min(self.stock_refresh_seconds, self.ttl_seconds)
+        return age > self.ttl_seconds
+
+    async def current(self) -> CatalogSnapshot:
+        if self.snapshot_dir:
+            await self._refresh_shared()
+        elif self._stale or self.snapshot is None or self._expired():
+            await self.reload()
+        return self.snapshot
+
+    async def reload(self):
+        read_at, sections = await build_sections()
+        if self.snapshot_dir:
+            await asyncio.to_thread(self._publish, read_at, sections)
+            self._map_current()
+        else:
+            version = self.snapshot.version + 1 if self.snapshot else 1
+            self.snapshot = CatalogSnapshot(pack(version, read_at, sections))
+        self._stale = False
+
+    async def fee_settings(self) -> dict:
+        return dict((await self.current()).fee_settings)
+
+    # Shared snapshot file
+
+    async def _refresh_shared(self):
+        now = time.monotonic()
+        if not self._stale and self.snapshot is not None and now - self._checked_at < self.check_seconds:
+            return
+        self._checked_at = now
+        self._map_current()
+
+        if self._stale or self.snapshot is None:
+            await self.reload()
+            return
+
+        if self._expired():
+            lock = self._try_lock("rebuild.lock")
+            if lock is None:
+                return  # another worker is rebuilding; keep serving this version
+            try:
+                self._map_current()
+                if self._expired():
+                    await self.reload()
+            finally:
+                os.close(lock)
+
+    def _try_lock(self, name: str) -> Optional[int]:
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        fd = os.open(os.path.join(self.snapshot_dir, name), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _read_file(self) -> Optional[CatalogSnapshot]:
+        try:
+            with open(self.path, "rb") as f:
+                return CatalogSnapshot(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"⚠️  Unreadable catalog snapshot {self.path}: {e}")
+            return None
+
+    def _map_current(self):
+        """Map the published snapshot if it changed since the last check"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        file_id = (stat.st_ino, stat.st_mtime_ns)
+        if file_id == self._file_id:
+            return
+        snapshot = self._read_file()
+        if snapshot is not None:
+            # The previous map is released once no response references it
+            self.snapshot = snapshot
+            self._file_id = file_id
+
+    def _publish(self, read_at: float, sections: Dict[str, bytes]):
+        """Replace the shared file unless a worker published newer data meanwhile"""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        fd = os.open(os.path.join(self.snapshot_dir, "publish.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            published = self._read_file()
+            if published is not None and published.read_at >= read_at:
+                return
+            version = published.version + 1 if published else 1
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(pack(version, read_at, sections))
+            os.replace(temporary, self.path)
+        finally:
+            os.close(fd)
+
+catalog_cache = CatalogCache(
+    settings.CATALOG_CACHE_TTL_SECONDS,
+    settings.CATALOG_SNAPSHOT_DIR,
+    settings.CATALOG_SNAPSHOT_CHECK_SECONDS,
+    settings.CATALOG_STOCK_REFRESH_SECONDS
+)
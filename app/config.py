@@ -6,10 +6,33 @@ class Settings(BaseSettings):
     MONGODB_URI: str
     DATABASE_NAME: str = "veggo_db"
     
+    # MongoDB connection pool (per worker)
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = 5000  # fail instead of queueing forever for a connection
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    MONGO_CONNECT_TIMEOUT_MS: int = 5000
+    MONGO_COMPRESSORS: str = ""  # e.g. "zstd,snappy,zlib" (first one the server supports wins)
+    
+    # MongoDB workloads: admin listings (analytics) and exports read from secondaries
+    # through their own pools (0 = share the transactional pool)
+    MONGO_ANALYTICS_READ_PREFERENCE: str = "secondaryPreferred"
+    MONGO_ANALYTICS_MAX_POOL_SIZE: int = 10
+    MONGO_EXPORT_READ_PREFERENCE: str = "secondaryPreferred"
+    MONGO_EXPORT_MAX_POOL_SIZE: int = 4
+    MONGO_MAX_STALENESS_SECONDS: int = 0  # >= 90 skips lagging secondaries; 0 = no limit
+    
     # JWT
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 10080
+    VERIFICATION_TOKEN_EXPIRE_HOURS: int = 24
+    RESET_TOKEN_EXPIRE_MINUTES: int = 60
+    REVOCATION_BLOOM_CAPACITY: int = 100000
+    REVOCATION_BLOOM_ERROR_RATE: float = 0.001
+    REVOCATION_REFRESH_SECONDS: int = 5
+    REVOCATION_REBUILD_SECONDS: int = 3600
+    REVOCATION_REFRESH_OVERLAP_SECONDS: int = 60  # re-read revocations this far behind the cursor
     
     # Email
     SMTP_HOST: str
@@ -27,9 +50,83 @@ class Settings(BaseSettings):
     PRICE_PER_KM: float = 10
     PRICE_PER_METER: float = 0.01
     
+    # Store location (used when no stores are configured)
+    STORE_LAT: float = 28.6139
+    STORE_LNG: float = 77.2090
+    STORE_INDEX_TTL_SECONDS: int = 30
+    
+    # Delivery zones (rasterized into a grid of ZONE_CELL_DEGREES cells)
+    ZONE_CELL_DEGREES: float = 0.005
+    ZONE_INDEX_TTL_SECONDS: int = 30
+    
+    # Geofencing (automatic arrival and status transitions)
+    GEOFENCE_RADIUS_METERS: float = 100
+    GEOFENCE_AUTO_ADVANCE: bool = False
+    GEOFENCE_REFRESH_SECONDS: int = 60
+    
+    # Admin live map feed
+    MAP_CLUSTER_MAX_ZOOM: int = 13
+    MAP_COORD_PRECISION: int = 5
+    FLEET_STALE_SECONDS: float = 600  # agents without a location update for this long drop off the map
+    
     # App
     FRONTEND_URL: str = "http://localhost:3000"
     ORDER_CANCEL_TIME_MINUTES: int = 5
+    QUOTE_TTL_SECONDS: int = 300
+    ORDER_NUMBER_BLOCK_SIZE: int = 20
+    
+    # Admission control (rate limits and load shedding)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"  # "memory" or "mongo" (shared across workers)
+    RATE_LIMIT_TRUSTED_PROXIES: str = ""  # comma-separated IPs/CIDRs whose X-Forwarded-For is believed
+    SHED_LOOP_LAG_MS: float = 200
+    SHED_MONGO_LATENCY_MS: float = 250
+    
+    # Event-loop stall detection
+    STALL_DETECTOR_ENABLED: bool = True
+    STALL_THRESHOLD_MS: float = 100
+    STALL_HEARTBEAT_MS: float = 20
+    
+    # Idempotency-Key support
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_CACHE_SIZE: int = 10000
+    IDEMPOTENCY_LEASE_SECONDS: int = 60  # a retry may take over an in-progress key after this
+    
+    # Query shape recording for index_advisor.py
+    QUERY_MONITOR_ENABLED: bool = True
+    QUERY_MONITOR_FLUSH_SECONDS: int = 60
+    
+    # Tracing
+    TRACING_EXPORTER: str = "none"  # "none", "file" or "otlp"
+    TRACE_SAMPLE_RATE: float = 0.1
+    TRACE_FILE_PATH: str = "logs/traces.jsonl"
+    OTLP_ENDPOINT: str = "http://localhost:4318"
+    TRACE_SERVICE_NAME: str = "veggo-api"
+    
+    # Product catalog and delivery fee settings snapshot
+    CATALOG_CACHE_TTL_SECONDS: int = 10
+    CATALOG_SNAPSHOT_DIR: str = ""  # shared by the workers of a host, e.g. /dev/shm/veggo (empty = per worker)
+    CATALOG_SNAPSHOT_CHECK_SECONDS: float = 1.0
+    CATALOG_STOCK_REFRESH_SECONDS: float = 2  # max age of in_stock flags after this worker's orders change stock
+    
+    # Startup warm-up (gates /ready)
+    WARMUP_POOL_CONNECTIONS: int = 10
+    WARMUP_TIMEOUT_SECONDS: float = 30
+    WARMUP_RETRY_SECONDS: float = 5
+    WARMUP_REQUIRE_INDEXES: bool = False  # stay unready while init_db.py indexes are missing
+    
+    # In-process order event bus (side effects of order changes)
+    EVENT_BUS_QUEUE_SIZE: int = 1000  # per subscriber worker
+    EVENT_BUS_PUBLISH_TIMEOUT_MS: float = 100  # wait for queue space, then drop the event
+    EVENT_BUS_DRAIN_SECONDS: float = 10
+    EVENT_BUS_NOTIFICATION_WORKERS: int = 4
+    
+    # Order status emails: updates of one order within the window go out as one email
+    NOTIFICATION_COALESCE_SECONDS: float = 120  # 0 = one email per update
+    NOTIFICATION_DIGEST_MODE: str = "digest"  # "digest" (every step) or "latest" (latest state only)
+    
+    # Serverless cold starts: import the admin router on its first request
+    LAZY_ROUTERS: bool = False
     
     # Google OAuth
     GOOGLE_CLIENT_ID: Optional[str] = None
@@ -1,39 +1,171 @@
+import asyncio
+from typing import Dict
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 from app.config import settings
+from app.query_monitor import query_recorder
+from app.metrics import mongo_metrics_listener
+from app.tracing import tracer, mongo_tracing_listener
+
+# Workloads: checkout and the other request paths use the "transactional"
+# client (primary reads). Admin listings ("analytics") and exports ("export")
+# read from secondaries through their own, smaller pools, so reporting never
+# takes connections or primary capacity away from checkout.
+TRANSACTIONAL = "transactional"
+ANALYTICS = "analytics"
+EXPORT = "export"
+
+def workload_options(workload: str) -> dict:
+    """Read preference and pool size of a workload"""
+    if workload == ANALYTICS:
+        return {"read_preference": settings.MONGO_ANALYTICS_READ_PREFERENCE,
+                "max_pool_size": settings.MONGO_ANALYTICS_MAX_POOL_SIZE}
+    if workload == EXPORT:
+        return {"read_preference": settings.MONGO_EXPORT_READ_PREFERENCE,
+                "max_pool_size": settings.MONGO_EXPORT_MAX_POOL_SIZE}
+    if workload == TRANSACTIONAL:
+        return {"read_preference": "primary", "max_pool_size": settings.MONGO_MAX_POOL_SIZE}
+    raise ValueError(f"Unknown MongoDB workload: {workload}")
 
 client: AsyncIOMotorClient = None
 database = None
+# Event loop the client was created on (serverless runtimes may start a new one)
+_client_loop = None
+# Dedicated clients and database handles of the non-transactional workloads
+_workload_clients: Dict[str, AsyncIOMotorClient] = {}
+_workload_databases: Dict[str, object] = {}
+_owned_client: AsyncIOMotorClient = None
 
-async def connect_db():
-    global client, database
-    client = AsyncIOMotorClient(settings.MONGODB_URI)
+def _client_options(workload: str) -> dict:
+    options = workload_options(workload)
+    client_options = {
+        "maxPoolSize": options["max_pool_size"],
+        "minPoolSize": settings.MONGO_MIN_POOL_SIZE if workload == TRANSACTIONAL else 0,
+        "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+        "readPreference": options["read_preference"],
+        "appname": f"veggo-api-{workload}"
+    }
+    if options["read_preference"] != "primary" and settings.MONGO_MAX_STALENESS_SECONDS > 0:
+        client_options["maxStalenessSeconds"] = settings.MONGO_MAX_STALENESS_SECONDS
+    if settings.MONGO_COMPRESSORS:
+        # zstd needs the zstandard package, snappy python-snappy; zlib is built in
+        client_options["compressors"] = settings.MONGO_COMPRESSORS
+    return client_options
+
+def _new_client(workload: str) -> AsyncIOMotorClient:
+    """Build a Motor client. Connections are opened lazily, on the first operation."""
+    event_listeners = [mongo_metrics_listener]
+    if settings.QUERY_MONITOR_ENABLED:
+        event_listeners.append(query_recorder)
+    if tracer.enabled:
+        event_listeners.append(mongo_tracing_listener)
+    return AsyncIOMotorClient(settings.MONGODB_URI, event_listeners=event_listeners, **_client_options(workload))
+
+def _close_workload_clients():
+    for workload_client in _workload_clients.values():
+        workload_client.close()
+    _workload_clients.clear()
+    _workload_databases.clear()
+
+def _create_client():
+    global client, database, _client_loop, _owned_client
+    _close_workload_clients()
+    client = _owned_client = _new_client(TRANSACTIONAL)
     database = client[settings.DATABASE_NAME]
+    try:
+        _client_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _client_loop = None
+
+async def connect_db():
+    _create_client()
     print(f"✅ Connected to MongoDB: {settings.DATABASE_NAME}")
 
 async def close_db():
-    global client
+    global client, database, _owned_client
     if client:
+        _close_workload_clients()
         client.close()
+        client = None
+        database = None
+        _owned_client = None
         print("❌ Disconnected from MongoDB")
 
-def get_database():
-    return database
+def _workload_database(workload: str):
+    db = _workload_databases.get(workload)
+    if db is None:
+        options = workload_options(workload)
+        if client is _owned_client and options["max_pool_size"] > 0:
+            # Own pool, so a burst of reports cannot exhaust the transactional one
+            _workload_clients[workload] = _new_client(workload)
+            db = _workload_clients[workload][database.name]
+        else:
+            # Share the transactional pool (MONGO_*_MAX_POOL_SIZE=0, or a client set up elsewhere)
+            read_preference = make_read_preference(
+                read_pref_mode_from_name(options["read_preference"]), None,
+                settings.MONGO_MAX_STALENESS_SECONDS if settings.MONGO_MAX_STALENESS_SECONDS > 0 else -1
+            )
+            db = client.get_database(database.name, read_preference=read_preference)
+        _workload_databases[workload] = db
+    return db
+
+def get_database(workload: str = TRANSACTIONAL):
+    """
+    The shared database handle. Serverless functions may serve requests
+    without running the lifespan handler, so the client is created on first
+    use and reused by later (warm) invocations in the same process.
+    """
+    if database is None:
+        _create_client()
+    elif _client_loop is not None and _client_loop.is_closed():
+        # The runtime replaced the event loop the client was bound to
+        client.close()
+        _create_client()
+    if workload == TRANSACTIONAL:
+        return database
+    return _workload_database(workload)
 
 # Collections
-def get_users_collection():
-    return database.users
+def get_users_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).users
+
+def get_admins_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).admins
+
+def get_agents_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).agents
+
+def get_products_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).products
+
+def get_orders_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).orders
+
+def get_delivery_settings_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).delivery_settings
+
+def get_stores_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).stores
+
+def get_delivery_zones_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).delivery_zones
+
+def get_idempotency_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).idempotency_keys
 
-def get_admins_collection():
-    return database.admins
+def get_counters_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).counters
 
-def get_agents_collection():
-    return database.agents
+def get_rate_limits_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).rate_limits
 
-def get_products_collection():
-    return database.products
+def get_revoked_tokens_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).revoked_tokens
 
-def get_orders_collection():
-    return database.orders
+def get_notification_holds_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).notification_holds
 
-def get_delivery_settings_collection():
-    return database.delivery_settings
+def get_query_shapes_collection(workload: str = TRANSACTIONAL):
+    return get_database(workload).query_shapes
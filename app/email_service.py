@@ -2,7 +2,35 @@ import aiosmtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from app.config import settings
-from typing import List, Optional
+from app.metrics import observe_dependency
+from app.tracing import trace_span
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+ORDER_STATUS_MESSAGES = {
+    "assigned": "Your order has been assigned to a delivery agent! 🚴",
+    "picked_up": "Your order has been picked up by the delivery agent! 📦",
+    "in_transit": "Your order is on the way! 🚚",
+    "delivered": "Your order has been delivered! ✅",
+    "cancelled": "Your order has been cancelled. ❌"
+}
+
+ORDER_STATUS_LABELS = {
+    "assigned": "Assigned to a delivery agent",
+    "picked_up": "Picked up from the store",
+    "in_transit": "On the way",
+    "delivered": "Delivered",
+    "cancelled": "Cancelled"
+}
+
+@lru_cache(maxsize=256)
+def order_update_fragment(status: str, agent_name: Optional[str] = None) -> str:
+    """Digest line for one status change (rendered once per status and agent)"""
+    label = ORDER_STATUS_LABELS.get(status, f"Status changed to {status}")
+    if agent_name:
+        return f"<strong>{label}</strong>: {agent_name}"
+    return f"<strong>{label}</strong>"
 
 class EmailService:
     @staticmethod
@@ -25,14 +53,15 @@ class EmailService:
         message.attach(part2)
         
         try:
-            await aiosmtplib.send(
-                message,
-                hostname=settings.SMTP_HOST,
-                port=settings.SMTP_PORT,
-                username=settings.SMTP_USER,
-                password=settings.SMTP_PASSWORD,
-                use_tls=True
-            )
+            with observe_dependency("smtp", "send"), trace_span("smtp.send", **{"smtp.host": settings.SMTP_HOST}):
+                await aiosmtplib.send(
+                    message,
+                    hostname=settings.SMTP_HOST,
+                    port=settings.SMTP_PORT,
+                    username=settings.SMTP_USER,
+                    password=settings.SMTP_PASSWORD,
+                    use_tls=True
+                )
             return True
         except Exception as e:
             print(f"Error sending email: {e}")
@@ -102,14 +131,36 @@ class EmailService:
     
     @staticmethod
     async def send_order_status_email(email: str, name: str, order_number: str, status: str):
-        status_messages = {
-            "picked_up": "Your order has been picked up by the delivery agent! 📦",
-            "in_transit": "Your order is on the way! 🚚",
-            "delivered": "Your order has been delivered! ✅",
-            "cancelled": "Your order has been cancelled. ❌"
-        }
+        message = ORDER_STATUS_MESSAGES.get(status, f"Your order status has been updated to: {status}")
         
-        message = status_messages.get(status, f"Your order status has been updated to: {status}")
+        html = f"""
+        <html>
+            <body style="font-family: Arial, sans-serif; padding: 20px;">
+                <h2>Order Status Update</h2>
+                <p>Hi {name},</p>
+                <p>{message}</p>
+                <p><strong>Order Number:</strong> {order_number}</p>
+                <p>Best regards,<br>VegGo Team</p>
+            </body>
+        </html>
+        """
+        
+        await EmailService.send_email(email, f"Order Update - {order_number}", html)
+    
+    @staticmethod
+    async def send_order_digest_email(
+        email: str,
+        name: str,
+        order_number: str,
+        updates: List[Tuple[str, datetime, Optional[str]]]
+    ):
+        """One email for several status changes: (status, changed_at, agent_name), oldest first"""
+        latest_status = updates[-1][0]
+        message = ORDER_STATUS_MESSAGES.get(latest_status, f"Your order status has been updated to: {latest_status}")
+        timeline = "".join(
+            f"<li>{changed_at:%H:%M} UTC - {order_update_fragment(status, agent_name)}</li>"
+            for status, changed_at, agent_name in updates
+        )
         
         html = f"""
         <html>
@@ -118,6 +169,8 @@ class EmailService:
                 <p>Hi {name},</p>
                 <p>{message}</p>
                 <p><strong>Order Number:</strong> {order_number}</p>
+                <h3>Since our last update:</h3>
+                <ul>{timeline}</ul>
                 <p>Best regards,<br>VegGo Team</p>
             </body>
         </html>
@@ -0,0 +1,219 @@
+"""
+In-process order event bus
+
+Order routes write the order (and its stock changes) to MongoDB, publish an
+OrderEvent and return. The side effects that follow from the change, such
+as emails, stats, catalog refreshes and live tracking, run in subscribers
+(app/order_subscribers.py) after the response has been sent. Adding a side
+effect therefore adds no request latency.
+
+Each subscriber has its own bounded queues and worker tasks. Events of one
+order always go to the same worker, so a subscriber sees them in the order
+they were published. When a queue is full, publish() waits up to
+EVENT_BUS_PUBLISH_TIMEOUT_MS for space and then drops the event for that
+subscriber (veggo_event_bus_events_total{outcome="dropped"}): a stalled
+SMTP server slows order requests by at most that much and never holds up
+the other subscribers.
+
+Each event carries the traceparent of the request that published it, so
+the subscriber spans (and the SMTP and MongoDB spans inside them) join the
+request's trace even though the workers run in a context of their own.
+
+Events live in the worker's memory. Queued events are drained on shutdown
+for up to EVENT_BUS_DRAIN_SECONDS and lost if the process dies, so nothing
+that must not be lost (stock, order state) belongs in a subscriber.
+
+The workers are started by the application lifespan. Without one (the
+serverless deployment, where the function may be frozen as soon as the
+response is sent) publish() runs the subscribers inline instead, before
+the request returns.
+"""
+
+import asyncio
+import contextvars
+import time
+import zlib
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Awaitable, Callable, Iterable, List, Optional
+from prometheus_client import Counter, Histogram
+from app.config import settings
+from app.tracing import continue_trace, current_traceparent
+
+EVENT_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+EVENT_BUS_EVENTS = Counter(
+    "veggo_event_bus_events_total", "Order events per subscriber by outcome (handled, failed, dropped)",
+    ["subscriber", "outcome"]
+)
+EVENT_BUS_LAG = Histogram(
+    "veggo_event_bus_lag_seconds", "Time from publishing an event to the end of its handling",
+    ["subscriber"], buckets=EVENT_LAG_BUCKETS
+)
+
+class OrderEventType(str, Enum):
+    CREATED = "order.created"
+    CANCELLED = "order.cancelled"
+    STATUS_CHANGED = "order.status_changed"
+    AGENT_ASSIGNED = "order.agent_assigned"
+
+# Order fields geofence_index.track_order() needs besides the event's own
+TRACKING_FIELDS = ("lat", "lng", "store_lat", "store_lng")
+
+@dataclass(frozen=True)
+class OrderEvent:
+    type: OrderEventType
+    order_id: str
+    order_number: str
+    user_id: str
+    status: str
+    previous_status: Optional[str] = None
+    source: str = "user"  # "user", "admin", "agent" or "geofence"
+    agent_id: Optional[str] = None
+    agent_name: Optional[str] = None
+    final_price: Optional[float] = None
+    reason: Optional[str] = None
+    location: dict = field(default_factory=dict)  # TRACKING_FIELDS of the order
+    occurred_at: float = field(default_factory=time.time)
+    traceparent: Optional[str] = field(default_factory=current_traceparent)  # of the publishing request
+
+    @classmethod
+    def from_order(cls, event_type: OrderEventType, order: dict, **fields) -> "OrderEvent":
+        """Event for an order document; fields override what the document says (new status, agent)"""
+        values = {
+            "order_id": str(order.get("id") or order["_id"]),
+            "order_number": order["order_number"],
+            "user_id": order["user_id"],
+            "status": order["status"],
+            "agent_id": order.get("agent_id"),
+            "final_price": order.get("final_price"),
+            "location": {name: order[name] for name in TRACKING_FIELDS if order.get(name) is not None}
+        }
+        values.update(fields)
+        return cls(type=event_type, **values)
+
+    def tracked_order(self) -> dict:
+        """The order as geofence_index.track_order() expects it"""
+        return {
+            "id": self.order_id,
+            "order_number": self.order_number,
+            "user_id": self.user_id,
+            "agent_id": self.agent_id,
+            "status": self.status,
+            **self.location
+        }
+
+Handler = Callable[[OrderEvent], Awaitable[None]]
+
+class Subscriber:
+    def __init__(self, name: str, handler: Handler, event_types: Optional[Iterable[OrderEventType]], workers: int):
+        self.name = name
+        self.handler = handler
+        self.event_types = frozenset(event_types) if event_types else None
+        self.workers = max(1, workers)
+        self.queues: List[asyncio.Queue] = []
+
+    def wants(self, event: OrderEvent) -> bool:
+        return self.event_types is None or event.type in self.event_types
+
+    def queue_for(self, event: OrderEvent) -> asyncio.Queue:
+        return self.queues[zlib.crc32(event.order_id.encode()) % len(self.queues)]
+
+class EventBus:
+    def __init__(self, queue_size: int, publish_timeout_ms: float, drain_seconds: float):
+        self.queue_size = queue_size
+        self.publish_timeout_ms = publish_timeout_ms
+        self.drain_seconds = drain_seconds
+        self.subscribers: List[Subscriber] = []
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, name: str, handler: Handler, event_types: Optional[Iterable[OrderEventType]] = None,
+                  workers: int = 1):
+        """Register a handler (all event types unless given); call before start()"""
+        self.subscribers.append(Subscriber(name, handler, event_types, workers))
+
+    @property
+    def running(self) -> bool:
+        try:
+            return self._loop is asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+    def start(self):
+        """Start the workers on the running loop (again after a loop change)"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._tasks = []
+        for subscriber in self.subscribers:
+            subscriber.queues = [asyncio.Queue(self.queue_size) for _ in range(subscriber.workers)]
+            for queue in subscriber.queues:
+                # A fresh context: workers must not inherit the route or trace of whoever started them
+                self._tasks.append(loop.create_task(self._work(subscriber, queue), context=contextvars.Context()))
+
+    async def stop(self):
+        """Finish the queued events (up to EVENT_BUS_DRAIN_SECONDS), then stop the workers"""
+        if self._loop is None:
+            return
+        queues = [queue for subscriber in self.subscribers for queue in subscriber.queues]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in queues)), self.drain_seconds)
+        except asyncio.TimeoutError:
+            pending = sum(queue.qsize() for queue in queues)
+            print(f"⚠️  Event bus stopped with {pending} unhandled events")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    async def publish(self, event: OrderEvent):
+        if not self.running:
+            # No lifespan started the workers: handle the event before the response
+            await asyncio.gather(*(
+                self._handle(subscriber, event) for subscriber in self.subscribers if subscriber.wants(event)
+            ))
+            return
+
+        for subscriber in self.subscribers:
+            if not subscriber.wants(event):
+                continue
+            queue = subscriber.queue_for(event)
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                try:
+                    await asyncio.wait_for(queue.put(event), self.publish_timeout_ms / 1000)
+                except asyncio.TimeoutError:
+                    EVENT_BUS_EVENTS.labels(subscriber.name, "dropped").inc()
+                    print(f"⚠️  Event queue of {subscriber.name} is full, dropped {event.type.value} "
+                          f"for order {event.order_number}")
+
+    async def _handle(self, subscriber: Subscriber, event: OrderEvent):
+        outcome = "handled"
+        try:
+            with continue_trace(f"event {subscriber.name}", event.traceparent,
+                                **{"event.type": event.type.value, "order.number": event.order_number}):
+                await subscriber.handler(event)
+        except Exception as e:
+            outcome = "failed"
+            print(f"⚠️  Event subscriber {subscriber.name} failed on {event.type.value} "
+                  f"for order {event.order_number}: {type(e).__name__}: {e}")
+        EVENT_BUS_EVENTS.labels(subscriber.name, outcome).inc()
+        EVENT_BUS_LAG.labels(subscriber.name).observe(max(0.0, time.time() - event.occurred_at))
+
+    async def _work(self, subscriber: Subscriber, queue: asyncio.Queue):
+        while True:
+            event = await queue.get()
+            try:
+                await self._handle(subscriber, event)
+            finally:
+                queue.task_done()
+
+event_bus = EventBus(
+    settings.EVENT_BUS_QUEUE_SIZE,
+    settings.EVENT_BUS_PUBLISH_TIMEOUT_MS,
+    settings.EVENT_BUS_DRAIN_SECONDS
+)
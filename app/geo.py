@@ -0,0 +1,30 @@
+from math import radians, sin, cos, sqrt, atan2, floor
+from typing import Tuple
+
+EARTH_RADIUS_METERS = 6371000
+METERS_PER_DEGREE_LAT = 111320
+
+def haversine_meters(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two points in meters"""
+    lat1_rad = radians(lat1)
+    lat2_rad = radians(lat2)
+    delta_lat = radians(lat2 - lat1)
+    delta_lng = radians(lng2 - lng1)
+
+    a = sin(delta_lat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(delta_lng/2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1-a))
+
+    return EARTH_RADIUS_METERS * c
+
+def meters_to_degrees(meters: float, lat: float) -> Tuple[float, float]:
+    """
+    Convert a distance in meters to degree offsets at the given latitude
+    Returns: (delta_lat, delta_lng)
+    """
+    delta_lat = meters / METERS_PER_DEGREE_LAT
+    delta_lng = meters / (METERS_PER_DEGREE_LAT * max(cos(radians(lat)), 0.01))
+    return delta_lat, delta_lng
+
+def grid_cell(lat: float, lng: float, cell_deg: float) -> Tuple[int, int]:
+    """Key of the fixed-size lat/lng grid cell containing a point"""
+    return floor(lat / cell_deg), floor(lng / cell_deg)
@@ -0,0 +1,228 @@
+"""
+In-memory geofence index for delivery agents
+
+Every active order contributes two circular fences: one around the store
+it is picked up from and one around its drop-off point. Fences are
+registered in a fixed lat/lng grid whose cells are about one fence radius
+wide, so checking a location ping only looks at the fences of a single
+cell instead of scanning the orders collection.
+
+The fences are rebuilt per worker from the orders collection. Which fences
+an agent is inside is not: it is stored on the agent document
+(geofence_inside) and swapped atomically with every location ping, so when
+consecutive pings of an agent reach different workers each enter and exit
+is still reported exactly once.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from app.config import settings
+from app.geo import haversine_meters, meters_to_degrees, grid_cell
+
+STORE = "store"
+DROPOFF = "dropoff"
+
+ENTER = "enter"
+EXIT = "exit"
+
+# Orders that are out for delivery and therefore need fences
+ACTIVE_STATUSES = ("assigned", "picked_up", "in_transit")
+
+# (fence kind, transition) -> (statuses the order may be in, status to advance to)
+STATUS_TRANSITIONS = {
+    (STORE, EXIT): (("assigned", "picked_up"), "in_transit"),
+    (DROPOFF, ENTER): (("picked_up", "in_transit"), "delivered"),
+}
+
+@dataclass
+class Fence:
+    fence_id: str
+    order_id: str
+    agent_id: str
+    kind: str
+    lat: float
+    lng: float
+    radius_meters: float
+
+@dataclass
+class GeofenceEvent:
+    order_id: str
+    order_number: str
+    user_id: str
+    agent_id: str
+    kind: str
+    transition: str
+    status: str
+    new_status: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "order_id": self.order_id,
+            "order_number": self.order_number,
+            "fence": self.kind,
+            "transition": self.transition,
+            "status": self.status,
+            "new_status": self.new_status
+        }
+
+class GeofenceIndex:
+    def __init__(self, radius_meters: float, refresh_seconds: int):
+        self.radius_meters = radius_meters
+        self.refresh_seconds = refresh_seconds
+        self.cell_deg = radius_meters / 111320
+        self._cells: Dict[Tuple[int, int], Set[str]] = {}
+        self._fences: Dict[str, Fence] = {}
+        self._orders: Dict[str, dict] = {}
+        self._agent_orders: Dict[str, Set[str]] = {}
+        self._agent_loaded_at: Dict[str, float] = {}
+
+    def _fence_cells(self, fence: Fence):
+        delta_lat, delta_lng = meters_to_degrees(fence.radius_meters, fence.lat)
+        min_cell = grid_cell(fence.lat - delta_lat, fence.lng - delta_lng, self.cell_deg)
+        max_cell = grid_cell(fence.lat + delta_lat, fence.lng + delta_lng, self.cell_deg)
+        for i in range(min_cell[0], max_cell[0] + 1):
+            for j in range(min_cell[1], max_cell[1] + 1):
+                yield i, j
+
+    def _add_fence(self, fence: Fence):
+        self._fences[fence.fence_id] = fence
+        for cell in self._fence_cells(fence):
+            self._cells.setdefault(cell, set()).add(fence.fence_id)
+
+    def _remove_fence(self, fence_id: str):
+        fence = self._fences.pop(fence_id, None)
+        if not fence:
+            return
+        for cell in self._fence_cells(fence):
+            members = self._cells.get(cell)
+            if members is not None:
+                members.discard(fence_id)
+                if not members:
+                    del self._cells[cell]
+
+    def track_order(self, order: dict):
+        """Add or refresh the fences of an order; inactive orders are dropped"""
+        order_id = str(order.get("id") or order["_id"])
+        agent_id = order.get("agent_id")
+
+        if not agent_id or order.get("status") not in ACTIVE_STATUSES:
+            self.untrack_order(order_id)
+            return
+
+        previous = self._orders.get(order_id)
+        if previous and previous["agent_id"] != agent_id:
+            self.untrack_order(order_id)
+
+        self._orders[order_id] = {
+            "order_id": order_id,
+            "order_number": order.get("order_number", ""),
+            "user_id": order.get("user_id", ""),
+            "agent_id": agent_id,
+            "status": order["status"]
+        }
+        self._agent_orders.setdefault(agent_id, set()).add(order_id)
+
+        if not previous or previous["agent_id"] != agent_id:
+            self._add_fence(Fence(
+                fence_id=f"{order_id}:{STORE}",
+                order_id=order_id,
+                agent_id=agent_id,
+                kind=STORE,
+                lat=order.get("store_lat", settings.STORE_LAT),
+                lng=order.get("store_lng", settings.STORE_LNG),
+                radius_meters=self.radius_meters
+            ))
+            self._add_fence(Fence(
+                fence_id=f"{order_id}:{DROPOFF}",
+                order_id=order_id,
+                agent_id=agent_id,
+                kind=DROPOFF,
+                lat=order["lat"],
+                lng=order["lng"],
+                radius_meters=self.radius_meters
+            ))
+
+    def untrack_order(self, order_id: str):
+        tracked = self._orders.pop(order_id, None)
+        if not tracked:
+            return
+        agent_id = tracked["agent_id"]
+        for kind in (STORE, DROPOFF):
+            fence_id = f"{order_id}:{kind}"
+            self._remove_fence(fence_id)
+        agent_orders = self._agent_orders.get(agent_id)
+        if agent_orders is not None:
+            agent_orders.discard(order_id)
+            if not agent_orders:
+                del self._agent_orders[agent_id]
+
+    def set_order_status(self, order_id: str, status: str):
+        tracked = self._orders.get(order_id)
+        if not tracked:
+            return
+        if status in ACTIVE_STATUSES:
+            tracked["status"] = status
+        else:
+            self.untrack_order(order_id)
+
+    def needs_refresh(self, agent_id: str) -> bool:
+        """Whether the agent's active orders should be reloaded from the database"""
+        loaded_at = self._agent_loaded_at.get(agent_id)
+        return loaded_at is None or time.monotonic() - loaded_at > self.refresh_seconds
+
+    def load_agent_orders(self, agent_id: str, orders: List[dict]):
+        """Replace the tracked orders of an agent with a fresh database read"""
+        fresh_ids = set()
+        for order in orders:
+            self.track_order(order)
+            fresh_ids.add(str(order.get("id") or order["_id"]))
+        for order_id in list(self._agent_orders.get(agent_id, set()) - fresh_ids):
+            self.untrack_order(order_id)
+        self._agent_loaded_at[agent_id] = time.monotonic()
+
+    def active_order_count(self, agent_id: str) -> int:
+        return len(self._agent_orders.get(agent_id, ()))
+
+    def locate(self, agent_id: str, lat: float, lng: float) -> Set[str]:
+        """Fences of the agent's orders that contain a location"""
+        inside = set()
+        for fence_id in self._cells.get(grid_cell(lat, lng, self.cell_deg), ()):
+            fence = self._fences[fence_id]
+            if fence.agent_id != agent_id:
+                continue
+            if haversine_meters(lat, lng, fence.lat, fence.lng) <= fence.radius_meters:
+                inside.add(fence_id)
+        return inside
+
+    def knows(self, fence_ids: Set[str]) -> bool:
+        return all(fence_id in self._fences for fence_id in fence_ids)
+
+    def transitions(self, agent_id: str, previous: Set[str], inside: Set[str]) -> List[GeofenceEvent]:
+        """Enter/exit events between the stored fences of the previous ping and this one"""
+        events = []
+        for fence_ids, transition in ((inside - previous, ENTER), (previous - inside, EXIT)):
+            for fence_id in sorted(fence_ids):
+                fence = self._fences.get(fence_id)
+                if not fence:
+                    continue
+                order = self._orders[fence.order_id]
+                new_status = None
+                rule = STATUS_TRANSITIONS.get((fence.kind, transition))
+                if rule and order["status"] != rule[1]:
+                    # The local status may lag behind other workers; the
+                    # conditional update in the route decides whether it applies
+                    new_status = rule[1]
+                events.append(GeofenceEvent(
+                    order_id=fence.order_id,
+                    order_number=order["order_number"],
+                    user_id=order["user_id"],
+                    agent_id=agent_id,
+                    kind=fence.kind,
+                    transition=transition,
+                    status=order["status"],
+                    new_status=new_status
+                ))
+        return events
+
+geofence_index = GeofenceIndex(settings.GEOFENCE_RADIUS_METERS, settings.GEOFENCE_REFRESH_SECONDS)
@@ -0,0 +1,234 @@
+"""
+Idempotency-Key support for order-changing routes
+
+The first response for a (principal, route, key) triple is stored in the
+TTL-indexed `idempotency_keys` collection and in a small in-process LRU
+front cache. Retries with the same key replay the stored response in a
+single lookup instead of re-running pricing, stock updates and emails.
+
+While the first request runs, its record is `in_progress` with a lease of
+IDEMPOTENCY_LEASE_SECONDS that the worker renews until the request ends.
+The record is removed when the request fails or is cancelled; if the
+worker dies instead, the lease runs out and a retry takes the record over
+and runs the request again.
+"""
+
+import asyncio
+import hashlib
+import re
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.responses import JSONResponse
+from app.config import settings
+from app.database import get_idempotency_collection
+
+IDEMPOTENT_ROUTES = [
+    ("POST", re.compile(r"^/api/order/create$")),
+    ("PUT", re.compile(r"^/api/order/cancel/[^/]+$")),
+    ("PUT", re.compile(r"^/api/agent/order-status/[^/]+$")),
+    ("PUT", re.compile(r"^/api/admin/order/status/[^/]+$")),
+    ("PUT", re.compile(r"^/api/admin/order/assign-agent/[^/]+$")),
+]
+
+# Responses that must not be replayed: the request may succeed on retry
+UNSTORED_STATUSES = {409, 429}
+
+class IdempotencyCache:
+    """In-process LRU of completed responses in front of the collection"""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["cached_at"] > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry["record"]
+
+    def put(self, key: str, record: dict):
+        self._entries[key] = {"record": record, "cached_at": time.monotonic()}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+idempotency_cache = IdempotencyCache(settings.IDEMPOTENCY_CACHE_SIZE, settings.IDEMPOTENCY_TTL_SECONDS)
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+def _is_idempotent_route(method: str, path: str) -> bool:
+    return any(method == route_method and pattern.match(path) for route_method, pattern in IDEMPOTENT_ROUTES)
+
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _is_idempotent_route(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        idempotency_key = _header(scope, b"idempotency-key")
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        if len(idempotency_key) > 255:
+            await JSONResponse({"detail": "Idempotency-Key is too long"}, status_code=400)(scope, receive, send)
+            return
+
+        # Keys are scoped to the caller and the route
+        principal = _header(scope, b"authorization") or ""
+        record_id = hashlib.sha256(
+            f"{principal}|{scope['method']}|{scope['path']}|{idempotency_key}".encode()
+        ).hexdigest()
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        record = idempotency_cache.get(record_id)
+        lease_id = uuid.uuid4().hex
+        collection = get_idempotency_collection()
+        while record is None:
+            now = datetime.utcnow()
+            lease_expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+            try:
+                await collection.insert_one({
+                    "_id": record_id,
+                    "state": "in_progress",
+                    "fingerprint": fingerprint,
+                    "lease_id": lease_id,
+                    "lease_expires_at": lease_expires_at,
+                    "created_at": now
+                })
+                break
+            except DuplicateKeyError:
+                pass
+            # Take over a request whose worker died (its lease ran out)
+            taken_over = await collection.find_one_and_update(
+                {"_id": record_id, "state": "in_progress", "fingerprint": fingerprint,
+                 "lease_expires_at": {"$lt": now}},
+                {"$set": {"lease_id": lease_id, "lease_expires_at": lease_expires_at}},
+                return_document=ReturnDocument.AFTER
+            )
+            if taken_over is not None:
+                break
+            # None: the other request's record went away meanwhile; reserve again
+            record = await collection.find_one({"_id": record_id})
+
+        if record is not None:
+            await self._replay(record, fingerprint, scope, receive, send)
+            return
+
+        await self._execute(record_id, lease_id, fingerprint, body, scope, receive, send)
+
+    async def _replay(self, record: dict, fingerprint: str, scope, receive, send):
+        if record.get("fingerprint") != fingerprint:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key was already used with a different request body"},
+                status_code=422
+            )
+        elif record.get("state") != "completed":
+            response = JSONResponse(
+                {"detail": "A request with this Idempotency-Key is still in progress"},
+                status_code=409
+            )
+        else:
+            idempotency_cache.put(record["_id"], record)
+            await send({
+                "type": "http.response.start",
+                "status": record["status"],
+                "headers": [
+                    (b"content-type", record["content_type"].encode("latin-1")),
+                    (b"idempotent-replayed", b"true"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": record["body"]})
+            return
+        await response(scope, receive, send)
+
+    async def _keep_lease(self, record_id: str, lease_id: str):
+        """Renew the lease while the request runs, so only a dead worker's key can be taken over"""
+        collection = get_idempotency_collection()
+        lease = timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+        while True:
+            await asyncio.sleep(lease.total_seconds() / 3)
+            try:
+                await collection.update_one(
+                    {"_id": record_id, "lease_id": lease_id, "state": "in_progress"},
+                    {"$set": {"lease_expires_at": datetime.utcnow() + lease}}
+                )
+            except Exception as e:
+                print(f"⚠️  Renewing an idempotency lease failed: {type(e).__name__}: {e}")
+
+    async def _execute(self, record_id: str, lease_id: str, fingerprint: str, body: bytes, scope, receive, send):
+        collection = get_idempotency_collection()
+        # Our own reservation only: after a takeover the record is another request's
+        reservation = {"_id": record_id, "lease_id": lease_id, "state": "in_progress"}
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = {"status": 500, "content_type": "application/json", "chunks": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for key, value in message.get("headers", []):
+                    if key.lower() == b"content-type":
+                        response["content_type"] = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                response["chunks"].append(message.get("body", b""))
+            await send(message)
+
+        lease = asyncio.get_running_loop().create_task(self._keep_lease(record_id, lease_id))
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            # Also on cancellation (client disconnect, shutdown): otherwise
+            # retries would get 409 until the lease expires
+            await asyncio.shield(collection.delete_one(reservation))
+            raise
+        finally:
+            lease.cancel()
+
+        if response["status"] >= 500 or response["status"] in UNSTORED_STATUSES:
+            await collection.delete_one(reservation)
+            return
+
+        record = {
+            "_id": record_id,
+            "state": "completed",
+            "fingerprint": fingerprint,
+            "status": response["status"],
+            "content_type": response["content_type"],
+            "body": b"".join(response["chunks"]),
+            "created_at": datetime.utcnow()
+        }
+        # Upsert: the reservation may have expired (TTL) while the request ran
+        await collection.replace_one({"_id": record_id}, record, upsert=True)
+        idempotency_cache.put(record_id, record)
@@ -0,0 +1,39 @@
+"""
+Routers imported on their first request
+
+On serverless cold starts every imported module adds to the latency of the
+first request. Rarely used routers (the admin API) can be mounted through
+LazyRouterApp instead of include_router: the module is imported and wrapped
+in a sub-application only when a request under its prefix arrives.
+
+Lazily mounted routes are served normally but do not appear in /docs.
+"""
+
+import importlib
+from fastapi import FastAPI
+
+class LazyRouterApp:
+    def __init__(self, module: str, attribute: str = "router"):
+        self.module = module
+        self.attribute = attribute
+        self._app = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._app is not None
+
+    @property
+    def routes(self) -> list:
+        # Read by Mount.routes (route templates for metrics); empty until loaded
+        return self._app.routes if self._app is not None else []
+
+    def load(self) -> FastAPI:
+        if self._app is None:
+            router = getattr(importlib.import_module(self.module), self.attribute)
+            app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+            app.include_router(router)
+            self._app = app
+        return self._app
+
+    async def __call__(self, scope, receive, send):
+        await self.load()(scope, receive, send)
@@ -1,10 +1,15 @@
-import googlemaps
+from functools import cached_property
 from app.config import settings
+from app.metrics import observe_dependency
+from app.tracing import trace_span
 from typing import Tuple, Optional
 
 class GoogleMapsService:
-    def __init__(self):
-        self.gmaps = googlemaps.Client(key=settings.GOOGLE_MAPS_API_KEY)
+    @cached_property
+    def gmaps(self):
+        """Client built on first use: importing googlemaps (and requests) is slow on cold starts"""
+        import googlemaps
+        return googlemaps.Client(key=settings.GOOGLE_MAPS_API_KEY)
     
     def calculate_distance(self, origin_lat: float, origin_lng: float, 
                           dest_lat: float, dest_lng: float) -> Tuple[float, float]:
@@ -16,11 +21,12 @@ class GoogleMapsService:
             origin = f"{origin_lat},{origin_lng}"
             destination = f"{dest_lat},{dest_lng}"
             
-            result = self.gmaps.distance_matrix(
-                origins=origin,
-                destinations=destination,
-                mode="driving"
-            )
+            with observe_dependency("google_maps", "distance_matrix"), trace_span("google_maps.distance_matrix"):
+                result = self.gmaps.distance_matrix(
+                    origins=origin,
+                    destinations=destination,
+                    mode="driving"
+                )
             
             if result['rows'][0]['elements'][0]['status'] == 'OK':
                 distance_meters = result['rows'][0]['elements'][0]['distance']['value']
@@ -60,7 +66,8 @@ class GoogleMapsService:
     def get_address_from_coords(self, lat: float, lng: float) -> Optional[str]:
         """Get formatted address from coordinates"""
         try:
-            result = self.gmaps.reverse_geocode((lat, lng))
+            with observe_dependency("google_maps", "reverse_geocode"), trace_span("google_maps.reverse_geocode"):
+                result = self.gmaps.reverse_geocode((lat, lng))
             if result:
                 return result[0]['formatted_address']
         except Exception as e:
@@ -0,0 +1,148 @@
+"""
+Prometheus metrics
+
+Request counts, latency histograms and in-flight gauges are labelled with
+the route template (`/api/order/{order_id}`), never the raw path. Calls to
+MongoDB (command listener), Google Maps and SMTP are timed as dependencies
+and labelled with the route that made them, through a context variable
+that Motor and asyncio.to_thread carry into their worker threads.
+
+With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by the workers before they start; /metrics then
+aggregates the samples of all of them.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               generate_latest, multiprocess)
+from pymongo import monitoring
+from starlette.routing import Match, Mount
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+DEPENDENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Paths that are not worth measuring
+UNMEASURED_PATHS = {"/metrics", "/health", "/ready"}
+
+HTTP_REQUESTS = Counter(
+    "veggo_http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "veggo_http_request_duration_seconds", "HTTP request latency", ["method", "route"]
+)
+HTTP_IN_FLIGHT = Gauge(
+    "veggo_http_requests_in_flight", "HTTP requests being served", ["method", "route"],
+    multiprocess_mode="livesum"
+)
+DEPENDENCY_LATENCY = Histogram(
+    "veggo_dependency_duration_seconds", "Latency of calls to external dependencies",
+    ["dependency", "operation", "route"], buckets=DEPENDENCY_BUCKETS
+)
+DEPENDENCY_ERRORS = Counter(
+    "veggo_dependency_errors_total", "Failed calls to external dependencies",
+    ["dependency", "operation", "route"]
+)
+
+# Route template of the request being served ("background" outside requests)
+current_route: ContextVar[str] = ContextVar("current_route", default="background")
+
+@contextmanager
+def observe_dependency(dependency: str, operation: str):
+    """Time a blocking or awaited call to an external dependency"""
+    route = current_route.get()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.labels(dependency, operation, route).inc()
+        raise
+    finally:
+        DEPENDENCY_LATENCY.labels(dependency, operation, route).observe(time.perf_counter() - started)
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """Feeds MongoDB command latencies into the dependency histogram"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        DEPENDENCY_LATENCY.labels("mongodb", event.command_name, current_route.get()).observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event):
+        route = current_route.get()
+        DEPENDENCY_LATENCY.labels("mongodb", event.command_name, route).observe(event.duration_micros / 1e6)
+        DEPENDENCY_ERRORS.labels("mongodb", event.command_name, route).inc()
+
+mongo_metrics_listener = MongoMetricsListener()
+
+def _match_template(routes, scope, prefix: str = ""):
+    partial = None
+    for route in routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            if isinstance(route, Mount) and route.routes:
+                # Lazily mounted routers: label with the route inside the mount
+                inner = _match_template(route.routes, {**scope, **child_scope}, prefix + route.path)
+                if inner:
+                    return inner
+            return prefix + route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = prefix + route.path
+    return partial
+
+def route_template(scope) -> str:
+    """Path template of the route that will handle the request (cached on the scope)"""
+    template = scope.get("veggo.route_template")
+    if template is None:
+        template = _match_template(getattr(scope.get("app"), "routes", []), scope) or "unmatched"
+        scope["veggo.route_template"] = template
+    return template
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNMEASURED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        token = current_route.set(route)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            in_flight.dec()
+            current_route.reset(token)
+
+def render_metrics() -> bytes:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+def mark_worker_dead():
+    """Drop this worker's live gauges from the shared multiprocess directory"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
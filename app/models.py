@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 from enum import Enum
 
@@ -69,6 +69,7 @@ class AgentLogin(BaseModel):
 class LocationUpdate(BaseModel):
     lat: float
     lng: float
+    heading: Optional[float] = None
 
 class OrderStatusUpdate(BaseModel):
     status: OrderStatus
@@ -100,6 +101,33 @@ class ProductUpdate(BaseModel):
     category: Optional[str] = None
     isAvailable: Optional[bool] = None
 
+class StoreStock(BaseModel):
+    stockKg: Optional[float] = None
+    stockPieces: Optional[int] = None
+
+class StoreCreate(BaseModel):
+    name: str
+    address: str
+    lat: float
+    lng: float
+    inventory: Dict[str, StoreStock] = {}
+    isActive: bool = True
+
+class StoreUpdate(BaseModel):
+    name: Optional[str] = None
+    address: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    isActive: Optional[bool] = None
+
+class DeliveryZone(BaseModel):
+    name: str
+    polygon: List[List[float]] = Field(..., min_length=3)  # [[lat, lng], ...]
+    base_delivery_fee: float
+    price_per_km: float
+    priority: int = 0
+    isActive: bool = True
+
 class DeliverySettings(BaseModel):
     base_delivery_fee: float
     price_per_km: float
@@ -123,6 +151,12 @@ class OrderCreate(BaseModel):
     lng: float
     phone: str
     notes: Optional[str] = None
+    quote_token: Optional[str] = None
+
+class OrderQuoteRequest(BaseModel):
+    items: List[OrderItem]
+    lat: float
+    lng: float
 
 class AgentAssign(BaseModel):
     agent_id: str
@@ -0,0 +1,200 @@
+"""
+Order status email coalescing
+
+An order usually goes assigned -> picked_up -> in_transit -> delivered within
+minutes, and used to send one email per step. Status updates (agent
+assignment and status changes) are now held per order for
+NOTIFICATION_COALESCE_SECONDS from the first one, then sent as one email:
+
+- "digest": the latest state plus a timeline of every step in the window
+- "latest": only the latest state
+
+Holds live in the notification_holds collection with a due time, so the
+updates of one order are combined whichever worker served them, and every
+worker's flusher sends the holds that are due. A final status (delivered,
+cancelled) sends the order's hold at once, so the last email of an order is
+never delayed. Before sending, the order is read again: a hold whose latest
+update is no longer the order's status (the order has moved on, and a later
+email covers it) is dropped. Order confirmations and user cancellations are
+not held.
+
+Holding needs the flusher, which the application lifespan starts. Without
+one (the serverless deployment) every update is sent right away.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional
+from bson import ObjectId
+from prometheus_client import Counter
+from app.config import settings
+from app.database import get_notification_holds_collection, get_orders_collection, get_users_collection
+from app.email_service import email_service
+from app.events import OrderEvent, OrderEventType
+
+FINAL_STATUSES = {"delivered", "cancelled"}
+
+ORDER_STATUS_EMAILS = Counter(
+    "veggo_order_status_emails_total", "Order status emails sent, by kind (single, latest, digest)", ["kind"]
+)
+ORDER_STATUS_UPDATES = Counter(
+    "veggo_order_status_updates_total",
+    "Order status updates notified, by outcome (sent, coalesced, superseded)", ["outcome"]
+)
+
+async def find_recipient(user_id: str) -> Optional[dict]:
+    return await get_users_collection().find_one({"_id": ObjectId(user_id)}, {"email": 1, "username": 1})
+
+def held_update(event: OrderEvent) -> dict:
+    return {
+        "type": event.type.value,
+        "status": event.status,
+        "agent_name": event.agent_name,
+        "occurred_at": datetime.utcfromtimestamp(event.occurred_at)
+    }
+
+class StatusNotifier:
+    def __init__(self, window_seconds: float, mode: str, concurrency: int):
+        self.window_seconds = window_seconds
+        self.mode = mode
+        self.concurrency = max(1, concurrency)
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def holding(self) -> bool:
+        try:
+            return self.window_seconds > 0 and self._loop is asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+    def start(self):
+        """Start sending due holds from the running loop"""
+        if self.window_seconds <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._task = loop.create_task(self._flush_due())
+
+    async def stop(self):
+        """Stop the flusher and send the holds that are already due"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._loop = None
+        await self._send_due()
+
+    async def notify(self, event: OrderEvent):
+        """Hold a status update for the order's window, or send it when final"""
+        hold = {
+            "_id": event.order_id,
+            "order_number": event.order_number,
+            "user_id": event.user_id,
+            "updates": [held_update(event)]
+        }
+        if not self.holding:
+            await self._send(hold)
+            return
+
+        collection = get_notification_holds_collection()
+        due_at = datetime.utcnow() + timedelta(seconds=self.window_seconds)
+        if event.status not in FINAL_STATUSES:
+            await collection.update_one(
+                {"_id": event.order_id},
+                {
+                    "$push": {"updates": hold["updates"][0]},
+                    "$setOnInsert": {"order_number": event.order_number, "user_id": event.user_id, "due_at": due_at}
+                },
+                upsert=True
+            )
+            return
+
+        # Take whatever is held together with the final update; if a flusher
+        # claimed the hold meanwhile, it sends the earlier updates and is
+        # then dropped as superseded
+        held = await collection.find_one_and_delete({"_id": event.order_id})
+        if held:
+            hold["updates"] = held["updates"] + hold["updates"]
+        await self._send(hold)
+
+    async def discard(self, order_id: str):
+        """Drop held updates that a later email (a cancellation) supersedes"""
+        held = await get_notification_holds_collection().find_one_and_delete({"_id": order_id})
+        if held:
+            ORDER_STATUS_UPDATES.labels("coalesced").inc(len(held["updates"]))
+
+    async def _flush_due(self):
+        interval = min(1.0, self.window_seconds)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._send_due()
+            except Exception as e:
+                print(f"⚠️  Sending held status emails failed: {type(e).__name__}: {e}")
+
+    async def _send_due(self):
+        """Claim the due holds (deleting one claims it for this worker) and send them"""
+        collection = get_notification_holds_collection()
+        while True:
+            holds = []
+            while len(holds) < self.concurrency:
+                hold = await collection.find_one_and_delete(
+                    {"due_at": {"$lte": datetime.utcnow()}}, sort=[("due_at", 1)]
+                )
+                if hold is None:
+                    break
+                holds.append(hold)
+            if not holds:
+                return
+            await asyncio.gather(*(self._send_claimed(hold) for hold in holds))
+
+    async def _send_claimed(self, hold: dict):
+        try:
+            await self._send(hold)
+        except Exception as e:
+            print(f"⚠️  Status email for order {hold['order_number']} failed: {type(e).__name__}: {e}")
+
+    async def _send(self, hold: dict):
+        updates = hold["updates"]
+        latest = updates[-1]
+        order = await get_orders_collection().find_one({"_id": ObjectId(hold["_id"])}, {"status": 1})
+        if not order or order["status"] != latest["status"]:
+            # The order has moved on (delivered by another worker, say): its later email covers these
+            ORDER_STATUS_UPDATES.labels("superseded").inc(len(updates))
+            return
+
+        ORDER_STATUS_UPDATES.labels("sent").inc()
+        if len(updates) > 1:
+            ORDER_STATUS_UPDATES.labels("coalesced").inc(len(updates) - 1)
+
+        user = await find_recipient(hold["user_id"])
+        if not user:
+            return
+
+        if len(updates) > 1 and self.mode == "digest":
+            ORDER_STATUS_EMAILS.labels("digest").inc()
+            await email_service.send_order_digest_email(
+                user["email"], user["username"], hold["order_number"],
+                [(update["status"], update["occurred_at"], update["agent_name"]) for update in updates]
+            )
+            return
+
+        ORDER_STATUS_EMAILS.labels("single" if len(updates) == 1 else "latest").inc()
+        if latest["type"] == OrderEventType.AGENT_ASSIGNED.value:
+            await email_service.send_order_assigned_email(
+                user["email"], user["username"], hold["order_number"], latest["agent_name"]
+            )
+        else:
+            await email_service.send_order_status_email(
+                user["email"], user["username"], hold["order_number"], latest["status"]
+            )
+
+status_notifier = StatusNotifier(
+    settings.NOTIFICATION_COALESCE_SECONDS,
+    settings.NOTIFICATION_DIGEST_MODE,
+    settings.EVENT_BUS_NOTIFICATION_WORKERS
+)
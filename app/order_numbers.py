@@ -0,0 +1,45 @@
+"""
+Collision-free order numbers
+
+Each worker leases a block of ORDER_NUMBER_BLOCK_SIZE sequence numbers
+from a per-day counter document with one atomic findOneAndUpdate/$inc and
+hands them out from memory. Numbers are unique across workers; blocks left
+unused when a worker stops simply leave gaps.
+"""
+
+import asyncio
+from datetime import datetime
+from pymongo import ReturnDocument
+from app.config import settings
+from app.database import get_counters_collection
+
+class OrderNumberAllocator:
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._day = None
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def _lease_block(self, day: str):
+        counter = await get_counters_collection().find_one_and_update(
+            {"_id": f"order_number:{day}"},
+            {"$inc": {"value": self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._day = day
+        self._next = counter["value"] - self.block_size + 1
+        self._end = counter["value"] + 1
+
+    async def next_order_number(self) -> str:
+        """Order number like VG202401150000123 (date + 7-digit daily sequence)"""
+        async with self._lock:
+            day = datetime.utcnow().strftime("%Y%m%d")
+            if day != self._day or self._next >= self._end:
+                await self._lease_block(day)
+            sequence = self._next
+            self._next += 1
+        return f"VG{day}{sequence:07d}"
+
+order_number_allocator = OrderNumberAllocator(settings.ORDER_NUMBER_BLOCK_SIZE)
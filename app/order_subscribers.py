@@ -0,0 +1,67 @@
+"""
+Order event subscribers
+
+Side effects of order changes, run by the event bus (app/events.py) after
+the request that made the change has returned:
+
+- notifications: confirmation and cancellation emails; assignment and
+  status emails go through the coalescing notifier (app/notifications.py)
+- stats: order lifecycle counters on /metrics
+- catalog: orders and cancellations change stock, so the catalog snapshot
+  expires after CATALOG_STOCK_REFRESH_SECONDS instead of the full TTL
+- tracking: keeps this worker's geofence index in step with assignments
+  and status changes
+"""
+
+from prometheus_client import Counter
+from app.catalog import catalog_cache
+from app.config import settings
+from app.email_service import email_service
+from app.events import EventBus, OrderEvent, OrderEventType
+from app.geofence import geofence_index
+from app.notifications import find_recipient, status_notifier
+
+ORDER_EVENTS = Counter(
+    "veggo_order_events_total", "Order lifecycle events", ["event", "status", "source"]
+)
+
+async def notify_customer(event: OrderEvent):
+    if event.type in (OrderEventType.AGENT_ASSIGNED, OrderEventType.STATUS_CHANGED):
+        await status_notifier.notify(event)
+        return
+    if event.type == OrderEventType.CANCELLED:
+        await status_notifier.discard(event.order_id)
+
+    user = await find_recipient(event.user_id)
+    if not user:
+        return
+
+    if event.type == OrderEventType.CREATED:
+        await email_service.send_order_confirmation_email(
+            user["email"], user["username"], event.order_number, event.final_price
+        )
+    else:
+        await email_service.send_order_cancelled_email(
+            user["email"], user["username"], event.order_number, event.reason
+        )
+
+async def count_order_event(event: OrderEvent):
+    ORDER_EVENTS.labels(event.type.value, event.status, event.source).inc()
+
+async def expire_catalog_stock(event: OrderEvent):
+    catalog_cache.mark_stock_changed(event.occurred_at)
+
+async def update_tracking(event: OrderEvent):
+    if event.source == "geofence":
+        return  # the transition came from the index itself
+    if event.type == OrderEventType.AGENT_ASSIGNED:
+        geofence_index.track_order(event.tracked_order())
+    else:
+        geofence_index.set_order_status(event.order_id, event.status)
+
+def register_order_subscribers(bus: EventBus):
+    bus.subscribe("notifications", notify_customer, workers=settings.EVENT_BUS_NOTIFICATION_WORKERS)
+    bus.subscribe("stats", count_order_event)
+    bus.subscribe("catalog", expire_catalog_stock, [OrderEventType.CREATED, OrderEventType.CANCELLED])
+    bus.subscribe("tracking", update_tracking,
+                  [OrderEventType.AGENT_ASSIGNED, OrderEventType.STATUS_CHANGED, OrderEventType.CANCELLED])
@@ -0,0 +1,276 @@
+"""
+Cart and delivery pricing shared by order creation and quotes
+"""
+
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+from bson import ObjectId
+from fastapi import HTTPException
+from jose import JWTError, jwt
+from pymongo import ReturnDocument
+from app.config import settings
+from app.database import (get_products_collection, get_stores_collection,
+                          get_delivery_zones_collection, get_users_collection, get_counters_collection)
+from app.maps_service import maps_service
+from app.catalog import catalog_cache
+from app.store_index import store_index
+from app.zones import zone_index
+
+async def get_delivery_fee_settings():
+    """Get current delivery fee settings from database or config (via the catalog snapshot)"""
+    return await catalog_cache.fee_settings()
+
+async def resolve_delivery_zone(lat: float, lng: float):
+    """
+    Find the delivery zone for an address with one grid lookup
+    Returns: (serviceable, zone) - zone is None when no zones are configured
+    """
+    await zone_index.ensure_fresh(get_delivery_zones_collection())
+
+    if not zone_index.has_zones():
+        return True, None
+
+    zone = zone_index.lookup(lat, lng)
+    return zone is not None, zone
+
+async def price_items(items: list):
+    """
+    Validate cart items against the catalog and stock
+    Returns: (validated_items, total_price)
+    """
+    products_collection = get_products_collection()
+
+    product_ids = list({ObjectId(item.product_id) for item in items})
+    products = await products_collection.find({"_id": {"$in": product_ids}}).to_list(None)
+    products_by_id = {str(product["_id"]): product for product in products}
+
+    total_price = 0
+    validated_items = []
+
+    for item in items:
+        product = products_by_id.get(item.product_id)
+
+        if not product:
+            raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
+
+        if not product.get("isAvailable", False):
+            raise HTTPException(status_code=400, detail=f"Product {product['name']} is not available")
+
+        # Check stock
+        if item.unit == "Kg":
+            if product.get("stockKg", 0) < item.quantity:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Insufficient stock for {product['name']}. Available: {product.get('stockKg', 0)} Kg"
+                )
+            price_per_unit = product.get("pricePerKg")
+            if price_per_unit is None:
+                raise HTTPException(status_code=400, detail=f"Product {product['name']} not available in Kg")
+        elif item.unit == "Piece":
+            if product.get("stockPieces", 0) < item.quantity:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Insufficient stock for {product['name']}. Available: {product.get('stockPieces', 0)} Pieces"
+                )
+            price_per_unit = product.get("pricePerPiece")
+            if price_per_unit is None:
+                raise HTTPException(status_code=400, detail=f"Product {product['name']} not available in Pieces")
+        else:
+            raise HTTPException(status_code=400, detail="Unit must be 'Kg' or 'Piece'")
+
+        item_total = price_per_unit * item.quantity
+        total_price += item_total
+
+        validated_items.append({
+            "product_id": item.product_id,
+            "product_name": product["name"],
+            "quantity": item.quantity,
+            "unit": item.unit,
+            "price_per_unit": price_per_unit,
+            "total_price": item_total
+        })
+
+    return validated_items, total_price
+
+async def select_store(lat: float, lng: float, items: list) -> Optional[dict]:
+    """
+    Nearest store able to fill the cart, or a pseudo-store at STORE_LAT/STORE_LNG
+    when no stores are configured
+    """
+    await store_index.ensure_fresh(get_stores_collection())
+
+    if not store_index.has_stores():
+        return {"_id": None, "lat": settings.STORE_LAT, "lng": settings.STORE_LNG}
+
+    cart = [{"product_id": item.product_id, "unit": item.unit, "quantity": item.quantity} for item in items]
+    return store_index.select_store(lat, lng, cart)
+
+def calculate_delivery_fee(distance_km: float, fee_settings: dict, zone: Optional[dict] = None) -> float:
+    """Delivery fee for a distance; the zone's fee tier takes precedence"""
+    if zone:
+        return zone["base_delivery_fee"] + distance_km * zone["price_per_km"]
+    return fee_settings["base_fee"] + distance_km * fee_settings["per_km"]
+
+async def build_quote(items: list, lat: float, lng: float) -> dict:
+    """
+    Price a cart and its delivery. The catalog read, the distance call and the
+    fee settings read are independent and run concurrently.
+    """
+    # Reject addresses outside every delivery zone before any other work
+    serviceable, zone = await resolve_delivery_zone(lat, lng)
+    if not serviceable:
+        raise HTTPException(status_code=400, detail="Delivery is not available at this address")
+
+    store = await select_store(lat, lng, items)
+    if not store:
+        raise HTTPException(status_code=400, detail="No store can fulfil this order right now")
+
+    (validated_items, total_price), (distance_km, _), fee_settings = await asyncio.gather(
+        price_items(items),
+        asyncio.to_thread(maps_service.calculate_distance, store["lat"], store["lng"], lat, lng),
+        get_delivery_fee_settings()
+    )
+
+    return {
+        "items": validated_items,
+        "total_price": total_price,
+        "store_id": str(store["_id"]) if store["_id"] else None,
+        "store_lat": store["lat"],
+        "store_lng": store["lng"],
+        "zone_id": str(zone["_id"]) if zone else None,
+        "distance_km": distance_km,
+        "delivery_fee": calculate_delivery_fee(distance_km, fee_settings, zone)
+    }
+
+def cart_digest(items: list) -> str:
+    """Stable fingerprint of the cart lines a quote was computed for"""
+    lines = sorted(f"{item.product_id}:{item.unit}:{item.quantity}" for item in items)
+    return hashlib.sha256("|".join(lines).encode()).hexdigest()
+
+def create_quote_token(user_id: str, lat: float, lng: float, items: list, quote: dict) -> str:
+    payload = {
+        "sub": user_id,
+        "type": "quote",
+        "lat": lat,
+        "lng": lng,
+        "cart": cart_digest(items),
+        "store_id": quote["store_id"],
+        "store_lat": quote["store_lat"],
+        "store_lng": quote["store_lng"],
+        "zone_id": quote["zone_id"],
+        "distance_km": quote["distance_km"],
+        "delivery_fee": quote["delivery_fee"],
+        "exp": datetime.utcnow() + timedelta(seconds=settings.QUOTE_TTL_SECONDS)
+    }
+    return jwt.encode(payload, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+def decode_quote_token(token: str, user_id: str, lat: float, lng: float, items: list) -> Optional[dict]:
+    """Quote claims if the token is valid, unexpired and matches this cart and address"""
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+
+    if (payload.get("type") != "quote" or payload.get("sub") != user_id
+            or payload.get("lat") != lat or payload.get("lng") != lng
+            or payload.get("cart") != cart_digest(items)):
+        return None
+
+    return payload
+
+async def quote_saved_address(lat: float, lng: float) -> dict:
+    """Delivery pricing for a saved address, independent of any cart"""
+    serviceable, zone = await resolve_delivery_zone(lat, lng)
+    if not serviceable:
+        return {"lat": lat, "lng": lng, "serviceable": False, "computed_at": datetime.utcnow()}
+
+    await store_index.ensure_fresh(get_stores_collection())
+    store = next(store_index.nearest(lat, lng), None)
+    if store is None:
+        store = {"_id": None, "lat": settings.STORE_LAT, "lng": settings.STORE_LNG}
+
+    (distance_km, _), fee_settings = await asyncio.gather(
+        asyncio.to_thread(maps_service.calculate_distance, store["lat"], store["lng"], lat, lng),
+        get_delivery_fee_settings()
+    )
+
+    return {
+        "lat": lat,
+        "lng": lng,
+        "serviceable": True,
+        "store_id": str(store["_id"]) if store["_id"] else None,
+        "store_lat": store["lat"],
+        "store_lng": store["lng"],
+        "zone_id": str(zone["_id"]) if zone else None,
+        "distance_km": distance_km,
+        "delivery_fee": calculate_delivery_fee(distance_km, fee_settings, zone),
+        "computed_at": datetime.utcnow()
+    }
+
+class PricingGeneration:
+    """
+    Counter bumped whenever fee settings, stores or zones change. Saved-address
+    quotes carry the generation they were computed under and are ignored once
+    it moves on, so nothing has to be deleted and a refresh that was already
+    running cannot bring back a stale quote. Workers re-read the counter at
+    most every ttl_seconds (the staleness of the store and zone indexes).
+    """
+    COUNTER_ID = "pricing_generation"
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._value: Optional[int] = None
+        self._read_at = 0.0
+
+    async def current(self) -> int:
+        if self._value is None or time.monotonic() - self._read_at > self.ttl_seconds:
+            counter = await get_counters_collection().find_one({"_id": self.COUNTER_ID})
+            self._value = counter["value"] if counter else 0
+            self._read_at = time.monotonic()
+        return self._value
+
+    async def bump(self):
+        counter = await get_counters_collection().find_one_and_update(
+            {"_id": self.COUNTER_ID},
+            {"$inc": {"value": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._value = counter["value"]
+        self._read_at = time.monotonic()
+
+pricing_generation = PricingGeneration(min(settings.STORE_INDEX_TTL_SECONDS, settings.ZONE_INDEX_TTL_SECONDS))
+
+async def refresh_saved_address_quote(user_id: ObjectId, lat: float, lng: float):
+    """Background task: precompute and store the delivery quote for a user's address"""
+    try:
+        # Read before pricing: a change made meanwhile makes this quote stale
+        generation = await pricing_generation.current()
+        delivery_quote = await quote_saved_address(lat, lng)
+        delivery_quote["generation"] = generation
+    except Exception as e:
+        print(f"Error precomputing delivery quote: {e}")
+        return
+
+    # Only store it if the address has not changed in the meantime
+    await get_users_collection().update_one(
+        {"_id": user_id, "lat": lat, "lng": lng},
+        {"$set": {"delivery_quote": delivery_quote}}
+    )
+
+async def invalidate_saved_address_quotes():
+    """Retire precomputed quotes after fee settings, stores or zones change"""
+    await pricing_generation.bump()
+
+async def saved_address_quote(user: dict, lat: float, lng: float) -> Optional[dict]:
+    """The user's precomputed quote if the order goes to the saved address and pricing has not changed"""
+    delivery_quote = user.get("delivery_quote")
+    if (delivery_quote and delivery_quote.get("serviceable")
+            and delivery_quote["lat"] == lat and delivery_quote["lng"] == lng
+            and user.get("lat") == lat and user.get("lng") == lng
+            and delivery_quote.get("generation") == await pricing_generation.current()):
+        return delivery_quote
+    return None
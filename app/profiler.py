@@ -0,0 +1,177 @@
+"""
+On-demand CPU and memory profiling for live traffic
+
+CpuProfiler samples Python stacks from a background thread with
+sys._current_frames() and aggregates them as collapsed stacks
+("outer;inner count"), the input format of flamegraph.pl, speedscope and
+inferno. In "all" mode every thread except the profiler's own is sampled;
+in "marker" mode only the event-loop thread is sampled, and only while it
+runs a request that carries the X-Profile header.
+
+MemoryProfiler wraps tracemalloc: take a baseline snapshot, let traffic
+run, then diff a new snapshot against it to see which lines allocated the
+most.
+
+Both profilers live in the worker that serves the admin request; with
+several uvicorn workers each one is profiled separately.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter
+from typing import Optional
+
+MARKER_HEADER = b"x-profile"
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    marker = filename.rfind("site-packages" + os.sep)
+    if marker != -1:
+        filename = filename[marker + len("site-packages") + 1:]
+    elif filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+class CpuProfiler:
+    def __init__(self):
+        self.mode: Optional[str] = None
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        # Tasks serving requests with the marker header ("marker" mode)
+        self.marked_tasks: weakref.WeakSet = weakref.WeakSet()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.mode is not None
+
+    async def profile(self, seconds: float, interval_ms: float, mode: str = "all") -> dict:
+        """Sample for `seconds` and return the collapsed stacks"""
+        if self.running:
+            raise RuntimeError("A CPU profile is already running")
+
+        self.mode = mode
+        self.samples = Counter()
+        self.sample_count = 0
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopping.clear()
+
+        thread = threading.Thread(target=self._sample, args=(interval_ms / 1000,), name="cpu-profiler", daemon=True)
+        started = time.monotonic()
+        thread.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._stopping.set()
+            await asyncio.to_thread(thread.join)
+            self.mode = None
+            self.marked_tasks = weakref.WeakSet()
+
+        return {
+            "duration_seconds": round(time.monotonic() - started, 3),
+            "samples": self.sample_count,
+            "collapsed": "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+        }
+
+    def _sample(self, interval: float):
+        own_id = threading.get_ident()
+        thread_names = {}
+        while not self._stopping.wait(interval):
+            frames = sys._current_frames()
+
+            if self.mode == "marker":
+                task = asyncio.current_task(self._loop)
+                frame = frames.get(self._loop_thread_id)
+                if task is None or task not in self.marked_tasks or frame is None:
+                    continue
+                self.samples[_collapse(frame)] += 1
+                self.sample_count += 1
+                continue
+
+            if len(thread_names) != threading.active_count():
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                name = thread_names.get(thread_id, str(thread_id))
+                self.samples[f"{name};{_collapse(frame)}"] += 1
+            self.sample_count += 1
+
+class MemoryProfiler:
+    def __init__(self):
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.baseline_at: Optional[float] = None
+
+    def snapshot(self, frames: int) -> dict:
+        """Start tracing if needed and record a new baseline"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.baseline = tracemalloc.take_snapshot()
+        self.baseline_at = time.time()
+        current, peak = tracemalloc.get_traced_memory()
+        return {"tracing": True, "traced_bytes": current, "peak_bytes": peak}
+
+    def diff(self, group_by: str, limit: int) -> dict:
+        """Allocation growth since the baseline, largest first"""
+        if self.baseline is None or not tracemalloc.is_tracing():
+            raise RuntimeError("Take a baseline snapshot first")
+
+        snapshot = tracemalloc.take_snapshot()
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ]
+        stats = snapshot.filter_traces(filters).compare_to(self.baseline.filter_traces(filters), group_by)
+
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "since_seconds": round(time.time() - self.baseline_at, 1),
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top": [
+                {
+                    "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                    "size_diff_bytes": stat.size_diff,
+                    "size_bytes": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count
+                }
+                for stat in stats[:limit]
+            ]
+        }
+
+    def stop(self):
+        self.baseline = None
+        self.baseline_at = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+cpu_profiler = CpuProfiler()
+memory_profiler = MemoryProfiler()
+
+class ProfilerMiddleware:
+    """Marks request tasks that carry the X-Profile header while a marker profile runs"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and cpu_profiler.mode == "marker":
+            if any(key == MARKER_HEADER for key, _ in scope.get("headers", [])):
+                cpu_profiler.marked_tasks.add(asyncio.current_task())
+        await self.app(scope, receive, send)
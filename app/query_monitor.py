@@ -0,0 +1,244 @@
+"""
+Query shape recorder
+
+A pymongo CommandListener that normalizes every read/update/delete into a
+shape (collection, operation, filter keys and operators, sort) and keeps
+per-shape counts and latencies. Aggregates are flushed periodically to the
+`query_shapes` collection, together with a sample filter, so
+`index_advisor.py` can explain them and suggest indexes from real traffic.
+The sample keeps the latest filter's fields, operators and value types but
+not its values (emails, token ids), which never reach the collection.
+Filters are stored as (extended) JSON strings because their operators are
+not valid field names in a stored document.
+
+Listener callbacks run on pymongo's threads, so the in-memory aggregates
+are guarded by a lock; no I/O happens inside a callback.
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId, Regex, json_util
+from pymongo import UpdateOne, monitoring
+from app.config import settings
+
+QUERY_SHAPES_COLLECTION = "query_shapes"
+
+# Commands whose filter can use an index
+FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+
+IGNORED_DATABASES = {"admin", "config", "local"}
+
+# Filter values are replaced by this marker; operators are kept
+PLACEHOLDER = "?"
+
+def normalize_filter(value):
+    """Replace literal values with a placeholder, keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: normalize_filter(value[key]) for key in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        # Lists of sub-filters ($and/$or) keep their structure, value lists collapse
+        if value and all(isinstance(item, dict) for item in value):
+            return [normalize_filter(item) for item in value]
+    return PLACEHOLDER
+
+# Operators whose values describe the query, not the data; kept when redacting
+STRUCTURAL_OPERATORS = {"$exists", "$type"}
+
+# Stand-ins of the same BSON type for redacted sample values
+REDACTED_VALUES = [
+    (int, 0),
+    (float, 0.0),
+    (str, ""),
+    (bytes, b""),
+    (datetime, datetime(1970, 1, 1)),
+    (ObjectId, ObjectId("0" * 24)),
+]
+
+def redact_filter(value):
+    """
+    A concrete filter with every value replaced by a stand-in of its type.
+    Booleans and the values of $exists/$type are kept: they are not personal
+    data and can change the plan MongoDB picks.
+    """
+    if isinstance(value, dict):
+        return {
+            key: item if key in STRUCTURAL_OPERATORS else redact_filter(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        # Sub-filters ($and/$or) keep their structure; value lists keep one element
+        if value and all(isinstance(item, dict) for item in value):
+            return [redact_filter(item) for item in value]
+        return [redact_filter(value[0])] if value else []
+    if isinstance(value, (re.Pattern, Regex)):
+        return Regex("")
+    if isinstance(value, bool):
+        return value
+    for value_type, stand_in in REDACTED_VALUES:
+        if isinstance(value, value_type):
+            return stand_in
+    return None
+
+def extract_query(command_name: str, command: dict):
+    """
+    Returns: (collection, filter, sort) for commands that carry a filter,
+    or None for everything else (inserts, admin commands, ...)
+    """
+    if command_name in FILTER_FIELDS:
+        return command[command_name], command.get(FILTER_FIELDS[command_name]) or {}, command.get("sort")
+
+    if command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes") or []
+        if not statements:
+            return None
+        return command[command_name], statements[0].get("q") or {}, None
+
+    if command_name == "aggregate" and isinstance(command.get("aggregate"), str):
+        pipeline = command.get("pipeline") or []
+        query, sort = {}, None
+        for stage in pipeline[:2]:
+            if "$match" in stage and not query:
+                query = stage["$match"]
+            elif "$sort" in stage and sort is None:
+                sort = stage["$sort"]
+            else:
+                break
+        return command["aggregate"], query, sort
+
+    return None
+
+def shape_id(collection: str, operation: str, filter_shape: dict, sort_shape) -> str:
+    key = json.dumps([collection, operation, filter_shape, sort_shape], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+class QueryShapeRecorder(monitoring.CommandListener):
+    def __init__(self, flush_seconds: int, max_pending: int = 10000):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._shapes = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # CommandListener interface (called on pymongo threads)
+
+    def started(self, event):
+        if event.database_name in IGNORED_DATABASES:
+            return
+        query = extract_query(event.command_name, event.command)
+        if query is None:
+            return
+        collection, filter_doc, sort = query
+        if collection == QUERY_SHAPES_COLLECTION:
+            return
+
+        with self._lock:
+            if len(self._pending) < self.max_pending:
+                self._pending[(event.connection_id, event.request_id)] = (
+                    collection, event.command_name, filter_doc, sort
+                )
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            query = self._pending.pop((event.connection_id, event.request_id), None)
+        if query is None:
+            return
+
+        collection, operation, filter_doc, sort = query
+        filter_shape = normalize_filter(filter_doc)
+        sort_shape = dict(sort) if sort else None
+        key = shape_id(collection, operation, filter_shape, sort_shape)
+        sample_filter = json_util.dumps(redact_filter(filter_doc))
+        duration_ms = event.duration_micros / 1000
+
+        with self._lock:
+            shape = self._shapes.get(key)
+            if shape is None:
+                shape = self._shapes[key] = {
+                    "collection": collection,
+                    "operation": operation,
+                    "filter": json.dumps(filter_shape, sort_keys=True),
+                    "sort": sort_shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                }
+            shape["count"] += 1
+            shape["total_ms"] += duration_ms
+            shape["max_ms"] = max(shape["max_ms"], duration_ms)
+            shape["sample_filter"] = sample_filter
+            shape["sample_sort"] = sort_shape
+
+    # Flushing (runs on the event loop)
+
+    def start(self, database):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(database))
+
+    async def stop(self, database):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.flush(database)
+
+    async def _run(self, database):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush(database)
+            except Exception as e:
+                print(f"Error flushing query shapes: {e}")
+
+    async def flush(self, database):
+        with self._lock:
+            shapes, self._shapes = self._shapes, {}
+        if not shapes:
+            return
+
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"_id": key},
+                {
+                    "$setOnInsert": {
+                        "collection": shape["collection"],
+                        "operation": shape["operation"],
+                        "filter": shape["filter"],
+                        "sort": shape["sort"],
+                        "first_seen": now
+                    },
+                    "$inc": {"count": shape["count"], "total_ms": shape["total_ms"]},
+                    "$max": {"max_ms": shape["max_ms"]},
+                    "$set": {
+                        "sample_filter": shape["sample_filter"],
+                        "sample_sort": shape["sample_sort"],
+                        "last_seen": now
+                    }
+                },
+                upsert=True
+            )
+            for key, shape in shapes.items()
+        ]
+        await database[QUERY_SHAPES_COLLECTION].bulk_write(operations, ordered=False)
+
+query_recorder = QueryShapeRecorder(settings.QUERY_MONITOR_FLUSH_SECONDS)
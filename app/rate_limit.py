@@ -0,0 +1,261 @@
+"""
+Admission control: per-principal rate limits and adaptive load shedding
+
+Expensive routes are limited with token buckets keyed by the authenticated
+principal (JWT subject) when present, otherwise by client IP. Behind a
+reverse proxy or load balancer the client IP is taken from X-Forwarded-For,
+walking back from the nearest hop past the addresses listed in
+RATE_LIMIT_TRUSTED_PROXIES (the header is ignored when the peer is not one
+of them). Buckets live in process memory by default; set
+RATE_LIMIT_BACKEND=mongo to share them across workers through the
+`rate_limits` collection.
+
+Independently, a LoadMonitor samples event-loop lag and MongoDB ping
+latency. When either crosses its threshold, low-priority routes are
+rejected with 503 before they do any work; at twice the threshold normal
+routes are shed too. High-priority routes (checkout, agent updates) are
+never shed.
+"""
+
+import asyncio
+import ipaddress
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from jose import jwt, JWTError
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.responses import JSONResponse
+from app.config import settings
+from app.database import get_database, get_rate_limits_collection
+
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+# (method, path pattern, rule name, requests per minute, burst, priority)
+ROUTE_RULES = [
+    ("POST", re.compile(r"^/api/(user|agent|admin)/login$"), "login", 10, 5, PRIORITY_NORMAL),
+    ("POST", re.compile(r"^/api/(user|agent)/signup$"), "signup", 5, 3, PRIORITY_NORMAL),
+    ("POST", re.compile(r"^/api/user/reset-password(/confirm)?$"), "reset", 5, 3, PRIORITY_LOW),
+    ("POST", re.compile(r"^/api/order/create$"), "order", 20, 5, PRIORITY_HIGH),
+    ("POST", re.compile(r"^/api/order/quote$"), "quote", 60, 20, PRIORITY_NORMAL),
+    ("PUT", re.compile(r"^/api/agent/update-location$"), "location", 240, 30, PRIORITY_HIGH),
+    ("GET", re.compile(r"^/api/admin/(users|agents|orders|stores|zones)$"), "admin_list", 30, 10, PRIORITY_LOW),
+    ("GET", re.compile(r"^/api/admin/map/agents$"), "admin_map", 120, 20, PRIORITY_LOW),
+    ("GET", re.compile(r"^/api/admin/orders/export$"), "admin_export", 6, 2, PRIORITY_LOW),
+]
+
+EXEMPT_PATHS = {"/", "/health", "/ready", "/metrics", "/docs", "/openapi.json"}
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, capacity: float):
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+class InMemoryRateLimiter:
+    """Token buckets per (rule, principal), bounded by an LRU"""
+
+    def __init__(self, max_buckets: int = 100000):
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict = OrderedDict()
+
+    async def allow(self, key: str, per_minute: int, burst: int) -> Tuple[bool, float]:
+        """Returns: (allowed, seconds until a token is available)"""
+        now = time.monotonic()
+        rate = per_minute / 60.0
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(burst)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated_at) * rate)
+            bucket.updated_at = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True, 0.0
+        return False, (1 - bucket.tokens) / rate
+
+class MongoRateLimiter:
+    """
+    The in-memory token buckets, shared by all workers (GCRA): each bucket
+    is one document holding `tat`, the unix time at which it will be full
+    again. A request is allowed while `tat` is at most burst - 1 intervals
+    ahead, and pushes it one interval further in a single conditional
+    update. Bucket documents expire through a TTL index on `expires_at`.
+    """
+
+    async def allow(self, key: str, per_minute: int, burst: int) -> Tuple[bool, float]:
+        collection = get_rate_limits_collection()
+        interval = 60.0 / per_minute
+        while True:
+            now = time.time()
+            allow_until = now + (burst - 1) * interval
+            try:
+                await collection.find_one_and_update(
+                    {"_id": key, "tat": {"$lte": allow_until}},
+                    [{"$set": {
+                        "tat": {"$add": [{"$max": ["$tat", now]}, interval]},
+                        "expires_at": datetime.utcnow() + timedelta(seconds=burst * interval + 60)
+                    }}],
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                return True, 0.0
+            except DuplicateKeyError:
+                pass  # the bucket exists and is empty (the upsert collided with it)
+            bucket = await collection.find_one({"_id": key}, {"tat": 1})
+            if bucket is not None and bucket["tat"] > allow_until:
+                return False, bucket["tat"] - allow_until
+            # Expired or refilled meanwhile: try again
+
+class LoadMonitor:
+    """Samples event-loop lag and MongoDB latency as exponential moving averages"""
+
+    def __init__(self, interval_seconds: float = 0.5, alpha: float = 0.3):
+        self.interval_seconds = interval_seconds
+        self.alpha = alpha
+        self.loop_lag_ms = 0.0
+        self.mongo_latency_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        ticks = 0
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval_seconds)
+            lag_ms = max(0.0, (time.perf_counter() - started - self.interval_seconds) * 1000)
+            self.loop_lag_ms += self.alpha * (lag_ms - self.loop_lag_ms)
+
+            ticks += 1
+            if ticks % 10 == 0 and get_database() is not None:
+                started = time.perf_counter()
+                try:
+                    await get_database().command("ping")
+                    latency_ms = (time.perf_counter() - started) * 1000
+                except Exception:
+                    latency_ms = settings.SHED_MONGO_LATENCY_MS * 2
+                self.mongo_latency_ms += self.alpha * (latency_ms - self.mongo_latency_ms)
+
+    def pressure(self) -> float:
+        """Load relative to the shedding thresholds (1.0 = at threshold)"""
+        return max(
+            self.loop_lag_ms / settings.SHED_LOOP_LAG_MS,
+            self.mongo_latency_ms / settings.SHED_MONGO_LATENCY_MS
+        )
+
+    def should_shed(self, priority: int) -> bool:
+        if priority >= PRIORITY_HIGH:
+            return False
+        pressure = self.pressure()
+        if priority == PRIORITY_LOW:
+            return pressure >= 1.0
+        return pressure >= 2.0
+
+load_monitor = LoadMonitor()
+rate_limiter = MongoRateLimiter() if settings.RATE_LIMIT_BACKEND == "mongo" else InMemoryRateLimiter()
+
+def _parse_networks(value: str):
+    return [ipaddress.ip_network(entry.strip(), strict=False) for entry in value.split(",") if entry.strip()]
+
+trusted_proxies = _parse_networks(settings.RATE_LIMIT_TRUSTED_PROXIES)
+
+def _is_trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+def client_ip(scope) -> str:
+    """
+    The caller's address: the peer, or behind trusted proxies the nearest
+    X-Forwarded-For entry that is not a trusted proxy itself
+    """
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if not trusted_proxies or not _is_trusted(address):
+        return address
+    forwarded = []
+    for key, value in scope.get("headers", []):
+        if key == b"x-forwarded-for":
+            forwarded.extend(entry.strip() for entry in value.decode("latin-1").split(","))
+    for entry in reversed([entry for entry in forwarded if entry]):
+        address = entry
+        if not _is_trusted(entry):
+            break
+    return address
+
+def _principal(scope) -> str:
+    """JWT subject when a valid bearer token is present, otherwise the client IP"""
+    for key, value in scope.get("headers", []):
+        if key == b"authorization":
+            token = value.decode("latin-1").partition(" ")[2]
+            try:
+                payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+                return f"{payload.get('type')}:{payload.get('sub')}"
+            except JWTError:
+                break
+    return f"ip:{client_ip(scope)}"
+
+def _match_rule(method: str, path: str):
+    for rule_method, pattern, name, per_minute, burst, priority in ROUTE_RULES:
+        if method == rule_method and pattern.match(path):
+            return name, per_minute, burst, priority
+    return None
+
+class AdmissionControlMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.RATE_LIMIT_ENABLED or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        rule = _match_rule(scope["method"], scope["path"])
+        priority = rule[3] if rule else PRIORITY_NORMAL
+
+        if load_monitor.should_shed(priority):
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry shortly"},
+                status_code=503,
+                headers={"Retry-After": "2"}
+            )
+            await response(scope, receive, send)
+            return
+
+        if rule:
+            name, per_minute, burst, _ = rule
+            allowed, retry_after = await rate_limiter.allow(f"{name}:{_principal(scope)}", per_minute, burst)
+            if not allowed:
+                response = JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+                )
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
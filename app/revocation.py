@@ -0,0 +1,164 @@
+"""
+Access token revocation
+
+Revoked token ids (`jti`) are stored in the `revoked_tokens` collection
+until the token would have expired anyway (TTL index on `expires_at`).
+Each worker mirrors the collection into a Bloom filter that it refreshes
+incrementally, so checking a token on the hot path is a few bit lookups;
+the collection is only queried when the filter reports a possible hit.
+
+Each refresh re-reads REVOCATION_REFRESH_OVERLAP_SECONDS behind the newest
+revocation it has seen: another worker's insert can become visible after
+newer ones (clock skew, slow writes), and adding an id twice is harmless.
+
+Refreshes run in a background task started by the application lifespan,
+so no request waits for a scan and a failed refresh keeps the current
+filter. Without a lifespan (the serverless deployment) a request that finds
+the filter stale starts a refresh in the background and is answered from
+the current filter. Until a first refresh has succeeded, tokens are looked
+up in the collection directly.
+"""
+
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta
+from math import ceil, log
+from typing import Optional
+from pymongo.errors import DuplicateKeyError
+from app.config import settings
+from app.database import get_revoked_tokens_collection
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, ceil(-capacity * log(error_rate) / (log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RevocationList:
+    def __init__(self, capacity: int, error_rate: float, refresh_seconds: int, rebuild_seconds: int,
+                 overlap_seconds: int = 60):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._rebuilding: Optional[BloomFilter] = None
+        self._cursor: Optional[datetime] = None
+        self._refreshed_at = 0.0
+        self._rebuilt_at = 0.0
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+        self._background: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        # The warm-up does the first load
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            await self._refresh_logged(force=True)
+
+    async def _refresh_logged(self, force: bool = False):
+        try:
+            await self.refresh(force)
+        except Exception as e:
+            print(f"⚠️  Revocation refresh failed, keeping the current filter: {type(e).__name__}: {e}")
+
+    async def refresh(self, force: bool = False):
+        """Pull revocations made since the last refresh (by any worker)"""
+        now = time.monotonic()
+        if not force and now - self._refreshed_at < self.refresh_seconds:
+            return
+        self._refreshed_at = now
+
+        # Periodically start over so ids of expired tokens drop out of the filter.
+        # The new filter is filled aside and swapped in complete: until then
+        # the current one keeps answering is_revoked()
+        if not self._loaded or now - self._rebuilt_at > self.rebuild_seconds:
+            bloom = self._rebuilding = BloomFilter(self.capacity, self.error_rate)
+            cursor_position = None
+            try:
+                cursor = get_revoked_tokens_collection().find({}, {"revoked_at": 1}).sort("revoked_at", 1)
+                async for entry in cursor:
+                    bloom.add(entry["_id"])
+                    cursor_position = entry["revoked_at"]
+            finally:
+                self._rebuilding = None
+            self._bloom = bloom
+            self._cursor = cursor_position
+            self._rebuilt_at = now
+            self._loaded = True
+            return
+
+        query = {}
+        if self._cursor is not None:
+            query["revoked_at"] = {"$gte": self._cursor - self.overlap}
+
+        cursor = get_revoked_tokens_collection().find(query, {"revoked_at": 1}).sort("revoked_at", 1)
+        async for entry in cursor:
+            self._bloom.add(entry["_id"])
+            self._cursor = max(self._cursor, entry["revoked_at"]) if self._cursor else entry["revoked_at"]
+
+    async def is_revoked(self, jti: Optional[str]) -> bool:
+        if not jti:
+            return False
+        if self._task is None and time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+            # No lifespan started the refresher: refresh without holding up this request
+            self._background = asyncio.get_running_loop().create_task(self._refresh_logged())
+        if self._loaded and not self._bloom.might_contain(jti):
+            return False
+        return await get_revoked_tokens_collection().find_one({"_id": jti}, {"_id": 1}) is not None
+
+    async def revoke(self, payload: dict):
+        """Revoke a decoded access token until its expiry"""
+        jti = payload.get("jti")
+        if not jti:
+            return
+        try:
+            await get_revoked_tokens_collection().insert_one({
+                "_id": jti,
+                "sub": payload.get("sub"),
+                "type": payload.get("type"),
+                "revoked_at": datetime.utcnow(),
+                "expires_at": datetime.utcfromtimestamp(payload["exp"])
+            })
+        except DuplicateKeyError:
+            pass
+        self._bloom.add(jti)
+        if self._rebuilding is not None:
+            self._rebuilding.add(jti)
+
+revocation_list = RevocationList(
+    settings.REVOCATION_BLOOM_CAPACITY,
+    settings.REVOCATION_BLOOM_ERROR_RATE,
+    settings.REVOCATION_REFRESH_SECONDS,
+    settings.REVOCATION_REBUILD_SECONDS,
+    settings.REVOCATION_REFRESH_OVERLAP_SECONDS
+)
@@ -1,12 +1,27 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import Optional
 from app.models import (AdminLogin, ProductCreate, ProductUpdate, DeliverySettings, 
-                        AgentAssign, OrderStatusUpdate, Token)
-from app.auth import hash_password, verify_password, create_access_token, get_current_admin
+                        AgentAssign, OrderStatusUpdate, StoreCreate, StoreUpdate, StoreStock,
+                        DeliveryZone, Token)
+from app.auth import (hash_password, verify_password, create_access_token, get_current_admin,
+                      security, revoke_token)
+from fastapi.security import HTTPAuthorizationCredentials
 from app.database import (get_admins_collection, get_users_collection, get_agents_collection,
-                          get_products_collection, get_orders_collection, get_delivery_settings_collection)
+                          get_products_collection, get_orders_collection, get_delivery_settings_collection,
+                          get_stores_collection, get_delivery_zones_collection, ANALYTICS, EXPORT)
 from app.email_service import email_service
+from app.events import event_bus, OrderEvent, OrderEventType
+from app.store_index import store_index
+from app.zones import zone_index
+from app.pricing import invalidate_saved_address_quotes
+from app.catalog import catalog_cache
+from app.profiler import cpu_profiler, memory_profiler
 from datetime import datetime
 from bson import ObjectId
+import csv
+import io
+import os
 from app.config import settings
 
 router = APIRouter()
@@ -26,13 +41,22 @@ async def admin_login(admin_data: AdminLogin):
     
     return {"access_token": access_token, "token_type": "bearer"}
 
+@router.post("/logout")
+async def admin_logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Revoke the current access token"""
+    await revoke_token(credentials)
+    return {"message": "Logged out successfully"}
+
 @router.get("/dashboard")
 async def get_dashboard(current_admin: dict = Depends(get_current_admin)):
     """Get admin dashboard statistics"""
-    users_collection = get_users_collection()
-    agents_collection = get_agents_collection()
-    products_collection = get_products_collection()
-    orders_collection = get_orders_collection()
+    users_collection = get_users_collection(ANALYTICS)
+    agents_collection = get_agents_collection(ANALYTICS)
+    products_collection = get_products_collection(ANALYTICS)
+    orders_collection = get_orders_collection(ANALYTICS)
     
     total_users = await users_collection.count_documents({})
     total_agents = await agents_collection.count_documents({"approved": True})
@@ -53,7 +77,7 @@ async def get_dashboard(current_admin: dict = Depends(get_current_admin)):
 @router.get("/users")
 async def get_all_users(current_admin: dict = Depends(get_current_admin)):
     """Get all users"""
-    users_collection = get_users_collection()
+    users_collection = get_users_collection(ANALYTICS)
     
     users = await users_collection.find({}).to_list(1000)
     
@@ -67,7 +91,7 @@ async def get_all_users(current_admin: dict = Depends(get_current_admin)):
 @router.get("/agents")
 async def get_all_agents(current_admin: dict = Depends(get_current_admin)):
     """Get all agents"""
-    agents_collection = get_agents_collection()
+    agents_collection = get_agents_collection(ANALYTICS)
     
     agents = await agents_collection.find({}).to_list(1000)
     
@@ -78,6 +102,46 @@ async def get_all_agents(current_admin: dict = Depends(get_current_admin)):
     
     return agents
 
+@router.get("/map/agents")
+async def get_map_agents(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lng: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lng: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=0, le=22),
+    since: Optional[float] = None,
+    format: str = Query("json", pattern="^(json|msgpack)$"),
+    current_admin: dict = Depends(get_current_admin)
+):
+    """
+    Live map feed: agents inside the viewport in a compact columnar format.
+    Clustered below MAP_CLUSTER_MAX_ZOOM; pass `since` (the previous
+    server_time) to receive only agents that moved since then.
+    """
+    if min_lat > max_lat or min_lng > max_lng:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    
+    # NumPy-backed; imported on first use to keep cold starts fast
+    from app.fleet_store import fleet_store, STATUS_BUSY
+    from app.map_feed import build_fleet_snapshot
+    
+    await fleet_store.sync_from_db(get_agents_collection())
+    
+    snapshot = build_fleet_snapshot(
+        min_lat, min_lng, max_lat, max_lng,
+        zoom=zoom,
+        since=since,
+        precision=settings.MAP_COORD_PRECISION,
+        cluster_max_zoom=settings.MAP_CLUSTER_MAX_ZOOM,
+        busy_status=STATUS_BUSY
+    )
+    
+    if format == "msgpack":
+        import msgpack
+        return Response(content=msgpack.packb(snapshot), media_type="application/x-msgpack")
+    
+    return snapshot
+
 @router.put("/agent/approve/{agent_id}")
 async def approve_agent(
     agent_id: str,
@@ -96,6 +160,11 @@ async def approve_agent(
         {"$set": {"approved": approve, "updated_at": datetime.utcnow()}}
     )
     
+    if not approve:
+        # Off this worker's live map now; other workers drop it on their next fleet sync
+        from app.fleet_store import fleet_store
+        fleet_store.remove(agent_id)
+    
     # Send email notification
     await email_service.send_agent_approval_email(
         agent["email"],
@@ -127,6 +196,7 @@ async def add_product(
     }
     
     result = await products_collection.insert_one(product_dict)
+    await catalog_cache.reload()
     
     return {"message": "Product added successfully", "product_id": str(result.inserted_id)}
 
@@ -169,6 +239,7 @@ async def update_product(
             {"_id": ObjectId(product_id)},
             {"$set": update_data}
         )
+        await catalog_cache.reload()
     
     return {"message": "Product updated successfully"}
 
@@ -184,13 +255,202 @@ async def delete_product(
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await catalog_cache.reload()
     
     return {"message": "Product deleted successfully"}
 
+@router.get("/stores")
+async def get_all_stores(current_admin: dict = Depends(get_current_admin)):
+    """Get all stores with their inventory"""
+    stores_collection = get_stores_collection()
+    
+    stores = await stores_collection.find({}).to_list(1000)
+    
+    for store in stores:
+        store["id"] = str(store["_id"])
+        store.pop("_id")
+    
+    return stores
+
+@router.post("/store/add")
+async def add_store(
+    store_data: StoreCreate,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Add new dark store"""
+    stores_collection = get_stores_collection()
+    
+    store_dict = {
+        "name": store_data.name,
+        "address": store_data.address,
+        "lat": store_data.lat,
+        "lng": store_data.lng,
+        "inventory": {
+            product_id: stock.model_dump()
+            for product_id, stock in store_data.inventory.items()
+        },
+        "isActive": store_data.isActive,
+        "created_at": datetime.utcnow()
+    }
+    
+    result = await stores_collection.insert_one(store_dict)
+    store_index.invalidate()
+    await invalidate_saved_address_quotes()
+    
+    return {"message": "Store added successfully", "store_id": str(result.inserted_id)}
+
+@router.put("/store/update/{store_id}")
+async def update_store(
+    store_id: str,
+    store_data: StoreUpdate,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Update store details or location"""
+    stores_collection = get_stores_collection()
+    
+    update_data = store_data.model_dump(exclude_none=True)
+    if update_data:
+        update_data["updated_at"] = datetime.utcnow()
+        result = await stores_collection.update_one(
+            {"_id": ObjectId(store_id)},
+            {"$set": update_data}
+        )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="Store not found")
+        store_index.invalidate()
+        await invalidate_saved_address_quotes()
+    
+    return {"message": "Store updated successfully"}
+
+@router.put("/store/inventory/{store_id}/{product_id}")
+async def update_store_stock(
+    store_id: str,
+    product_id: str,
+    stock_data: StoreStock,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Set a store's stock for one product"""
+    stores_collection = get_stores_collection()
+    
+    update_data = {
+        f"inventory.{product_id}.{field}": value
+        for field, value in stock_data.model_dump(exclude_none=True).items()
+    }
+    if update_data:
+        update_data["updated_at"] = datetime.utcnow()
+        result = await stores_collection.update_one(
+            {"_id": ObjectId(store_id)},
+            {"$set": update_data}
+        )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="Store not found")
+        store_index.invalidate()
+    
+    return {"message": "Store inventory updated successfully"}
+
+@router.delete("/store/delete/{store_id}")
+async def delete_store(
+    store_id: str,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Delete store"""
+    stores_collection = get_stores_collection()
+    
+    result = await stores_collection.delete_one({"_id": ObjectId(store_id)})
+    
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Store not found")
+    store_index.invalidate()
+    await invalidate_saved_address_quotes()
+    
+    return {"message": "Store deleted successfully"}
+
+def _validate_zone_polygon(zone_data: DeliveryZone):
+    for vertex in zone_data.polygon:
+        if len(vertex) != 2 or not (-90 <= vertex[0] <= 90) or not (-180 <= vertex[1] <= 180):
+            raise HTTPException(status_code=400, detail="Polygon vertices must be [lat, lng] pairs")
+
+@router.get("/zones")
+async def get_all_zones(current_admin: dict = Depends(get_current_admin)):
+    """Get all delivery zones"""
+    zones_collection = get_delivery_zones_collection()
+    
+    zones = await zones_collection.find({}).sort("priority", -1).to_list(1000)
+    
+    for zone in zones:
+        zone["id"] = str(zone["_id"])
+        zone.pop("_id")
+    
+    return zones
+
+@router.post("/zone/add")
+async def add_zone(
+    zone_data: DeliveryZone,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Add delivery zone with its own fee tier"""
+    zones_collection = get_delivery_zones_collection()
+    admin = current_admin["admin"]
+    _validate_zone_polygon(zone_data)
+    
+    zone_dict = zone_data.model_dump()
+    zone_dict.update({
+        "updated_by": admin["email"],
+        "created_at": datetime.utcnow()
+    })
+    
+    result = await zones_collection.insert_one(zone_dict)
+    zone_index.invalidate()
+    await invalidate_saved_address_quotes()
+    
+    return {"message": "Delivery zone added successfully", "zone_id": str(result.inserted_id)}
+
+@router.put("/zone/update/{zone_id}")
+async def update_zone(
+    zone_id: str,
+    zone_data: DeliveryZone,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Replace a delivery zone's polygon and fee tier"""
+    zones_collection = get_delivery_zones_collection()
+    admin = current_admin["admin"]
+    _validate_zone_polygon(zone_data)
+    
+    zone_dict = zone_data.model_dump()
+    zone_dict.update({
+        "updated_by": admin["email"],
+        "updated_at": datetime.utcnow()
+    })
+    
+    result = await zones_collection.update_one({"_id": ObjectId(zone_id)}, {"$set": zone_dict})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Delivery zone not found")
+    zone_index.invalidate()
+    await invalidate_saved_address_quotes()
+    
+    return {"message": "Delivery zone updated successfully"}
+
+@router.delete("/zone/delete/{zone_id}")
+async def delete_zone(
+    zone_id: str,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Delete delivery zone"""
+    zones_collection = get_delivery_zones_collection()
+    
+    result = await zones_collection.delete_one({"_id": ObjectId(zone_id)})
+    
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Delivery zone not found")
+    zone_index.invalidate()
+    await invalidate_saved_address_quotes()
+    
+    return {"message": "Delivery zone deleted successfully"}
+
 @router.get("/orders")
 async def get_all_orders(current_admin: dict = Depends(get_current_admin)):
     """Get all orders"""
-    orders_collection = get_orders_collection()
+    orders_collection = get_orders_collection(ANALYTICS)
     
     orders = await orders_collection.find({}).sort("created_at", -1).to_list(1000)
     
@@ -200,6 +460,48 @@ async def get_all_orders(current_admin: dict = Depends(get_current_admin)):
     
     return orders
 
+EXPORT_COLUMNS = ["order_number", "created_at", "status", "user_id", "agent_id", "items",
+                  "total_price", "delivery_fee", "final_price", "distance_km", "delivery_address"]
+
+@router.get("/orders/export")
+async def export_orders(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Export orders as CSV (streamed from a secondary, oldest first)"""
+    orders_collection = get_orders_collection(EXPORT)
+    
+    query = {}
+    if since or until:
+        query["created_at"] = {}
+        if since:
+            query["created_at"]["$gte"] = since
+        if until:
+            query["created_at"]["$lt"] = until
+    
+    projection = {column: 1 for column in EXPORT_COLUMNS}
+    cursor = orders_collection.find(query, projection).sort("created_at", 1).batch_size(500)
+    
+    async def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        async for order in cursor:
+            writer.writerow([
+                len(order.get(column) or []) if column == "items" else order.get(column, "")
+                for column in EXPORT_COLUMNS
+            ])
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    filename = f"orders-{datetime.utcnow():%Y%m%d-%H%M%S}.csv"
+    return StreamingResponse(rows(), media_type="text/csv",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 @router.put("/order/status/{order_id}")
 async def update_order_status(
     order_id: str,
@@ -208,7 +510,6 @@ async def update_order_status(
 ):
     """Update order status"""
     orders_collection = get_orders_collection()
-    users_collection = get_users_collection()
     
     order = await orders_collection.find_one({"_id": ObjectId(order_id)})
     if not order:
@@ -222,15 +523,10 @@ async def update_order_status(
         }}
     )
     
-    # Send email notification
-    user = await users_collection.find_one({"_id": ObjectId(order["user_id"])})
-    if user:
-        await email_service.send_order_status_email(
-            user["email"],
-            user["username"],
-            order["order_number"],
-            status_data.status
-        )
+    await event_bus.publish(OrderEvent.from_order(
+        OrderEventType.STATUS_CHANGED, order,
+        status=status_data.status.value, previous_status=order["status"], source="admin"
+    ))
     
     return {"message": "Order status updated successfully"}
 
@@ -243,7 +539,6 @@ async def assign_agent_to_order(
     """Assign agent to order"""
     orders_collection = get_orders_collection()
     agents_collection = get_agents_collection()
-    users_collection = get_users_collection()
     
     # Verify order exists
     order = await orders_collection.find_one({"_id": ObjectId(order_id)})
@@ -267,15 +562,12 @@ async def assign_agent_to_order(
         }}
     )
     
-    # Send email notification to user
-    user = await users_collection.find_one({"_id": ObjectId(order["user_id"])})
-    if user:
-        await email_service.send_order_assigned_email(
-            user["email"],
-            user["username"],
-            order["order_number"],
-            agent["name"]
-        )
+    # Tracking and the customer's email follow from the event
+    await event_bus.publish(OrderEvent.from_order(
+        OrderEventType.AGENT_ASSIGNED, order,
+        status="assigned", previous_status=order["status"], source="admin",
+        agent_id=agent_data.agent_id, agent_name=agent["name"]
+    ))
     
     return {"message": "Agent assigned successfully"}
 
@@ -320,6 +612,8 @@ async def update_delivery_settings(
     }
     
     await settings_collection.insert_one(settings_dict)
+    await catalog_cache.reload()
+    await invalidate_saved_address_quotes()
     
     # Update app settings for current session
     settings.BASE_DELIVERY_FEE = delivery_settings.base_delivery_fee
@@ -327,3 +621,55 @@ async def update_delivery_settings(
     settings.PRICE_PER_METER = delivery_settings.price_per_meter
     
     return {"message": "Delivery settings updated successfully"}
+
+@router.post("/profile/cpu", response_class=PlainTextResponse)
+async def profile_cpu(
+    seconds: float = Query(10, gt=0, le=120),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    mode: str = Query("all", pattern="^(all|marker)$"),
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Sample this worker's stacks and return them collapsed for flamegraphs"""
+    try:
+        profile = await cpu_profiler.profile(seconds, interval_ms, mode)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return PlainTextResponse(
+        profile["collapsed"],
+        headers={
+            "X-Profile-Samples": str(profile["samples"]),
+            "X-Profile-Duration": str(profile["duration_seconds"]),
+            "X-Profile-Pid": str(os.getpid())
+        }
+    )
+
+@router.post("/profile/memory/snapshot")
+async def profile_memory_snapshot(
+    frames: int = Query(10, ge=1, le=50),
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Start tracemalloc if needed and take a baseline snapshot"""
+    result = memory_profiler.snapshot(frames)
+    result["pid"] = os.getpid()
+    return result
+
+@router.get("/profile/memory/diff")
+async def profile_memory_diff(
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    limit: int = Query(20, ge=1, le=200),
+    current_admin: dict = Depends(get_current_admin)
+):
+    """Allocations that grew since the baseline snapshot"""
+    try:
+        result = memory_profiler.diff(group_by, limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result["pid"] = os.getpid()
+    return result
+
+@router.post("/profile/memory/stop")
+async def profile_memory_stop(current_admin: dict = Depends(get_current_admin)):
+    """Stop tracemalloc and drop the baseline"""
+    memory_profiler.stop()
+    return {"message": "Memory profiling stopped"}
@@ -1,13 +1,52 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from app.models import AgentSignup, AgentLogin, LocationUpdate, OrderStatusUpdate, Token
-from app.auth import hash_password, verify_password, create_access_token, get_current_agent
-from app.database import get_agents_collection, get_orders_collection, get_users_collection
-from app.email_service import email_service
+from app.auth import (hash_password, verify_password, create_access_token, get_current_agent,
+                      security, revoke_token)
+from fastapi.security import HTTPAuthorizationCredentials
+from app.database import get_agents_collection, get_orders_collection
+from app.events import event_bus, OrderEvent, OrderEventType
+from app.geofence import geofence_index, GeofenceEvent, ACTIVE_STATUSES, STATUS_TRANSITIONS
+from app.config import settings
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 router = APIRouter()
 
+async def advance_order_from_geofence(event: GeofenceEvent):
+    """Apply the status transition carried by a geofence event"""
+    orders_collection = get_orders_collection()
+    
+    # Only advance from a status the transition applies to: this worker's
+    # copy of the status may lag behind changes made on other workers
+    from_statuses, _ = STATUS_TRANSITIONS[(event.kind, event.transition)]
+    previous = await orders_collection.find_one_and_update(
+        {"_id": ObjectId(event.order_id), "agent_id": event.agent_id, "status": {"$in": list(from_statuses)}},
+        {"$set": {
+            "status": event.new_status,
+            "updated_at": datetime.utcnow(),
+            "status_source": "geofence"
+        }},
+        projection={"status": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
+        return False
+    
+    geofence_index.set_order_status(event.order_id, event.new_status)
+    
+    await event_bus.publish(OrderEvent(
+        type=OrderEventType.STATUS_CHANGED,
+        order_id=event.order_id,
+        order_number=event.order_number,
+        user_id=event.user_id,
+        status=event.new_status,
+        previous_status=previous["status"],
+        source="geofence",
+        agent_id=event.agent_id
+    ))
+    return True
+
 @router.post("/signup", response_model=Token)
 async def agent_signup(agent_data: AgentSignup):
     agents_collection = get_agents_collection()
@@ -61,6 +100,15 @@ async def agent_login(agent_data: AgentLogin):
     
     return {"access_token": access_token, "token_type": "bearer"}
 
+@router.post("/logout")
+async def agent_logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_agent: dict = Depends(get_current_agent)
+):
+    """Revoke the current access token"""
+    await revoke_token(credentials)
+    return {"message": "Logged out successfully"}
+
 @router.get("/profile")
 async def get_agent_profile(current_agent: dict = Depends(get_current_agent)):
     agent = current_agent["agent"]
@@ -99,20 +147,73 @@ async def update_location(
 ):
     """Update agent's current location for real-time tracking"""
     agents_collection = get_agents_collection()
+    orders_collection = get_orders_collection()
     agent = current_agent["agent"]
+    agent_id = str(agent["_id"])
     
-    await agents_collection.update_one(
+    current_location = {
+        "lat": location_data.lat,
+        "lng": location_data.lng,
+        "updated_at": datetime.utcnow()
+    }
+    if location_data.heading is not None:
+        current_location["heading"] = location_data.heading
+    
+    async def load_active_orders():
+        active_orders = await orders_collection.find(
+            {"agent_id": agent_id, "status": {"$in": list(ACTIVE_STATUSES)}}
+        ).to_list(100)
+        geofence_index.load_agent_orders(agent_id, active_orders)
+    
+    # Check the ping against the fences of the agent's active orders
+    if geofence_index.needs_refresh(agent_id):
+        await load_active_orders()
+    inside = geofence_index.locate(agent_id, location_data.lat, location_data.lng)
+    
+    # Swap the fences the agent is inside in one update: whichever worker
+    # handled the previous ping, each transition is seen exactly once
+    before = await agents_collection.find_one_and_update(
         {"_id": agent["_id"]},
-        {"$set": {
-            "current_location": {
-                "lat": location_data.lat,
-                "lng": location_data.lng,
-                "updated_at": datetime.utcnow()
-            }
-        }}
+        {"$set": {"current_location": current_location, "geofence_inside": sorted(inside)}},
+        projection={"geofence_inside": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    previous = set((before or {}).get("geofence_inside", []))
+    if not geofence_index.knows(previous):
+        # Fences of an order this worker has not loaded yet (assigned elsewhere):
+        # load them and correct the stored state unless a newer ping replaced it
+        await load_active_orders()
+        located = geofence_index.locate(agent_id, location_data.lat, location_data.lng)
+        if located != inside:
+            result = await agents_collection.update_one(
+                {"_id": agent["_id"], "geofence_inside": sorted(inside)},
+                {"$set": {"geofence_inside": sorted(located)}}
+            )
+            inside = located if result.modified_count else previous
+    
+    events = geofence_index.transitions(agent_id, previous, inside)
+    
+    geofence_events = []
+    for event in events:
+        event_dict = event.to_dict()
+        event_dict["applied"] = False
+        if settings.GEOFENCE_AUTO_ADVANCE and event.new_status:
+            event_dict["applied"] = await advance_order_from_geofence(event)
+        geofence_events.append(event_dict)
+    
+    # Keep the in-memory fleet state current for dispatch and live maps
+    # (NumPy-backed; imported on first use to keep cold starts fast)
+    from app.fleet_store import fleet_store, STATUS_AVAILABLE, STATUS_BUSY
+    fleet_store.upsert(
+        agent_id,
+        location_data.lat,
+        location_data.lng,
+        heading=location_data.heading,
+        vehicle_type=agent.get("vehicle_type"),
+        status=STATUS_BUSY if geofence_index.active_order_count(agent_id) else STATUS_AVAILABLE
     )
     
-    return {"message": "Location updated successfully"}
+    return {"message": "Location updated successfully", "geofence_events": geofence_events}
 
 @router.put("/order-status/{order_id}")
 async def update_order_status(
@@ -122,7 +223,6 @@ async def update_order_status(
 ):
     """Update order status by agent"""
     orders_collection = get_orders_collection()
-    users_collection = get_users_collection()
     agent = current_agent["agent"]
     
     # Verify order belongs to this agent
@@ -142,14 +242,9 @@ async def update_order_status(
         }}
     )
     
-    # Send email notification to user
-    user = await users_collection.find_one({"_id": ObjectId(order["user_id"])})
-    if user:
-        await email_service.send_order_status_email(
-            user["email"],
-            user["username"],
-            order["order_number"],
-            status_data.status
-        )
+    await event_bus.publish(OrderEvent.from_order(
+        OrderEventType.STATUS_CHANGED, order,
+        status=status_data.status.value, previous_status=order["status"], source="agent"
+    ))
     
     return {"message": "Order status updated successfully"}
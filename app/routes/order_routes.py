@@ -1,45 +1,75 @@
-from fastapi import APIRouter, HTTPException, Depends
-from app.models import OrderCreate, OrderItem
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from app.models import OrderCreate, OrderItem, OrderQuoteRequest
 from app.auth import get_current_user
 from app.database import (get_orders_collection, get_products_collection, 
-                          get_users_collection, get_delivery_settings_collection)
-from app.maps_service import maps_service
-from app.email_service import email_service
+                          get_users_collection, get_stores_collection)
+from app.events import event_bus, OrderEvent, OrderEventType
+from app.store_index import store_index, update_store_inventory
+from app.order_numbers import order_number_allocator
+from app.pricing import (get_delivery_fee_settings, resolve_delivery_zone, price_items, build_quote,
+                         create_quote_token, decode_quote_token, saved_address_quote,
+                         refresh_saved_address_quote)
 from datetime import datetime, timedelta
 from bson import ObjectId
-import random
-import string
 from app.config import settings
 
 router = APIRouter()
 
-def generate_order_number():
-    """Generate unique order number"""
-    timestamp = datetime.utcnow().strftime("%Y%m%d")
-    random_part = ''.join(random.choices(string.digits, k=6))
-    return f"VG{timestamp}{random_part}"
-
-async def get_delivery_fee_settings():
-    """Get current delivery fee settings from database or config"""
-    settings_collection = get_delivery_settings_collection()
-    settings_doc = await settings_collection.find_one({}, sort=[("updated_at", -1)])
+@router.get("/delivery/serviceability")
+async def check_serviceability(lat: float, lng: float):
+    """Check whether an address can be served and which fee tier applies"""
+    serviceable, zone = await resolve_delivery_zone(lat, lng)
+    
+    if not serviceable:
+        return {"serviceable": False}
     
-    if settings_doc:
+    if zone:
         return {
-            "base_fee": settings_doc["base_delivery_fee"],
-            "per_km": settings_doc["price_per_km"],
-            "per_meter": settings_doc["price_per_meter"]
+            "serviceable": True,
+            "zone_id": str(zone["_id"]),
+            "zone_name": zone["name"],
+            "base_delivery_fee": zone["base_delivery_fee"],
+            "price_per_km": zone["price_per_km"]
         }
     
+    fee_settings = await get_delivery_fee_settings()
+    return {
+        "serviceable": True,
+        "zone_id": None,
+        "zone_name": None,
+        "base_delivery_fee": fee_settings["base_fee"],
+        "price_per_km": fee_settings["per_km"]
+    }
+
+@router.post("/order/quote")
+async def quote_order(
+    quote_data: OrderQuoteRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Price a cart and its delivery, returning a short-lived signed quote token"""
+    user = current_user["user"]
+    
+    quote = await build_quote(quote_data.items, quote_data.lat, quote_data.lng)
+    
+    quote_token = create_quote_token(
+        str(user["_id"]), quote_data.lat, quote_data.lng, quote_data.items, quote
+    )
+    
     return {
-        "base_fee": settings.BASE_DELIVERY_FEE,
-        "per_km": settings.PRICE_PER_KM,
-        "per_meter": settings.PRICE_PER_METER
+        "quote_token": quote_token,
+        "expires_in": settings.QUOTE_TTL_SECONDS,
+        "items": quote["items"],
+        "total_price": quote["total_price"],
+        "delivery_fee": quote["delivery_fee"],
+        "final_price": quote["total_price"] + quote["delivery_fee"],
+        "distance_km": quote["distance_km"],
+        "store_id": quote["store_id"]
     }
 
 @router.post("/order/create")
 async def create_order(
     order_data: OrderCreate,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
     """Create new order with automatic delivery fee calculation"""
@@ -47,72 +77,44 @@ async def create_order(
     products_collection = get_products_collection()
     user = current_user["user"]
     
-    # Validate and calculate order total
-    total_price = 0
-    validated_items = []
-    
-    for item in order_data.items:
-        product = await products_collection.find_one({"_id": ObjectId(item.product_id)})
-        
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
-        
-        if not product.get("isAvailable", False):
-            raise HTTPException(status_code=400, detail=f"Product {product['name']} is not available")
-        
-        # Check stock
-        if item.unit == "Kg":
-            if product.get("stockKg", 0) < item.quantity:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Insufficient stock for {product['name']}. Available: {product.get('stockKg', 0)} Kg"
-                )
-            price_per_unit = product.get("pricePerKg")
-            if price_per_unit is None:
-                raise HTTPException(status_code=400, detail=f"Product {product['name']} not available in Kg")
-        elif item.unit == "Piece":
-            if product.get("stockPieces", 0) < item.quantity:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Insufficient stock for {product['name']}. Available: {product.get('stockPieces', 0)} Pieces"
-                )
-            price_per_unit = product.get("pricePerPiece")
-            if price_per_unit is None:
-                raise HTTPException(status_code=400, detail=f"Product {product['name']} not available in Pieces")
-        else:
-            raise HTTPException(status_code=400, detail="Unit must be 'Kg' or 'Piece'")
-        
-        item_total = price_per_unit * item.quantity
-        total_price += item_total
-        
-        validated_items.append({
-            "product_id": item.product_id,
-            "product_name": product["name"],
-            "quantity": item.quantity,
-            "unit": item.unit,
-            "price_per_unit": price_per_unit,
-            "total_price": item_total
-        })
-    
-    # Calculate delivery fee based on distance
-    # Assume store location (you should set this in your database or config)
-    store_lat = 28.6139  # Example: Delhi
-    store_lng = 77.2090
-    
-    distance_km, distance_meters = maps_service.calculate_distance(
-        store_lat, store_lng,
-        order_data.lat, order_data.lng
-    )
-    
-    # Get delivery fee settings
-    fee_settings = await get_delivery_fee_settings()
+    quote = None
+    if order_data.quote_token:
+        quote = decode_quote_token(
+            order_data.quote_token, str(user["_id"]),
+            order_data.lat, order_data.lng, order_data.items
+        )
+    else:
+        # Orders to the saved profile address use its precomputed pricing
+        quote = await saved_address_quote(user, order_data.lat, order_data.lng)
+        if (quote is None and user.get("lat") == order_data.lat
+                and user.get("lng") == order_data.lng):
+            background_tasks.add_task(
+                refresh_saved_address_quote, user["_id"], order_data.lat, order_data.lng
+            )
     
-    # Calculate delivery fee
-    delivery_fee = fee_settings["base_fee"] + (distance_km * fee_settings["per_km"])
+    if quote and quote["store_id"]:
+        # The quoted store must still be able to fill the cart
+        await store_index.ensure_fresh(get_stores_collection())
+        quoted_store = store_index.get(quote["store_id"])
+        cart = [item.model_dump() for item in order_data.items]
+        if not quoted_store or not store_index.can_fill(quoted_store, cart):
+            quote = None
+    
+    if quote:
+        # Valid quote: reuse its distance and fee, only re-check items and stock
+        validated_items, total_price = await price_items(order_data.items)
+    else:
+        quote = await build_quote(order_data.items, order_data.lat, order_data.lng)
+        validated_items = quote["items"]
+        total_price = quote["total_price"]
+    
+    store_id = quote["store_id"]
+    distance_km = quote["distance_km"]
+    delivery_fee = quote["delivery_fee"]
     final_price = total_price + delivery_fee
     
     # Generate order number
-    order_number = generate_order_number()
+    order_number = await order_number_allocator.next_order_number()
     
     # Create order
     order_dict = {
@@ -127,6 +129,10 @@ async def create_order(
         "delivery_address": order_data.delivery_address,
         "lat": order_data.lat,
         "lng": order_data.lng,
+        "store_id": store_id,
+        "zone_id": quote["zone_id"],
+        "store_lat": quote["store_lat"],
+        "store_lng": quote["store_lng"],
         "phone": order_data.phone,
         "notes": order_data.notes,
         "agent_id": None,
@@ -148,14 +154,13 @@ async def create_order(
                 {"_id": ObjectId(item.product_id)},
                 {"$inc": {"stockPieces": -item.quantity}}
             )
+    if store_id:
+        await update_store_inventory(get_stores_collection(), store_id, validated_items, -1)
     
-    # Send confirmation email
-    await email_service.send_order_confirmation_email(
-        user["email"],
-        user["username"],
-        order_number,
-        final_price
-    )
+    # Confirmation email, stats and catalog refresh run after the response
+    await event_bus.publish(OrderEvent.from_order(
+        OrderEventType.CREATED, {**order_dict, "_id": result.inserted_id}
+    ))
     
     return {
         "message": "Order created successfully",
@@ -164,7 +169,8 @@ async def create_order(
         "total_price": total_price,
         "delivery_fee": delivery_fee,
         "final_price": final_price,
-        "distance_km": distance_km
+        "distance_km": distance_km,
+        "store_id": store_id
     }
 
 @router.get("/order/{order_id}")
@@ -264,14 +270,13 @@ async def cancel_order(
                 {"_id": ObjectId(item["product_id"])},
                 {"$inc": {"stockPieces": item["quantity"]}}
             )
+    if order.get("store_id"):
+        await update_store_inventory(get_stores_collection(), order["store_id"], order["items"], 1)
     
-    # Send cancellation email
-    await email_service.send_order_cancelled_email(
-        user["email"],
-        user["username"],
-        order["order_number"],
-        "Cancelled by user"
-    )
+    await event_bus.publish(OrderEvent.from_order(
+        OrderEventType.CANCELLED, order,
+        status="cancelled", previous_status=order["status"], reason="Cancelled by user"
+    ))
     
     return {"message": "Order cancelled successfully"}
 
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from app.database import get_products_collection
+from app.catalog import catalog_cache, serialize_product, SnapshotResponse
 from bson import ObjectId
 
 router = APIRouter()
@@ -9,28 +10,18 @@ async def get_all_products(category: str = None, available_only: bool = True):
     """Get all products (public endpoint)"""
     products_collection = get_products_collection()
     
+    # Available products are served from the catalog snapshot
+    if available_only:
+        snapshot = await catalog_cache.current()
+        return SnapshotResponse(snapshot.category(category) if category else snapshot.products())
+    
     query = {}
     if category:
         query["category"] = category
-    if available_only:
-        query["isAvailable"] = True
     
     products = await products_collection.find(query).to_list(1000)
     
-    for product in products:
-        product["id"] = str(product["_id"])
-        product.pop("_id")
-        
-        # Add stock status
-        if product["unitType"] == "Kg":
-            product["in_stock"] = product.get("stockKg", 0) > 0
-        elif product["unitType"] == "Piece":
-            product["in_stock"] = product.get("stockPieces", 0) > 0
-        else:  # Both
-            product["in_stock"] = (product.get("stockKg", 0) > 0 or 
-                                  product.get("stockPieces", 0) > 0)
-    
-    return products
+    return [serialize_product(product) for product in products]
 
 @router.get("/product/{product_id}")
 async def get_product(product_id: str):
@@ -42,25 +33,11 @@ async def get_product(product_id: str):
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    product["id"] = str(product["_id"])
-    product.pop("_id")
-    
-    # Add stock status
-    if product["unitType"] == "Kg":
-        product["in_stock"] = product.get("stockKg", 0) > 0
-    elif product["unitType"] == "Piece":
-        product["in_stock"] = product.get("stockPieces", 0) > 0
-    else:  # Both
-        product["in_stock"] = (product.get("stockKg", 0) > 0 or 
-                              product.get("stockPieces", 0) > 0)
-    
-    return product
+    return serialize_product(product)
 
 @router.get("/categories")
 async def get_categories():
     """Get all product categories"""
-    products_collection = get_products_collection()
-    
-    categories = await products_collection.distinct("category")
+    snapshot = await catalog_cache.current()
     
-    return {"categories": categories}
+    return SnapshotResponse(snapshot.categories())
@@ -1,16 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from app.models import UserSignup, UserLogin, GoogleLogin, UserProfileUpdate, PasswordReset, Token, UserResponse
-from app.auth import hash_password, verify_password, create_access_token, get_current_user
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, status
+from app.models import (UserSignup, UserLogin, GoogleLogin, UserProfileUpdate, PasswordReset,
+                        PasswordResetConfirm, Token, UserResponse)
+from app.auth import (hash_password, verify_password, create_access_token, get_current_user,
+                      security, revoke_token, create_email_verification_token,
+                      create_password_reset_token, decode_purpose_token, password_fingerprint)
+from fastapi.security import HTTPAuthorizationCredentials
 from app.database import get_users_collection, get_orders_collection
 from app.email_service import email_service
+from app.pricing import refresh_saved_address_quote
 from datetime import datetime
 from bson import ObjectId
-import secrets
 
 router = APIRouter()
 
 @router.post("/signup", response_model=Token)
-async def signup(user_data: UserSignup):
+async def signup(user_data: UserSignup, background_tasks: BackgroundTasks):
     users_collection = get_users_collection()
     
     # Check if user exists
@@ -21,8 +25,8 @@ async def signup(user_data: UserSignup):
     # Hash password
     hashed_password = hash_password(user_data.password)
     
-    # Generate verification token
-    verification_token = secrets.token_urlsafe(32)
+    # Generate signed verification token (expiry is embedded, nothing is stored)
+    verification_token = create_email_verification_token(user_data.email)
     
     # Create user
     user_dict = {
@@ -34,13 +38,18 @@ async def signup(user_data: UserSignup):
         "lat": user_data.lat,
         "lng": user_data.lng,
         "verified": False,
-        "verification_token": verification_token,
         "google_id": None,
         "created_at": datetime.utcnow()
     }
     
     result = await users_collection.insert_one(user_dict)
     
+    # Precompute delivery pricing for the saved address
+    if user_data.lat is not None and user_data.lng is not None:
+        background_tasks.add_task(
+            refresh_saved_address_quote, result.inserted_id, user_data.lat, user_data.lng
+        )
+    
     # Send verification email
     await email_service.send_verification_email(
         user_data.email, 
@@ -72,7 +81,12 @@ async def login(user_data: UserLogin):
 async def verify_email(token: str):
     users_collection = get_users_collection()
     
-    user = await users_collection.find_one({"verification_token": token})
+    payload = decode_purpose_token(token, "email_verification")
+    if payload:
+        user = await users_collection.find_one({"email": payload["sub"]})
+    else:
+        # Links sent before tokens were self-contained (sparse index)
+        user = await users_collection.find_one({"verification_token": token})
     if not user:
         raise HTTPException(status_code=400, detail="Invalid or expired verification token")
     
@@ -95,16 +109,8 @@ async def reset_password(data: PasswordReset):
         # Don't reveal if email exists
         return {"message": "If the email exists, a reset link has been sent"}
     
-    # Generate reset token
-    reset_token = secrets.token_urlsafe(32)
-    
-    await users_collection.update_one(
-        {"_id": user["_id"]},
-        {"$set": {
-            "reset_token": reset_token,
-            "reset_token_expires": datetime.utcnow()
-        }}
-    )
+    # Generate signed reset token, valid until it expires or the password changes
+    reset_token = create_password_reset_token(data.email, user["password"])
     
     # Send reset email
     await email_service.send_password_reset_email(
@@ -115,6 +121,37 @@ async def reset_password(data: PasswordReset):
     
     return {"message": "If the email exists, a reset link has been sent"}
 
+@router.post("/logout")
+async def user_logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: dict = Depends(get_current_user)
+):
+    """Revoke the current access token"""
+    await revoke_token(credentials)
+    return {"message": "Logged out successfully"}
+
+@router.post("/reset-password/confirm")
+async def confirm_reset_password(data: PasswordResetConfirm):
+    users_collection = get_users_collection()
+    
+    payload = decode_purpose_token(data.token, "password_reset")
+    if not payload:
+        raise HTTPException(status_code=400, detail="Invalid or expired reset token")
+    
+    user = await users_collection.find_one({"email": payload["sub"]})
+    if not user or password_fingerprint(user["password"]) != payload.get("pwd"):
+        raise HTTPException(status_code=400, detail="Invalid or expired reset token")
+    
+    await users_collection.update_one(
+        {"_id": user["_id"]},
+        {
+            "$set": {"password": hash_password(data.new_password)},
+            "$unset": {"reset_token": "", "reset_token_expires": ""}
+        }
+    )
+    
+    return {"message": "Password reset successfully"}
+
 @router.get("/profile")
 async def get_profile(current_user: dict = Depends(get_current_user)):
     user = current_user["user"]
@@ -133,6 +170,7 @@ async def get_profile(current_user: dict = Depends(get_current_user)):
 @router.put("/profile/update")
 async def update_profile(
     profile_data: UserProfileUpdate,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
     users_collection = get_users_collection()
@@ -150,12 +188,26 @@ async def update_profile(
     if profile_data.lng is not None:
         update_data["lng"] = profile_data.lng
     
+    update_query = {}
     if update_data:
+        update_query["$set"] = update_data
+    
+    # A new address invalidates the precomputed delivery pricing
+    lat = update_data.get("lat", user.get("lat"))
+    lng = update_data.get("lng", user.get("lng"))
+    address_changed = lat != user.get("lat") or lng != user.get("lng")
+    if address_changed:
+        update_query["$unset"] = {"delivery_quote": ""}
+    
+    if update_query:
         await users_collection.update_one(
             {"_id": user["_id"]},
-            {"$set": update_data}
+            update_query
         )
     
+    if address_changed and lat is not None and lng is not None:
+        background_tasks.add_task(refresh_saved_address_quote, user["_id"], lat, lng)
+    
     return {"message": "Profile updated successfully"}
 
 @router.get("/orders")
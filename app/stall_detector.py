@@ -0,0 +1,130 @@
+"""
+Event-loop stall detector
+
+A heartbeat task on the event loop stamps the time every few milliseconds
+and a watchdog thread checks the stamp. When the heartbeat is late by more
+than STALL_THRESHOLD_MS, something is blocking the loop (bcrypt, a
+synchronous HTTP call, heavy CPU work), so the watchdog captures the loop
+thread's current stack with sys._current_frames() while it is still
+blocked, together with the route of the task that is running. Each stall
+is logged once with its stack and counted in the Prometheus metrics when
+the loop resumes.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import Optional
+from prometheus_client import Counter, Histogram
+from app.config import settings
+from app.metrics import route_template
+
+STALL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+EVENT_LOOP_STALLS = Counter(
+    "veggo_event_loop_stalls_total", "Event-loop stalls above the threshold", ["route"]
+)
+EVENT_LOOP_STALL_DURATION = Histogram(
+    "veggo_event_loop_stall_duration_seconds", "Duration of event-loop stalls", ["route"],
+    buckets=STALL_BUCKETS
+)
+
+class StallDetector:
+    def __init__(self, threshold_ms: float, heartbeat_ms: float, stack_limit: int = 40):
+        self.threshold = threshold_ms / 1000
+        self.heartbeat = heartbeat_ms / 1000
+        self.stack_limit = stack_limit
+        # Request task -> route template, maintained by StallDetectorMiddleware
+        self.task_routes: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._beat = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._watch, name="stall-detector", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=1)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.heartbeat)
+
+    def _active_route(self) -> str:
+        # Read-only peek at the loop's running task from the watchdog thread
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            return "idle"
+        route = self.task_routes.get(task)
+        if route:
+            return route
+        coro = task.get_coro()
+        return f"task:{getattr(coro, '__qualname__', task.get_name())}"
+
+    def _watch(self):
+        stall = None
+        while not self._stopping.wait(self.heartbeat / 2):
+            beat = self._beat
+            lag = time.monotonic() - beat - self.heartbeat
+
+            if stall is None and lag > self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame, limit=self.stack_limit)) if frame else ""
+                stall = {"beat": beat, "route": self._active_route()}
+                print(f"⚠️  Event loop blocked for >{lag * 1000:.0f} ms in {stall['route']}\n{stack}")
+            elif stall is not None and beat != stall["beat"]:
+                # The loop is running again
+                duration = beat - stall["beat"] - self.heartbeat
+                EVENT_LOOP_STALLS.labels(stall["route"]).inc()
+                EVENT_LOOP_STALL_DURATION.labels(stall["route"]).observe(duration)
+                print(f"ℹ️  Event loop resumed after {duration * 1000:.0f} ms ({stall['route']})")
+                stall = None
+
+stall_detector = StallDetector(settings.STALL_THRESHOLD_MS, settings.STALL_HEARTBEAT_MS)
+
+class StallDetectorMiddleware:
+    """Registers the route template of each request task for stall reports"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not stall_detector.running:
+            await self.app(scope, receive, send)
+            return
+
+        task = asyncio.current_task()
+        stall_detector.task_routes[task] = f"{scope['method']} {route_template(scope)}"
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            stall_detector.task_routes.pop(task, None)
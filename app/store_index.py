@@ -0,0 +1,141 @@
+"""
+Spatial index of dark stores for nearest-store selection
+
+Store locations are kept in a 2-d KD-tree (equirectangular projection
+around the stores' mean latitude, accurate enough at city scale). Nearest
+stores are yielded one at a time by a best-first search, so picking the
+closest store that can fill a cart costs O(log n) per store inspected.
+The tree is rebuilt whenever stores are added, moved or removed; stock
+changes are applied to the cached inventory in place.
+"""
+
+import heapq
+import itertools
+import time
+from math import cos, radians
+from typing import Iterator, List, Optional, Tuple
+from bson import ObjectId
+from app.config import settings
+
+class KDTree:
+    def __init__(self, points: List[Tuple[float, float]]):
+        self.points = points
+        self.root = self._build(list(range(len(points))), 0)
+
+    def _build(self, indices: List[int], depth: int):
+        if not indices:
+            return None
+        axis = depth % 2
+        indices.sort(key=lambda i: self.points[i][axis])
+        mid = len(indices) // 2
+        return (
+            indices[mid],
+            axis,
+            self._build(indices[:mid], depth + 1),
+            self._build(indices[mid + 1:], depth + 1)
+        )
+
+    def nearest(self, x: float, y: float) -> Iterator[Tuple[float, int]]:
+        """Yield (squared_distance, point_index) in increasing distance order"""
+        counter = itertools.count()
+        heap = [(0.0, next(counter), False, self.root)]
+        while heap:
+            bound, _, is_point, item = heapq.heappop(heap)
+            if is_point:
+                yield bound, item
+                continue
+            if item is None:
+                continue
+            index, axis, left, right = item
+            px, py = self.points[index]
+            heapq.heappush(heap, ((px - x) ** 2 + (py - y) ** 2, next(counter), True, index))
+            diff = (x - px) if axis == 0 else (y - py)
+            near, far = (left, right) if diff < 0 else (right, left)
+            if near is not None:
+                heapq.heappush(heap, (bound, next(counter), False, near))
+            if far is not None:
+                heapq.heappush(heap, (max(bound, diff * diff), next(counter), False, far))
+
+class StoreIndex:
+    def __init__(self, ttl_seconds: int = 30):
+        self.ttl_seconds = ttl_seconds
+        self._stores: List[dict] = []
+        self._by_id = {}
+        self._tree: Optional[KDTree] = None
+        self._scale = 1.0
+        self._loaded_at: Optional[float] = None
+
+    def invalidate(self):
+        """Force a rebuild on the next lookup (stores added, moved or removed)"""
+        self._loaded_at = None
+
+    async def ensure_fresh(self, stores_collection):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+            return
+        stores = await stores_collection.find({"isActive": True}).to_list(None)
+        self.rebuild(stores)
+
+    def rebuild(self, stores: List[dict]):
+        self._stores = stores
+        self._by_id = {str(store["_id"]): store for store in stores}
+        if stores:
+            mean_lat = sum(store["lat"] for store in stores) / len(stores)
+            self._scale = cos(radians(mean_lat))
+            self._tree = KDTree([(store["lng"] * self._scale, store["lat"]) for store in stores])
+        else:
+            self._tree = None
+        self._loaded_at = time.monotonic()
+
+    def has_stores(self) -> bool:
+        return bool(self._stores)
+
+    def get(self, store_id: str) -> Optional[dict]:
+        return self._by_id.get(store_id)
+
+    def nearest(self, lat: float, lng: float) -> Iterator[dict]:
+        """Active stores ordered by distance from the point"""
+        if self._tree is None:
+            return
+        for _, index in self._tree.nearest(lng * self._scale, lat):
+            yield self._stores[index]
+
+    @staticmethod
+    def can_fill(store: dict, items: list) -> bool:
+        inventory = store.get("inventory", {})
+        for item in items:
+            stock = inventory.get(item["product_id"], {})
+            field = "stockKg" if item["unit"] == "Kg" else "stockPieces"
+            if (stock.get(field) or 0) < item["quantity"]:
+                return False
+        return True
+
+    def select_store(self, lat: float, lng: float, items: list) -> Optional[dict]:
+        """Nearest active store whose inventory covers every item of the cart"""
+        for store in self.nearest(lat, lng):
+            if self.can_fill(store, items):
+                return store
+        return None
+
+    def adjust_inventory(self, store_id: str, items: list, sign: int):
+        """Apply a stock change to the cached inventory (sign -1 to reserve, +1 to restore)"""
+        store = self._by_id.get(store_id)
+        if not store:
+            return
+        inventory = store.setdefault("inventory", {})
+        for item in items:
+            field = "stockKg" if item["unit"] == "Kg" else "stockPieces"
+            stock = inventory.setdefault(item["product_id"], {})
+            stock[field] = (stock.get(field) or 0) + sign * item["quantity"]
+
+async def update_store_inventory(stores_collection, store_id: str, items: list, sign: int):
+    """Apply a stock change to a store's inventory in the database"""
+    increments = {}
+    for item in items:
+        field = "stockKg" if item["unit"] == "Kg" else "stockPieces"
+        key = f"inventory.{item['product_id']}.{field}"
+        increments[key] = increments.get(key, 0) + sign * item["quantity"]
+    if increments:
+        await stores_collection.update_one({"_id": ObjectId(store_id)}, {"$inc": increments})
+    store_index.adjust_inventory(store_id, items, sign)
+
+store_index = StoreIndex(settings.STORE_INDEX_TTL_SECONDS)
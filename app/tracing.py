@@ -0,0 +1,347 @@
+"""
+Lightweight request tracing
+
+Every sampled request gets a root span, with child spans for each MongoDB
+command (command listener), Google Maps call and SMTP send. The active
+span lives in a context variable, so spans opened inside asyncio.gather
+branches, asyncio.to_thread and Motor's executor threads attach to the
+right parent.
+
+Incoming W3C `traceparent` headers are honoured (a sampled parent is always
+traced) and every response carries the `traceparent` of its root span.
+Finished spans are queued and exported from a background thread, either as
+JSON lines to TRACE_FILE_PATH or as OTLP/HTTP JSON to OTLP_ENDPOINT (an
+OpenTelemetry Collector or Jaeger all-in-one running locally). Sampling
+keeps the overhead configurable through TRACE_SAMPLE_RATE.
+"""
+
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from pymongo import monitoring
+from app.config import settings
+from app.metrics import route_template
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_CONSUMER = 5
+
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "status")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: int, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = STATUS_UNSET
+
+    def child(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> "Span":
+        return Span(self.trace_id, self.span_id, name, kind, attributes)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.status == STATUS_ERROR
+        }
+
+# Only sampled spans are ever set here; None means "not traced"
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_span(span: Span) -> dict:
+    otlp = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": span.status}
+    }
+    if span.parent_id:
+        otlp["parentSpanId"] = span.parent_id
+    return otlp
+
+class FileSpanExporter:
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans: list):
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def close(self):
+        pass
+
+class OTLPSpanExporter:
+    def __init__(self, endpoint: str, service_name: str):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.resource = {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]}
+        import httpx  # only needed when exporting over OTLP
+        self.client = httpx.Client(timeout=5.0)
+
+    def export(self, spans: list):
+        payload = {
+            "resourceSpans": [{
+                "resource": self.resource,
+                "scopeSpans": [{"scope": {"name": "veggo"}, "spans": [_otlp_span(span) for span in spans]}]
+            }]
+        }
+        self.client.post(self.url, json=payload).raise_for_status()
+
+    def close(self):
+        self.client.close()
+
+class Tracer:
+    """Samples traces and exports finished spans in batches from a daemon thread"""
+
+    def __init__(self, sample_rate: float, exporter=None, max_queue: int = 10000,
+                 batch_size: int = 512, flush_seconds: float = 2.0):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        if self._thread:
+            self._stopping.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+            self.exporter.close()
+
+    def start_trace(self, name: str, traceparent: Optional[str], **attributes) -> Optional[Span]:
+        """Root span for a request, or None if the request is not sampled"""
+        if not self.enabled:
+            return None
+
+        parent = TRACEPARENT.match(traceparent or "")
+        if parent:
+            trace_id, parent_id, flags = parent.groups()
+            sampled = int(flags, 16) & 1 or random.random() < self.sample_rate
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = random.random() < self.sample_rate
+
+        if not sampled:
+            return None
+        return Span(trace_id, parent_id, name, SPAN_KIND_SERVER, attributes)
+
+    def finish(self, span: Span):
+        span.end_ns = time.time_ns()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._stopping.wait(self.flush_seconds)
+            self._drain()
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            try:
+                self.exporter.export(batch)
+            except Exception as e:
+                print(f"Error exporting spans: {e}")
+                return
+
+def _build_exporter():
+    if settings.TRACING_EXPORTER == "file":
+        return FileSpanExporter(settings.TRACE_FILE_PATH)
+    if settings.TRACING_EXPORTER == "otlp":
+        return OTLPSpanExporter(settings.OTLP_ENDPOINT, settings.TRACE_SERVICE_NAME)
+    return None
+
+tracer = Tracer(settings.TRACE_SAMPLE_RATE, _build_exporter())
+
+def current_traceparent() -> Optional[str]:
+    """traceparent of the current span (None when not traced), to hand to background work"""
+    span = current_span.get()
+    return span.traceparent() if span else None
+
+@contextmanager
+def trace_span(name: str, kind: int = SPAN_KIND_CLIENT, **attributes):
+    """Child span of the current span; a no-op when the request is not traced"""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    with _active(parent.child(name, kind, **attributes)) as span:
+        yield span
+
+@contextmanager
+def continue_trace(name: str, traceparent: Optional[str], kind: int = SPAN_KIND_CONSUMER, **attributes):
+    """
+    Span for work done outside the request that caused it (event subscribers),
+    as a child of the request's traceparent; a no-op when it was not traced
+    """
+    parent = TRACEPARENT.match(traceparent or "") if tracer.enabled else None
+    if parent is None:
+        yield None
+        return
+
+    trace_id, parent_id, _ = parent.groups()
+    with _active(Span(trace_id, parent_id, name, kind, attributes)) as span:
+        yield span
+
+@contextmanager
+def _active(span: Span):
+    """Make span the current span until the block ends, then export it"""
+    token = current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.status = STATUS_ERROR
+        span.attributes["error.type"] = type(e).__name__
+        raise
+    finally:
+        current_span.reset(token)
+        tracer.finish(span)
+
+class MongoTracingListener(monitoring.CommandListener):
+    """Opens a client span for every MongoDB command of a traced request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+
+    def started(self, event):
+        parent = current_span.get()
+        if parent is None:
+            return
+        target = event.command.get(event.command_name)
+        span = parent.child(
+            f"mongodb.{event.command_name}", SPAN_KIND_CLIENT,
+            **{"db.system": "mongodb", "db.name": event.database_name, "db.operation": event.command_name}
+        )
+        if isinstance(target, str):
+            span.attributes["db.mongodb.collection"] = target
+        with self._lock:
+            self._spans[(event.connection_id, event.request_id)] = span
+
+    def succeeded(self, event):
+        self._finish(event, error=False)
+
+    def failed(self, event):
+        self._finish(event, error=True)
+
+    def _finish(self, event, error: bool):
+        with self._lock:
+            span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is None:
+            return
+        if error:
+            span.status = STATUS_ERROR
+        tracer.finish(span)
+
+mongo_tracing_listener = MongoTracingListener()
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        route = route_template(scope)
+        span = tracer.start_trace(
+            f"{scope['method']} {route}", traceparent,
+            **{"http.method": scope["method"], "http.route": route, "http.target": scope["path"]}
+        )
+        if span is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    span.status = STATUS_ERROR
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"traceparent", span.traceparent().encode("latin-1"))
+                ]
+            await send(message)
+
+        token = current_span.set(span)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            span.status = STATUS_ERROR
+            raise
+        finally:
+            current_span.reset(token)
+            tracer.finish(span)
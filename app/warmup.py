@@ -0,0 +1,132 @@
+"""
+Startup warm-up and readiness
+
+Right after a deploy, the first requests of each worker would otherwise pay
+for opening MongoDB connections, loading delivery settings, the catalog and
+the store/zone indexes, and building the OpenAPI schema. The lifespan
+handler starts the warm-up in the background: /health (liveness) answers at
+once, and /ready (readiness) returns 503 until every step has finished.
+Failed warm-ups are retried until they succeed.
+
+Each uvicorn worker warms itself; a readiness probe reaches one of them.
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+from app.config import settings
+from app.catalog import catalog_cache
+from app.database import get_database, get_stores_collection, get_delivery_zones_collection
+from app.revocation import revocation_list
+from app.store_index import store_index
+from app.zones import zone_index
+
+# Indexes created by init_db.py that the hot paths rely on (collection -> key patterns)
+REQUIRED_INDEXES = {
+    "users": [[("email", 1)], [("username", 1)]],
+    "agents": [[("email", 1)], [("approved", 1)]],
+    "products": [[("category", 1)], [("isAvailable", 1)]],
+    "orders": [[("user_id", 1)], [("agent_id", 1)], [("status", 1)], [("order_number", 1)], [("created_at", 1)]],
+    "stores": [[("isActive", 1)]],
+    "delivery_zones": [[("isActive", 1)]],
+    "idempotency_keys": [[("created_at", 1)]],
+    "revoked_tokens": [[("expires_at", 1)]],
+    "notification_holds": [[("due_at", 1)]],
+}
+
+async def find_missing_indexes(db) -> List[str]:
+    missing = []
+    for collection, key_patterns in REQUIRED_INDEXES.items():
+        existing = {
+            tuple((field, direction) for field, direction in index["key"])
+            for index in (await db[collection].index_information()).values()
+        }
+        for keys in key_patterns:
+            if tuple(keys) not in existing:
+                missing.append(f"{collection}({', '.join(field for field, _ in keys)})")
+    return missing
+
+class Warmup:
+    def __init__(self):
+        self.ready = False
+        self.attempts = 0
+        self.steps: Dict[str, float] = {}  # step -> milliseconds
+        self.missing_indexes: List[str] = []
+        self.error: Optional[str] = None
+        self.duration_ms: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, app):
+        self._task = asyncio.create_task(self._run(app))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "warming_up",
+            "attempts": self.attempts,
+            "duration_ms": self.duration_ms,
+            "steps_ms": self.steps,
+            "missing_indexes": self.missing_indexes,
+            "error": self.error
+        }
+
+    async def _run(self, app):
+        while True:
+            self.attempts += 1
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.warm_up(app), settings.WARMUP_TIMEOUT_SECONDS)
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                print(f"⚠️  Warm-up failed ({self.error}), retrying in {settings.WARMUP_RETRY_SECONDS}s")
+                await asyncio.sleep(settings.WARMUP_RETRY_SECONDS)
+                continue
+
+            self.duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            self.error = None
+            self.ready = True
+            print(f"✅ Warm-up finished in {self.duration_ms:.0f} ms")
+            return
+
+    async def _step(self, name: str, coro):
+        started = time.perf_counter()
+        result = await coro
+        self.steps[name] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    async def warm_up(self, app):
+        db = get_database()
+
+        # Concurrent pings make the pool open that many connections
+        await self._step("connection_pool", asyncio.gather(
+            *(db.command("ping") for _ in range(settings.WARMUP_POOL_CONNECTIONS))
+        ))
+
+        # Catalog and fee settings (maps the shared snapshot when another worker published it)
+        await self._step("catalog", catalog_cache.current())
+        await self._step("stores_and_zones", asyncio.gather(
+            store_index.ensure_fresh(get_stores_collection()),
+            zone_index.ensure_fresh(get_delivery_zones_collection()),
+            revocation_list.refresh(force=True)
+        ))
+
+        self.missing_indexes = await self._step("indexes", find_missing_indexes(db))
+        if self.missing_indexes:
+            print(f"⚠️  Missing indexes (run init_db.py): {', '.join(self.missing_indexes)}")
+            if settings.WARMUP_REQUIRE_INDEXES:
+                raise RuntimeError(f"missing indexes: {', '.join(self.missing_indexes)}")
+
+        # Build the OpenAPI schema (every model's JSON schema) before /docs is first opened
+        started = time.perf_counter()
+        app.openapi()
+        self.steps["serializers"] = round((time.perf_counter() - started) * 1000, 1)
+
+warmup = Warmup()
@@ -0,0 +1,149 @@
+"""
+Delivery zones rasterized into a grid lookup table
+
+Admins draw zones as polygons, each with its own fee tier. When zones are
+(re)loaded every polygon is rasterized onto a fixed lat/lng grid
+(ZONE_CELL_DEGREES wide cells). Cells fully inside a zone resolve with a
+single dict lookup; only cells crossed by a zone boundary fall back to an
+exact point-in-polygon test.
+
+Every ZONE_INDEX_TTL_SECONDS the index reads only the ids and timestamps
+of the active zones; the polygons are reloaded and rasterized only when
+that fingerprint changed (a zone was added, edited, deleted or
+deactivated through the admin API). Rasterizing runs in a worker thread,
+so requests keep being served while a large zone set is rebuilt.
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+from app.geo import grid_cell
+
+def point_in_polygon(lat: float, lng: float, polygon: List[List[float]]) -> bool:
+    """Ray casting test; polygon is a list of [lat, lng] vertices"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lng_i = polygon[i]
+        lat_j, lng_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing_lng = lng_i + (lat - lat_i) * (lng_j - lng_i) / (lat_j - lat_i)
+            if lng < crossing_lng:
+                inside = not inside
+        j = i
+    return inside
+
+def _segments_intersect(p1, p2, q1, q2) -> bool:
+    def orientation(a, b, c):
+        value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return 0 if value == 0 else (1 if value > 0 else -1)
+
+    def on_segment(a, b, c):
+        return (min(a[0], b[0]) <= c[0] <= max(a[0], b[0])
+                and min(a[1], b[1]) <= c[1] <= max(a[1], b[1]))
+
+    o1 = orientation(p1, p2, q1)
+    o2 = orientation(p1, p2, q2)
+    o3 = orientation(q1, q2, p1)
+    o4 = orientation(q1, q2, p2)
+    if o1 != o2 and o3 != o4:
+        return True
+    return ((o1 == 0 and on_segment(p1, p2, q1)) or (o2 == 0 and on_segment(p1, p2, q2))
+            or (o3 == 0 and on_segment(q1, q2, p1)) or (o4 == 0 and on_segment(q1, q2, p2)))
+
+def _edge_touches_cell(a, b, min_lat, min_lng, max_lat, max_lng) -> bool:
+    for lat, lng in (a, b):
+        if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+            return True
+    corners = [(min_lat, min_lng), (min_lat, max_lng), (max_lat, max_lng), (max_lat, min_lng)]
+    for k in range(4):
+        if _segments_intersect(a, b, corners[k], corners[(k + 1) % 4]):
+            return True
+    return False
+
+class ZoneIndex:
+    def __init__(self, cell_deg: float, ttl_seconds: int = 30):
+        self.cell_deg = cell_deg
+        self.ttl_seconds = ttl_seconds
+        self._zones: Dict[str, dict] = {}
+        # cell -> [(priority, zone_id, fully_inside)], highest priority first
+        self._cells: Dict[Tuple[int, int], List[Tuple[int, str, bool]]] = {}
+        self._loaded_at: Optional[float] = None
+        self._fingerprint: Optional[tuple] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    @staticmethod
+    def fingerprint(zones: List[dict]) -> tuple:
+        return tuple(sorted(
+            (str(zone["_id"]), zone.get("updated_at") or zone.get("created_at")) for zone in zones
+        ))
+
+    async def ensure_fresh(self, zones_collection):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+            return
+        async with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                return  # refreshed while this request waited
+            versions = await zones_collection.find(
+                {"isActive": True}, {"updated_at": 1, "created_at": 1}
+            ).to_list(None)
+            fingerprint = self.fingerprint(versions)
+            if fingerprint != self._fingerprint:
+                zones = await zones_collection.find({"isActive": True}).to_list(None)
+                cells = await asyncio.to_thread(self._build_cells, zones)
+                self._install(zones, cells)
+                self._fingerprint = self.fingerprint(zones)
+            self._loaded_at = time.monotonic()
+
+    def rebuild(self, zones: List[dict]):
+        self._install(zones, self._build_cells(zones))
+        self._fingerprint = self.fingerprint(zones)
+        self._loaded_at = time.monotonic()
+
+    def _build_cells(self, zones: List[dict]) -> Dict[Tuple[int, int], List[Tuple[int, str, bool]]]:
+        cells: Dict[Tuple[int, int], List[Tuple[int, str, bool]]] = {}
+        for zone in zones:
+            zone_id = str(zone["_id"])
+            for cell, fully_inside in self._rasterize(zone["polygon"]):
+                cells.setdefault(cell, []).append((zone.get("priority", 0), zone_id, fully_inside))
+        for entries in cells.values():
+            entries.sort(key=lambda entry: entry[0], reverse=True)
+        return cells
+
+    def _install(self, zones: List[dict], cells: Dict[Tuple[int, int], List[Tuple[int, str, bool]]]):
+        self._zones = {str(zone["_id"]): zone for zone in zones}
+        self._cells = cells
+
+    def _rasterize(self, polygon: List[List[float]]):
+        lats = [vertex[0] for vertex in polygon]
+        lngs = [vertex[1] for vertex in polygon]
+        min_cell = grid_cell(min(lats), min(lngs), self.cell_deg)
+        max_cell = grid_cell(max(lats), max(lngs), self.cell_deg)
+        edges = [(polygon[k], polygon[(k + 1) % len(polygon)]) for k in range(len(polygon))]
+
+        for i in range(min_cell[0], max_cell[0] + 1):
+            for j in range(min_cell[1], max_cell[1] + 1):
+                min_lat, min_lng = i * self.cell_deg, j * self.cell_deg
+                max_lat, max_lng = min_lat + self.cell_deg, min_lng + self.cell_deg
+
+                if any(_edge_touches_cell(a, b, min_lat, min_lng, max_lat, max_lng) for a, b in edges):
+                    yield (i, j), False
+                elif point_in_polygon((min_lat + max_lat) / 2, (min_lng + max_lng) / 2, polygon):
+                    yield (i, j), True
+
+    def has_zones(self) -> bool:
+        return bool(self._zones)
+
+    def lookup(self, lat: float, lng: float) -> Optional[dict]:
+        """Highest-priority zone containing the point, or None"""
+        for _, zone_id, fully_inside in self._cells.get(grid_cell(lat, lng, self.cell_deg), ()):
+            zone = self._zones[zone_id]
+            if fully_inside or point_in_polygon(lat, lng, zone["polygon"]):
+                return zone
+        return None
+
+zone_index = ZoneIndex(settings.ZONE_CELL_DEGREES, settings.ZONE_INDEX_TTL_SECONDS)
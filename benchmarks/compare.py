@@ -0,0 +1,45 @@
+"""
+Compare two benchmark result files
+
+Usage:
+    python benchmarks/compare.py benchmarks/results/before.json benchmarks/results/after.json
+"""
+
+import argparse
+import json
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        report = json.load(f)
+    return report["meta"], {(r["scenario"], r["concurrency"]): r for r in report["results"]}
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return "    n/a"
+    return f"{(after - before) / before * 100:+7.1f}%"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    before_meta, before = load_results(args.before)
+    after_meta, after = load_results(args.after)
+    print(f"Before: {before_meta['git']['commit']} ({before_meta['backend']})")
+    print(f"After:  {after_meta['git']['commit']} ({after_meta['backend']})\n")
+    print(f"{'scenario':<16} {'conc':>4}  {'req/s':>17}  {'p50':>17}  {'p95':>17}  {'p99':>17}")
+
+    for key in sorted(set(before) & set(after)):
+        old, new = before[key], after[key]
+        print(
+            f"{key[0]:<16} {key[1]:>4}  "
+            f"{new['throughput_rps']:>8.1f} {change(old['throughput_rps'], new['throughput_rps'])}  "
+            + "  ".join(
+                f"{new['latency_ms'][q]:>8.2f} {change(old['latency_ms'][q], new['latency_ms'][q])}"
+                for q in ("p50", "p95", "p99")
+            )
+        )
+
+    for key in sorted(set(before) ^ set(after)):
+        print(f"{key[0]:<16} {key[1]:>4}  only in {'before' if key in before else 'after'}")
@@ -0,0 +1,107 @@
+"""
+Import-time budget for serverless cold starts
+Imports main.py in fresh interpreters with `python -X importtime`, reports
+the median total and the slowest modules, and fails when the budget is
+exceeded or a module that should load lazily was imported eagerly.
+
+Usage:
+    python benchmarks/import_budget.py                    # as deployed on Vercel (LAZY_ROUTERS=true)
+    python benchmarks/import_budget.py --budget-ms 900 --runs 9
+    python benchmarks/import_budget.py --eager            # LAZY_ROUTERS=false, no lazy-module check
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported before the first request that needs them
+LAZY_MODULES = ["numpy", "googlemaps", "requests", "httpx", "app.fleet_store", "app.map_feed", "app.routes.admin_routes"]
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def measure(env: dict) -> dict:
+    """One cold import of main; returns {"total_us", "modules": {name: (self_us, cumulative_us, depth)}}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing main failed:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), len(match[3]), match[4]
+        depth = (indent - 1) // 2
+        modules[name] = (self_us, cumulative_us, depth)
+        if depth == 0:
+            total_us += cumulative_us
+    return {"total_us": total_us, "modules": modules}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the cold-start import time of main.py")
+    parser.add_argument("--budget-ms", type=float, default=1600, help="Maximum median import time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    parser.add_argument("--eager", action="store_true", help="Measure with LAZY_ROUTERS=false")
+    parser.add_argument("--output", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    env = {**os.environ, "LAZY_ROUTERS": "false" if args.eager else "true"}
+    env.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+    env.setdefault("SECRET_KEY", "import-budget")
+    for name in ("SMTP_HOST", "SMTP_USER", "SMTP_PASSWORD", "FROM_EMAIL", "GOOGLE_MAPS_API_KEY"):
+        env.setdefault(name, "import-budget")
+    env.setdefault("SMTP_PORT", "587")
+
+    runs = [measure(env) for _ in range(args.runs)]
+    totals_ms = sorted(run["total_us"] / 1000 for run in runs)
+    median_ms = statistics.median(totals_ms)
+
+    # Slowest first-party and direct third-party imports, by median cumulative time
+    names = set.intersection(*(set(run["modules"]) for run in runs))
+    cumulative_ms = {
+        name: statistics.median(run["modules"][name][1] for run in runs) / 1000
+        for name in names
+        if name.startswith("app.") or runs[0]["modules"][name][2] <= 1
+    }
+    slowest = sorted(cumulative_ms.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    eager = [] if args.eager else [name for name in LAZY_MODULES if any(name in run["modules"] for run in runs)]
+
+    print(f"⏱️  import main: median {median_ms:.0f} ms (min {totals_ms[0]:.0f}, max {totals_ms[-1]:.0f}, "
+          f"{args.runs} runs, budget {args.budget_ms:.0f} ms)\n")
+    print(f"{'module':<40} {'cumulative':>12}")
+    for name, ms in slowest:
+        print(f"{name:<40} {ms:>9.1f} ms")
+
+    failures = []
+    if median_ms > args.budget_ms:
+        failures.append(f"median import time {median_ms:.0f} ms exceeds the {args.budget_ms:.0f} ms budget")
+    for name in eager:
+        failures.append(f"{name} is imported at startup; it should load on first use")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "median_ms": round(median_ms, 1),
+                "runs_ms": [round(ms, 1) for ms in totals_ms],
+                "budget_ms": args.budget_ms,
+                "lazy_routers": not args.eager,
+                "slowest_ms": {name: round(ms, 1) for name, ms in slowest},
+                "failures": failures
+            }, f, indent=2)
+
+    if failures:
+        print("\n❌ " + "\n❌ ".join(failures))
+        sys.exit(1)
+    print("\n✅ Within budget")
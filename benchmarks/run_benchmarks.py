@@ -0,0 +1,104 @@
+"""
+API Benchmarks
+Measures throughput and p50/p95/p99 latency of the hot paths and writes the
+results to JSON so runs can be compared across commits.
+
+Usage:
+    python benchmarks/run_benchmarks.py                                  # mongomock-motor
+    python benchmarks/run_benchmarks.py --mongo-uri mongodb://localhost:27017
+    python benchmarks/run_benchmarks.py --scenarios products,login --concurrency 1,16,64
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+
+from harness import ROOT, SCENARIOS, bench_client, run_load, seed
+
+def git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(
+                ["git", *args], cwd=ROOT, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+async def run_benchmarks(args) -> dict:
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+
+    results = []
+    async with bench_client(args.mongo_uri, args.maps_latency_ms, args.smtp_latency_ms) as (client, db):
+        print("🌱 Seeding benchmark data...")
+        data = await seed(db, args.products, args.users, args.agents, args.orders_per_user, args.seed)
+
+        for scenario in scenarios:
+            build_request = SCENARIOS[scenario]
+            if args.warmup:
+                await run_load(client, build_request, data, min(args.warmup, 4), args.warmup, args.seed)
+
+            for concurrency in concurrency_levels:
+                summary = await run_load(client, build_request, data, concurrency, args.requests, args.seed)
+                results.append({"scenario": scenario, "concurrency": concurrency, **summary})
+                latency = summary["latency_ms"]
+                print(f"📊 {scenario:<16} c={concurrency:<4} {summary['throughput_rps']:>8.1f} req/s  "
+                      f"p50 {latency['p50']:>8.2f} ms  p95 {latency['p95']:>8.2f} ms  "
+                      f"p99 {latency['p99']:>8.2f} ms  errors {summary['errors']}")
+
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": "mongod" if args.mongo_uri else "mongomock-motor",
+            "requests_per_run": args.requests,
+            "data": {
+                "products": args.products,
+                "users": args.users,
+                "agents": args.agents,
+                "orders_per_user": args.orders_per_user
+            },
+            "fakes": {"maps_latency_ms": args.maps_latency_ms, "smtp_latency_ms": args.smtp_latency_ms},
+            "seed": args.seed
+        },
+        "results": results
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the VegGo API hot paths in-process")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="Unrecorded requests before each scenario")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--agents", type=int, default=200)
+    parser.add_argument("--orders-per-user", type=int, default=5)
+    parser.add_argument("--mongo-uri", help="Benchmark against this mongod (database veggo_bench is dropped)")
+    parser.add_argument("--maps-latency-ms", type=float, default=50)
+    parser.add_argument("--smtp-latency-ms", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON output path (default: benchmarks/results/<timestamp>-<commit>.json)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmarks(args))
+
+    output = args.output
+    if not output:
+        commit = report["meta"]["git"]["commit"] or "nogit"
+        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(ROOT, "benchmarks", "results", f"{stamp}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to {output}")
@@ -0,0 +1,414 @@
+"""
+Fleet and Shopper Workload Simulator
+Drives the API with virtual shoppers and delivery agents over a compressed
+trading day to find where a deployment saturates.
+
+- Shoppers arrive following an arrival curve with lunch and dinner peaks,
+  browse products, place (and sometimes cancel) orders and poll tracking.
+- Agents ping update-location while moving along straight-line routes
+  (agent -> store -> customer) and advance order statuses.
+- A dispatcher assigns each order to the nearest idle agent through the
+  admin API.
+
+Every window (default 10 s) reports offered sessions, throughput, p95/p99
+latency and error rate; the first window over the latency SLO or error
+budget is reported as the saturation point.
+
+Usage:
+    # In-process (one app instance, like a single uvicorn worker)
+    python benchmarks/simulator.py --agents 1000 --users 5000 --duration 300
+
+    # Against a running deployment (seeds through MongoDB, signs tokens with SECRET_KEY)
+    SECRET_KEY=... python benchmarks/simulator.py --base-url http://localhost:8000 \\
+        --mongo-uri mongodb://localhost:27017 --database veggo_db
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List
+
+from harness import ROOT, Dataset, bench_client, percentile, seed
+import httpx
+from app.auth import create_access_token, hash_password
+from app.config import settings
+from app.geo import haversine_meters
+
+class WindowRecorder:
+    """Latency and status samples bucketed into fixed wall-clock windows"""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self.started = time.perf_counter()
+        self.windows = defaultdict(lambda: {
+            "latencies": [], "statuses": Counter(), "groups": defaultdict(list),
+            "sessions": 0, "orders": 0, "active_shoppers": 0, "busy_agents": 0, "sim_hour": None
+        })
+
+    def current(self) -> dict:
+        return self.windows[int((time.perf_counter() - self.started) // self.window_seconds)]
+
+    def record(self, group: str, latency: float, status: int):
+        window = self.current()
+        window["latencies"].append(latency)
+        window["statuses"][status] += 1
+        window["groups"][group].append(latency)
+
+    def summarize(self, slo_p95_ms: float, max_error_rate: float) -> dict:
+        rows = []
+        for index in sorted(self.windows):
+            window = self.windows[index]
+            latencies = sorted(latency * 1000 for latency in window["latencies"])
+            total = len(latencies)
+            errors = sum(count for code, count in window["statuses"].items() if code >= 500 or code in (0, 429))
+            rows.append({
+                "window": index,
+                "sim_hour": window["sim_hour"],
+                "sessions_started": window["sessions"],
+                "orders_placed": window["orders"],
+                "active_shoppers": window["active_shoppers"],
+                "busy_agents": window["busy_agents"],
+                "throughput_rps": round(total / self.window_seconds, 1),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "status_counts": {str(code): count for code, count in sorted(window["statuses"].items())},
+                "p95_ms_by_group": {
+                    group: round(percentile(sorted(v * 1000 for v in values), 95), 2)
+                    for group, values in sorted(window["groups"].items())
+                }
+            })
+
+        saturation = next(
+            (row for row in rows if row["p95_ms"] > slo_p95_ms or row["error_rate"] > max_error_rate),
+            None
+        )
+        healthy = rows[:rows.index(saturation)] if saturation else rows
+        return {
+            "windows": rows,
+            "saturation": saturation,
+            "max_healthy_throughput_rps": max((row["throughput_rps"] for row in healthy), default=0.0),
+            "max_healthy_active_shoppers": max((row["active_shoppers"] for row in healthy), default=0)
+        }
+
+class Simulation:
+    def __init__(self, client: httpx.AsyncClient, data: Dataset, admin_token: str, args):
+        self.client = client
+        self.data = data
+        self.admin_headers = {"Authorization": f"Bearer {admin_token}"}
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.recorder = WindowRecorder(args.window)
+        self.sim_hours_per_second = (args.end_hour - args.start_hour) / args.duration
+        self.pending_orders: asyncio.Queue = asyncio.Queue()
+        self.idle_agents = {agent["id"]: agent for agent in data.agents}
+        self.agent_jobs = {agent["id"]: asyncio.Queue() for agent in data.agents}
+        self.cancelled = set()
+        self.delivered = set()
+        self.active_shoppers = 0
+        self.started = 0.0
+
+    # Clock and arrival curve
+
+    def sim_hour(self) -> float:
+        return self.args.start_hour + (time.perf_counter() - self.started) * self.sim_hours_per_second
+
+    def arrival_weight(self, hour: float) -> float:
+        """Relative demand: a baseline plus Gaussian lunch and dinner peaks (max 1.0)"""
+        args = self.args
+        weight = (args.base_weight
+                  + args.lunch_weight * math.exp(-((hour - args.lunch_hour) ** 2) / (2 * 1.0 ** 2))
+                  + args.dinner_weight * math.exp(-((hour - args.dinner_hour) ** 2) / (2 * 1.5 ** 2)))
+        peak = args.base_weight + max(args.lunch_weight, args.dinner_weight)
+        return min(1.0, weight / peak)
+
+    # HTTP
+
+    async def request(self, group: str, method: str, path: str, body=None, headers=None):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, json=body, headers=headers)
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, 0
+        self.recorder.record(group, time.perf_counter() - started, status)
+        return response
+
+    # Virtual users
+
+    async def shopper(self, user: dict):
+        rng = random.Random(self.rng.random())
+        headers = {"Authorization": f"Bearer {user['token']}"}
+        self.active_shoppers += 1
+        try:
+            for _ in range(rng.randint(1, 3)):
+                await self.request("browse", "GET", "/api/products")
+                await asyncio.sleep(rng.uniform(0.5, 2.0))
+
+            if rng.random() >= self.args.order_probability:
+                return
+
+            items = [
+                {"product_id": product_id, "product_name": "Product", "quantity": rng.randint(1, 3),
+                 "unit": "Kg", "price_per_unit": 0, "total_price": 0}
+                for product_id in rng.sample(self.data.product_ids, rng.randint(1, min(4, len(self.data.product_ids))))
+            ]
+            response = await self.request("order_create", "POST", "/api/order/create", {
+                "items": items,
+                "delivery_address": "Simulated Street",
+                "lat": user["lat"],
+                "lng": user["lng"],
+                "phone": "9000000000"
+            }, {**headers, "Idempotency-Key": uuid.uuid4().hex})
+            if response is None or response.status_code != 200:
+                return
+
+            order_id = response.json()["order_id"]
+            self.recorder.current()["orders"] += 1
+
+            if rng.random() < self.args.cancel_probability:
+                await asyncio.sleep(rng.uniform(0.2, 1.0))
+                self.cancelled.add(order_id)
+                await self.request("order_cancel", "PUT", f"/api/order/cancel/{order_id}", None, headers)
+                return
+
+            await self.pending_orders.put({"id": order_id, "lat": user["lat"], "lng": user["lng"]})
+
+            # Poll tracking until delivered
+            for _ in range(self.args.max_polls):
+                await asyncio.sleep(self.args.poll_interval)
+                await self.request("order_track", "GET", f"/api/order/{order_id}", None, headers)
+                if order_id in self.delivered:
+                    break
+        finally:
+            self.active_shoppers -= 1
+
+    async def arrivals(self):
+        """Poisson session arrivals following the arrival curve"""
+        while True:
+            rate = self.args.peak_sessions_per_sec * self.arrival_weight(self.sim_hour())
+            await asyncio.sleep(self.rng.expovariate(rate) if rate > 0 else 1.0)
+            window = self.recorder.current()
+            window["sessions"] += 1
+            window["sim_hour"] = round(self.sim_hour(), 2)
+            window["active_shoppers"] = max(window["active_shoppers"], self.active_shoppers)
+            window["busy_agents"] = max(window["busy_agents"], len(self.data.agents) - len(self.idle_agents))
+            asyncio.create_task(self.shopper(self.rng.choice(self.data.users)))
+
+    async def dispatcher(self):
+        """Assign each order to the nearest idle agent"""
+        while True:
+            order = await self.pending_orders.get()
+            if order["id"] in self.cancelled:
+                continue
+            while not self.idle_agents:
+                await asyncio.sleep(0.5)
+
+            agent = min(
+                self.idle_agents.values(),
+                key=lambda a: haversine_meters(a["lat"], a["lng"], settings.STORE_LAT, settings.STORE_LNG)
+            )
+            response = await self.request(
+                "assign_agent", "PUT", f"/api/admin/order/assign-agent/{order['id']}",
+                {"agent_id": agent["id"]}, self.admin_headers
+            )
+            if response is not None and response.status_code == 200:
+                del self.idle_agents[agent["id"]]
+                await self.agent_jobs[agent["id"]].put(order)
+
+    async def move(self, agent: dict, headers: dict, lat: float, lng: float):
+        """Ping along a straight line to (lat, lng) at the configured speed"""
+        step_m = self.args.agent_speed_kmh / 3.6 * self.args.ping_interval * self.sim_hours_per_second * 3600
+        while True:
+            remaining = haversine_meters(agent["lat"], agent["lng"], lat, lng)
+            fraction = 1.0 if remaining <= step_m else step_m / remaining
+            agent["lat"] += (lat - agent["lat"]) * fraction
+            agent["lng"] += (lng - agent["lng"]) * fraction
+            await self.request("location_ping", "PUT", "/api/agent/update-location",
+                               {"lat": agent["lat"], "lng": agent["lng"]}, headers)
+            if fraction >= 1.0:
+                return
+            await asyncio.sleep(self.args.ping_interval)
+
+    async def agent(self, agent: dict):
+        rng = random.Random(self.rng.random())
+        headers = {"Authorization": f"Bearer {agent['token']}"}
+        jobs = self.agent_jobs[agent["id"]]
+        await asyncio.sleep(rng.uniform(0, self.args.ping_interval))
+
+        while True:
+            try:
+                order = await asyncio.wait_for(jobs.get(), self.args.ping_interval)
+            except asyncio.TimeoutError:
+                # Idle: drift a little and ping
+                agent["lat"] += rng.uniform(-0.0003, 0.0003)
+                agent["lng"] += rng.uniform(-0.0003, 0.0003)
+                await self.request("location_ping", "PUT", "/api/agent/update-location",
+                                   {"lat": agent["lat"], "lng": agent["lng"]}, headers)
+                continue
+
+            status_path = f"/api/agent/order-status/{order['id']}"
+            await self.move(agent, headers, settings.STORE_LAT, settings.STORE_LNG)
+            await self.request("order_status", "PUT", status_path, {"status": "picked_up"}, headers)
+            await self.request("order_status", "PUT", status_path, {"status": "in_transit"}, headers)
+            await self.move(agent, headers, order["lat"], order["lng"])
+            await self.request("order_status", "PUT", status_path, {"status": "delivered"}, headers)
+            self.delivered.add(order["id"])
+            self.idle_agents[agent["id"]] = agent
+
+    async def run(self) -> dict:
+        self.started = time.perf_counter()
+        self.recorder.started = self.started
+        tasks = [asyncio.create_task(self.agent(agent)) for agent in self.data.agents]
+        tasks.append(asyncio.create_task(self.dispatcher()))
+        tasks.append(asyncio.create_task(self.arrivals()))
+
+        next_report = self.args.window
+        while time.perf_counter() - self.started < self.args.duration:
+            await asyncio.sleep(1)
+            if time.perf_counter() - self.started >= next_report:
+                next_report += self.args.window
+                window = self.recorder.windows[int((time.perf_counter() - self.started) // self.args.window) - 1]
+                latencies = sorted(latency * 1000 for latency in window["latencies"])
+                print(f"⏱️  sim {self.sim_hour():5.2f}h  {len(latencies) / self.args.window:7.1f} req/s  "
+                      f"p95 {percentile(latencies, 95):7.1f} ms  shoppers {self.active_shoppers:5d}  "
+                      f"busy agents {len(self.data.agents) - len(self.idle_agents):5d}")
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Drop the partial window of requests that finished after the deadline
+        for index in [i for i in self.recorder.windows if i * self.args.window >= self.args.duration]:
+            del self.recorder.windows[index]
+        return self.recorder.summarize(self.args.slo_p95_ms, self.args.max_error_rate)
+
+async def create_admin(db, tag: str) -> str:
+    email = f"{tag}-admin@bench.veggo.com"
+    await db.admins.update_one(
+        {"email": email},
+        {"$setOnInsert": {"name": "Simulator", "email": email, "password": hash_password(uuid.uuid4().hex),
+                          "role": "admin", "created_at": datetime.utcnow()}},
+        upsert=True
+    )
+    return create_access_token({"sub": email, "type": "admin"})
+
+async def available_product_ids(db, limit: int) -> List[str]:
+    cursor = db.products.find({"isAvailable": True}, {"_id": 1}).limit(limit)
+    product_ids = [str(product["_id"]) async for product in cursor]
+    if not product_ids:
+        raise SystemExit("--base-url needs available products in the target database")
+    return product_ids
+
+@asynccontextmanager
+async def simulation_target(args):
+    """Yields: (client, database) for in-process or remote runs"""
+    if not args.base_url:
+        async with bench_client(args.mongo_uri, args.maps_latency_ms, args.smtp_latency_ms) as target:
+            yield target
+        return
+
+    if not args.mongo_uri:
+        raise SystemExit("--base-url needs --mongo-uri (and --database) to seed virtual users")
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+    mongo = AsyncIOMotorClient(args.mongo_uri)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30.0) as client:
+        yield client, mongo[args.database]
+    mongo.close()
+
+async def simulate(args) -> dict:
+    tag = f"sim{uuid.uuid4().hex[:6]}"
+    async with simulation_target(args) as (client, db):
+        print(f"🌱 Seeding {args.users} shoppers and {args.agents} agents ({tag})...")
+        if args.base_url:
+            # Never add products to a live catalogue: order what it already sells
+            data = await seed(db, 0, args.users, args.agents, 0, args.seed, tag)
+            data.product_ids = await available_product_ids(db, args.products)
+        else:
+            data = await seed(db, args.products, args.users, args.agents, 0, args.seed, tag)
+        admin_token = await create_admin(db, tag)
+
+        print(f"🚦 Simulating {args.start_hour}:00-{args.end_hour}:00 in {args.duration:.0f} s")
+        summary = await Simulation(client, data, admin_token, args).run()
+
+    saturation = summary["saturation"]
+    if saturation:
+        print(f"\n🔥 Saturated at sim {saturation['sim_hour']}h: {saturation['throughput_rps']} req/s, "
+              f"p95 {saturation['p95_ms']} ms, error rate {saturation['error_rate']:.2%}, "
+              f"{saturation['active_shoppers']} active shoppers")
+    else:
+        print("\n✅ No saturation within the SLO")
+    print(f"📈 Max healthy throughput: {summary['max_healthy_throughput_rps']} req/s "
+          f"({summary['max_healthy_active_shoppers']} concurrent shoppers)")
+
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "target": args.base_url or ("in-process, mongod" if args.mongo_uri else "in-process, mongomock-motor"),
+            "args": {key: value for key, value in vars(args).items() if key != "mongo_uri"},
+        },
+        **summary
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate shoppers and delivery agents to find saturation points")
+    target = parser.add_argument_group("target")
+    target.add_argument("--base-url", help="Drive a running deployment instead of the in-process app")
+    target.add_argument("--mongo-uri", help="mongod used for seeding (and by the in-process app)")
+    target.add_argument("--database", default=settings.DATABASE_NAME, help="Database of the deployment (--base-url)")
+    target.add_argument("--max-connections", type=int, default=500)
+    target.add_argument("--maps-latency-ms", type=float, default=80)
+    target.add_argument("--smtp-latency-ms", type=float, default=30)
+
+    population = parser.add_argument_group("population")
+    population.add_argument("--agents", type=int, default=500)
+    population.add_argument("--users", type=int, default=5000)
+    population.add_argument("--products", type=int, default=200,
+                            help="Products to seed (in-process) or to order from (--base-url)")
+
+    day = parser.add_argument_group("arrival curve")
+    day.add_argument("--duration", type=float, default=300, help="Real seconds for the simulated day")
+    day.add_argument("--start-hour", type=float, default=10)
+    day.add_argument("--end-hour", type=float, default=22)
+    day.add_argument("--peak-sessions-per-sec", type=float, default=20, help="Shopper arrivals at the busiest hour")
+    day.add_argument("--base-weight", type=float, default=0.2)
+    day.add_argument("--lunch-hour", type=float, default=13)
+    day.add_argument("--lunch-weight", type=float, default=0.7)
+    day.add_argument("--dinner-hour", type=float, default=20)
+    day.add_argument("--dinner-weight", type=float, default=1.0)
+
+    behaviour = parser.add_argument_group("behaviour")
+    behaviour.add_argument("--order-probability", type=float, default=0.35)
+    behaviour.add_argument("--cancel-probability", type=float, default=0.05)
+    behaviour.add_argument("--poll-interval", type=float, default=3, help="Seconds between tracking polls")
+    behaviour.add_argument("--max-polls", type=int, default=20)
+    behaviour.add_argument("--ping-interval", type=float, default=4, help="Seconds between agent location pings")
+    behaviour.add_argument("--agent-speed-kmh", type=float, default=20)
+
+    report = parser.add_argument_group("report")
+    report.add_argument("--window", type=float, default=10, help="Report window in seconds")
+    report.add_argument("--slo-p95-ms", type=float, default=500)
+    report.add_argument("--max-error-rate", type=float, default=0.01)
+    report.add_argument("--seed", type=int, default=42)
+    report.add_argument("--output", help="JSON output path (default: benchmarks/results/simulation-<timestamp>.json)")
+    args = parser.parse_args()
+
+    result = asyncio.run(simulate(args))
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"simulation-{datetime.utcnow():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2, default=str)
+    print(f"\n✅ Report written to {output}")
@@ -0,0 +1,220 @@
+"""
+Index Advisor
+Reads the query shapes recorded by the API (app/query_monitor.py), explains
+each one against the live data and suggests compound indexes ordered
+Equality -> Sort -> Range.
+
+Usage:
+    python index_advisor.py                 # report only
+    python index_advisor.py --apply         # also create the suggested indexes
+    python index_advisor.py --min-count 50 --limit 10
+"""
+
+import argparse
+import asyncio
+import json
+from datetime import datetime
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import settings
+from app.query_monitor import QUERY_SHAPES_COLLECTION
+
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte", "$ne", "$nin", "$exists", "$regex", "$not", "$type"}
+
+# Examined/returned ratio above which an index scan is still considered poor
+EXAMINED_RATIO_THRESHOLD = 10
+
+def plan_stages(plan: dict) -> list:
+    """Flatten a winning plan into its stage names (outermost first)"""
+    stages = []
+    while plan:
+        stages.append(plan.get("stage"))
+        if "inputStage" in plan:
+            plan = plan["inputStage"]
+        elif plan.get("inputStages"):
+            for child in plan["inputStages"]:
+                stages.extend(plan_stages(child))
+            break
+        else:
+            break
+    return stages
+
+def find_index_name(plan: dict):
+    if not plan:
+        return None
+    if plan.get("stage") == "IXSCAN":
+        return plan.get("indexName")
+    for child in [plan.get("inputStage")] + list(plan.get("inputStages", [])):
+        name = find_index_name(child)
+        if name:
+            return name
+    return None
+
+def summarize_explain(explain: dict) -> dict:
+    planner = explain.get("queryPlanner", {})
+    winning_plan = planner.get("winningPlan", {})
+    # Slot-based engine nests the classic plan under queryPlan
+    winning_plan = winning_plan.get("queryPlan", winning_plan)
+    stats = explain.get("executionStats", {})
+    stages = plan_stages(winning_plan)
+    return {
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "in_memory_sort": "SORT" in stages,
+        "index": find_index_name(winning_plan),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "time_ms": stats.get("executionTimeMillis")
+    }
+
+def classify_fields(filter_shape: dict, has_sort: bool):
+    """
+    Split filter fields into equality and range predicates
+    Returns: (equality, range, unsupported) - unsupported is True for $or/$nor/$expr
+    """
+    equality, ranges, unsupported = [], [], False
+    for field, condition in filter_shape.items():
+        if field == "$and":
+            for clause in condition:
+                sub_equality, sub_ranges, sub_unsupported = classify_fields(clause, has_sort)
+                equality += [f for f in sub_equality if f not in equality]
+                ranges += [f for f in sub_ranges if f not in ranges]
+                unsupported = unsupported or sub_unsupported
+        elif field.startswith("$"):
+            unsupported = True
+        elif isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            operators = set(condition)
+            if operators & RANGE_OPERATORS or ("$in" in operators and has_sort):
+                # $in followed by a sort behaves like a range (blocking sort otherwise)
+                ranges.append(field)
+            else:
+                equality.append(field)
+        else:
+            equality.append(field)
+    return equality, ranges, unsupported
+
+def suggest_index(filter_shape: dict, sort_shape):
+    """Compound index keys following the Equality, Sort, Range rule"""
+    equality, ranges, unsupported = classify_fields(filter_shape, bool(sort_shape))
+    if unsupported:
+        return None
+
+    keys = [(field, 1) for field in equality]
+    used = set(equality)
+    for field, direction in (sort_shape or {}).items():
+        if field not in used and direction in (1, -1):
+            keys.append((field, direction))
+            used.add(field)
+    keys += [(field, 1) for field in ranges if field not in used]
+
+    if not keys or keys == [("_id", 1)]:
+        return None
+    return keys
+
+def is_covered(keys: list, existing_indexes: list) -> bool:
+    """True when an existing index starts with the suggested keys"""
+    for index in existing_indexes:
+        index_keys = list(index["key"].items())
+        if index_keys[:len(keys)] == keys:
+            return True
+    return False
+
+def needs_index(summary: dict) -> bool:
+    if summary["collscan"] or summary["in_memory_sort"]:
+        return True
+    returned = summary["returned"] or 0
+    examined = summary["docs_examined"] or 0
+    return examined > max(returned, 1) * EXAMINED_RATIO_THRESHOLD
+
+async def explain_shape(db, shape: dict) -> dict:
+    """
+    Explain a shape's sample query as a find: real fields, operators,
+    booleans and $exists/$type, stand-ins for every other value. The plan
+    follows the shape; the document counts are those of the stand-ins.
+    """
+    command = {"find": shape["collection"], "filter": json_util.loads(shape["sample_filter"])}
+    if shape.get("sample_sort"):
+        command["sort"] = shape["sample_sort"]
+    explain = await db.command({"explain": command, "verbosity": "executionStats"})
+    return summarize_explain(explain)
+
+async def run_advisor(min_count: int, limit: int, apply: bool):
+    client = AsyncIOMotorClient(settings.MONGODB_URI)
+    db = client[settings.DATABASE_NAME]
+
+    print("🔎 Analyzing recorded query shapes...")
+
+    shapes = await db[QUERY_SHAPES_COLLECTION].find(
+        {"count": {"$gte": min_count}}
+    ).sort("total_ms", -1).to_list(limit)
+
+    if not shapes:
+        print("ℹ️  No query shapes recorded yet (is QUERY_MONITOR_ENABLED set?)")
+        client.close()
+        return
+
+    existing_indexes = {}
+    suggestions = {}
+
+    for shape in shapes:
+        collection = shape["collection"]
+        filter_shape = json.loads(shape["filter"])
+        avg_ms = shape["total_ms"] / shape["count"]
+
+        print(f"\n📄 {collection}.{shape['operation']} {shape['filter']} sort={shape.get('sort')}")
+        print(f"   {shape['count']} calls, avg {avg_ms:.1f} ms, max {shape['max_ms']:.1f} ms")
+
+        try:
+            summary = await explain_shape(db, shape)
+        except Exception as e:
+            print(f"   ⚠️  Explain failed: {e}")
+            continue
+
+        await db[QUERY_SHAPES_COLLECTION].update_one(
+            {"_id": shape["_id"]},
+            {"$set": {"explain": summary, "explained_at": datetime.utcnow()}}
+        )
+
+        plan = " <- ".join(stage for stage in summary["stages"] if stage)
+        print(f"   Plan: {plan} (index: {summary['index'] or '-'})")
+        print(f"   Sample query examined {summary['docs_examined']} docs / {summary['keys_examined']} keys, "
+              f"returned {summary['returned']}")
+
+        if not needs_index(summary):
+            print("   ✅ Served efficiently")
+            continue
+
+        keys = suggest_index(filter_shape, shape.get("sort"))
+        if not keys:
+            print("   ⚠️  No single compound index fits this shape ($or / $expr)")
+            continue
+
+        if collection not in existing_indexes:
+            existing_indexes[collection] = await db[collection].list_indexes().to_list(None)
+        if is_covered(keys, existing_indexes[collection]):
+            print(f"   ℹ️  Index on {keys} exists but was not chosen by the planner")
+            continue
+
+        print(f"   💡 Suggested index: {keys}")
+        suggestions.setdefault((collection, tuple(keys)), shape["count"])
+
+    if suggestions and apply:
+        print("\n📑 Creating suggested indexes...")
+        for collection, keys in suggestions:
+            name = await db[collection].create_index(list(keys))
+            print(f"✅ {collection}: {name}")
+    elif suggestions:
+        print(f"\n💡 {len(suggestions)} index(es) suggested. Re-run with --apply to create them.")
+    else:
+        print("\n✨ No missing indexes found")
+
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Suggest MongoDB indexes from recorded query shapes")
+    parser.add_argument("--min-count", type=int, default=10, help="Ignore shapes seen fewer times")
+    parser.add_argument("--limit", type=int, default=20, help="Analyze the N most expensive shapes")
+    parser.add_argument("--apply", action="store_true", help="Create the suggested indexes")
+    args = parser.parse_args()
+    asyncio.run(run_advisor(args.min_count, args.limit, args.apply))
@@ -38,10 +38,13 @@ async def init_database():
     # Users
     await db.users.create_index("email", unique=True)
     await db.users.create_index("username")
+    # Only legacy users still carry a stored verification token
+    await db.users.create_index("verification_token", sparse=True)
     
     # Agents
     await db.agents.create_index("email", unique=True)
     await db.agents.create_index("approved")
+    await db.agents.create_index("current_location.updated_at")
     
     # Products
     await db.products.create_index("category")
@@ -54,6 +57,27 @@ async def init_database():
     await db.orders.create_index("order_number", unique=True)
     await db.orders.create_index("created_at")
     
+    # Stores
+    await db.stores.create_index("isActive")
+    
+    # Delivery zones
+    await db.delivery_zones.create_index("isActive")
+    
+    # Idempotency keys expire on their own
+    await db.idempotency_keys.create_index(
+        "created_at", expireAfterSeconds=settings.IDEMPOTENCY_TTL_SECONDS
+    )
+    
+    # Shared rate limit windows (RATE_LIMIT_BACKEND=mongo)
+    await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+    
+    # Revoked access tokens are kept until they would have expired
+    await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.revoked_tokens.create_index("revoked_at")
+    
+    # Held order status emails, sent by due time
+    await db.notification_holds.create_index("due_at")
+    
     print("✅ Indexes created")
     
     # Insert sample products (optional)
@@ -1,16 +1,53 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from app.database import connect_db, close_db
-from app.routes import user_routes, admin_routes, agent_routes, product_routes, order_routes
+from app.database import connect_db, close_db, get_database
+from app.idempotency import IdempotencyMiddleware
+from app.rate_limit import AdmissionControlMiddleware, load_monitor
+from app.revocation import revocation_list
+from app.query_monitor import query_recorder
+from app.metrics import MetricsMiddleware, render_metrics, mark_worker_dead
+from app.tracing import TracingMiddleware, tracer
+from app.stall_detector import StallDetectorMiddleware, stall_detector
+from app.profiler import ProfilerMiddleware
+from app.warmup import warmup
+from app.events import event_bus
+from app.order_subscribers import register_order_subscribers
+from app.notifications import status_notifier
+from app.config import settings
+from prometheus_client import CONTENT_TYPE_LATEST
+from app.lazy_router import LazyRouterApp
+from app.routes import user_routes, agent_routes, product_routes, order_routes
+
+# Emails, stats, catalog refreshes and tracking run after order requests return
+register_order_subscribers(event_bus)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     await connect_db()
+    tracer.start()
+    load_monitor.start()
+    revocation_list.start()
+    query_recorder.start(get_database())
+    if settings.STALL_DETECTOR_ENABLED:
+        stall_detector.start()
+    event_bus.start()
+    status_notifier.start()
+    warmup.start(app)
     yield
     # Shutdown
+    await warmup.stop()
+    await event_bus.stop()
+    await status_notifier.stop()
+    await stall_detector.stop()
+    await query_recorder.stop(get_database())
+    await load_monitor.stop()
+    await revocation_list.stop()
     await close_db()
+    tracer.shutdown()
+    mark_worker_dead()
 
 app = FastAPI(
     title="VegGo API",
@@ -19,6 +56,24 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Replay stored responses for retried order requests (Idempotency-Key header)
+app.add_middleware(IdempotencyMiddleware)
+
+# Per-principal rate limits and load shedding for expensive routes
+app.add_middleware(AdmissionControlMiddleware)
+
+# Mark requests carrying X-Profile for marker-mode CPU profiles
+app.add_middleware(ProfilerMiddleware)
+
+# Remember which route each request task serves, for event-loop stall reports
+app.add_middleware(StallDetectorMiddleware)
+
+# Per-route request and dependency metrics (exposed at /metrics)
+app.add_middleware(MetricsMiddleware)
+
+# Request tracing with spans for Mongo, Maps and SMTP calls (sampled)
+app.add_middleware(TracingMiddleware)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -30,7 +85,11 @@ app.add_middleware(
 
 # Include Routes
 app.include_router(user_routes.router, prefix="/api/user", tags=["Users"])
-app.include_router(admin_routes.router, prefix="/api/admin", tags=["Admin"])
+if settings.LAZY_ROUTERS:
+    app.mount("/api/admin", LazyRouterApp("app.routes.admin_routes"))
+else:
+    from app.routes import admin_routes
+    app.include_router(admin_routes.router, prefix="/api/admin", tags=["Admin"])
 app.include_router(agent_routes.router, prefix="/api/agent", tags=["Agents"])
 app.include_router(product_routes.router, prefix="/api", tags=["Products"])
 app.include_router(order_routes.router, prefix="/api", tags=["Orders"])
@@ -46,3 +105,12 @@ async def root():
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Ready once the startup warm-up has finished (503 until then)"""
+    return JSONResponse(warmup.status(), status_code=200 if warmup.ready else 503)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(render_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST})
@@ -0,0 +1,14 @@
+import os
+import sys
+
+# app.config needs these at import; the tests below never connect anywhere
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("SMTP_HOST", "localhost")
+os.environ.setdefault("SMTP_PORT", "25")
+os.environ.setdefault("SMTP_USER", "test")
+os.environ.setdefault("SMTP_PASSWORD", "test")
+os.environ.setdefault("FROM_EMAIL", "test@veggo.com")
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
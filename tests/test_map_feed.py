@@ -0,0 +1,33 @@
+import time
+from app.fleet_store import FleetStore, STATUS_BUSY
+from app import map_feed
+
+VIEWPORT = (28.5, 77.1, 28.7, 77.3)
+
+def snapshot(since):
+    return map_feed.build_fleet_snapshot(*VIEWPORT, zoom=15, since=since, precision=5,
+                                         cluster_max_zoom=13, busy_status=STATUS_BUSY)
+
+def test_removed_agent_is_reported_in_delta(monkeypatch):
+    store = FleetStore()
+    monkeypatch.setattr(map_feed, "fleet_store", store)
+    store.upsert("a" * 24, 28.6, 77.2)
+    store.upsert("b" * 24, 28.61, 77.21)
+    since = snapshot(None)["server_time"]
+
+    store.remove("a" * 24)
+    body = snapshot(since)
+
+    assert body["delta"] is True
+    assert body["removed"] == ["a" * 24]
+
+def test_stale_agent_is_evicted_and_reported(monkeypatch):
+    store = FleetStore(stale_seconds=60)
+    monkeypatch.setattr(map_feed, "fleet_store", store)
+    store.upsert("a" * 24, 28.6, 77.2, timestamp=time.time() - 120)
+    store.upsert("b" * 24, 28.61, 77.21)
+    since = time.time()
+
+    assert store.evict_stale() == 1
+    assert store.get("a" * 24) is None
+    assert snapshot(since)["removed"] == ["a" * 24]